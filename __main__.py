@@ -0,0 +1,13 @@
+"""Runs the bot: ``python /path/to/megabot-dir`` (``python .`` from inside it).
+
+Post-processing starts its extraction workers with "spawn", and a spawned
+worker re-imports the parent's main script unless that is a ``__main__``
+module like this one. Starting the bot from here keeps the workers down
+to importing postprocess, instead of each one setting up a whole bot
+(Telegram, SDK, journal and caches) as ``python megabot.py`` would.
+"""
+import asyncio
+
+import megabot
+
+asyncio.run(megabot.main())
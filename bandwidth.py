@@ -0,0 +1,190 @@
+import logging
+import math
+import re
+
+from selection import UNITS
+
+RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)([KMGT]?)(?:B|B/s|/s)?$', re.I)
+UNLIMITED = math.inf
+
+
+def parse_rate(text):
+    """Parses '10M', '512K' or '1.5G' (bytes per second); 'off', 'none' and '0' mean no limit (0)."""
+    text = text.strip()
+    if text.lower() in ("off", "none", "0"):
+        return 0
+    m = RATE_RE.match(text)
+    if m is None:
+        raise ValueError(f"'{text}' is not a speed (e.g. 10M, 512K)")
+    return int(float(m.group(1)) * UNITS[m.group(2).upper()])
+
+
+def fair_shares(capacity, demands):
+    """Max-min fair split of ``capacity`` over {key: demand}.
+
+    Nobody gets more than it asks for; what the modest ones leave over is
+    shared equally by the rest. Demands and capacity may be UNLIMITED.
+    """
+    shares = {}
+    left = capacity
+    pending = sorted(demands.items(), key=lambda item: item[1])
+    for k, (key, demand) in enumerate(pending):
+        share = min(demand, left / (len(pending) - k))
+        shares[key] = share
+        if share != UNLIMITED:
+            left -= share
+    return shares
+
+
+def size_connections(remaining, max_connections):
+    """Connections worth opening for ``remaining`` bytes: 1 up to 4 MB, one more per doubling."""
+    if remaining <= 4 * 1024 ** 2:
+        return 1
+    return max(1, min(max_connections, 1 + int(math.log2(remaining / (4 * 1024 ** 2)))))
+
+
+class ConnectionTuner:
+    """Hill-climbs the connections per transfer of one MegaApi worker.
+
+    The ceiling comes from the bytes left (small files gain nothing from
+    extra connections, each costs a TLS handshake). Below it one connection
+    is added at a time and kept only if the observed speed went up by at
+    least ``min_gain``; otherwise it is taken back and the tuner holds for
+    ``hold`` rounds before probing again.
+    """
+    __slots__ = ("connections", "min_gain", "hold", "_last_speed", "_probing", "_hold")
+
+    def __init__(self, connections=4, min_gain=0.05, hold=6):
+        self.connections = connections
+        self.min_gain = min_gain
+        self.hold = hold
+        self._last_speed = 0
+        self._probing = False
+        self._hold = 0
+
+    def update(self, remaining, speed, max_connections, capped=False):
+        """Returns the connections to use given the bytes left and the current speed.
+
+        ``capped`` means a speed limit, not the connections, holds the
+        worker back, so there is nothing to gain from probing.
+        """
+        ceiling = size_connections(remaining, max_connections)
+        if self._probing:
+            self._probing = False
+            if speed < self._last_speed * (1 + self.min_gain):
+                self.connections -= 1
+                self._hold = self.hold
+        elif self._hold:
+            self._hold -= 1
+        elif not capped and self.connections < ceiling:
+            self.connections += 1
+            self._probing = True
+        self.connections = max(1, min(self.connections, ceiling))
+        self._last_speed = speed
+        return self.connections
+
+
+class _Worker:
+    __slots__ = ("tuner", "speed_limit", "connections", "fresh")
+
+    def __init__(self, connections):
+        self.tuner = ConnectionTuner(connections)
+        self.speed_limit = None  # bytes/s last applied, 0 for none; None until applied
+        self.connections = None
+        self.fresh = True  # just started or resumed; its speed says nothing yet
+
+
+class BandwidthManager:
+    """Speed limits and connection counts for every session's MegaApi worker.
+
+    The SDK only caps a whole MegaApi, and every session leases its own, so
+    limits are applied per session. Each ``rebalance`` splits the global
+    limit max-min fairly between chats, and each chat's share (bounded by
+    its own limit) between its sessions. A session running well below its
+    cap only keeps what it uses plus ``headroom``; one that is at its cap
+    asks for more. Connections per transfer are tuned per worker by a
+    ConnectionTuner, unless an admin fixed them. ``total_connections`` is
+    shared out over all running transfers, but every transfer keeps at
+    least one connection, so with more transfers than that the total is
+    exceeded.
+    """
+    def __init__(self, global_limit=0, chat_limit=0, max_connections=6, total_connections=64,
+                 default_connections=4, headroom=1.5, min_rate=256 * 1024):
+        self.global_limit = global_limit  # bytes/s, 0 for none
+        self.chat_limit = chat_limit  # default for every chat, 0 for none
+        self.chat_limits = {}  # chat_id -> limit set by an admin, overriding chat_limit
+        self.max_connections = max_connections
+        self.total_connections = total_connections
+        self.default_connections = default_connections
+        self.fixed_connections = None  # set by an admin; None tunes automatically
+        self.headroom = headroom
+        self.min_rate = min_rate
+        self._workers = {}  # session id -> _Worker
+
+    def limit_for_chat(self, chat_id):
+        return self.chat_limits.get(chat_id, self.chat_limit)
+
+    def worker(self, session):
+        """The limits last applied to ``session``, or None if it hasn't been balanced yet."""
+        return self._workers.get(session.id)
+
+    def _demand(self, worker, speed):
+        if worker.fresh or not worker.speed_limit or speed >= 0.9 * worker.speed_limit:
+            return UNLIMITED
+        return max(self.min_rate, speed * self.headroom)
+
+    def rebalance(self, sessions):
+        """Recomputes and applies every session's speed limit and connections. Call on the event loop."""
+        running = {}
+        seen = set()
+        for session in sessions:
+            seen.add(session.id)
+            worker = self._workers.get(session.id)
+            if worker is None:
+                worker = self._workers[session.id] = _Worker(self.default_connections)
+            transfers = [dl for dl in session.current_dls if not dl.is_finished]
+            if session.paused or not transfers:
+                worker.fresh = True
+                continue
+            running[session.id] = (session, worker, transfers)
+        for session_id in [k for k in self._workers if k not in seen]:
+            del self._workers[session_id]
+        if not running:
+            return
+
+        speeds = {k: sum(dl.smooth_speed for dl in t) for k, (_, _, t) in running.items()}
+        chats = {}
+        for k, (session, worker, _) in running.items():
+            chats.setdefault(session.chat_id, {})[k] = self._demand(worker, speeds[k])
+
+        def capacity(limit):
+            return limit if limit > 0 else UNLIMITED
+
+        chat_demands = {}
+        for chat_id, demands in chats.items():
+            wanted = fair_shares(capacity(self.limit_for_chat(chat_id)), demands)
+            chat_demands[chat_id] = sum(wanted.values())
+        chat_shares = fair_shares(capacity(self.global_limit), chat_demands)
+
+        # setMaxConnections applies to each transfer of a worker, so the budget is per transfer
+        budget = max(1, self.total_connections // sum(len(t) for _, _, t in running.values()))
+        for chat_id, demands in chats.items():
+            cap = min(capacity(self.limit_for_chat(chat_id)), chat_shares[chat_id])
+            for k, share in fair_shares(cap, demands).items():
+                session, worker, transfers = running[k]
+                limit = 0 if share == UNLIMITED else max(1, int(share))
+                # Re-applying a near-identical cap every round only churns the SDK
+                if worker.speed_limit is None or abs(limit - worker.speed_limit) > 0.05 * max(limit, worker.speed_limit):
+                    session.set_speed_limit(limit)
+                    worker.speed_limit = limit
+                if self.fixed_connections is not None:
+                    connections = self.fixed_connections
+                else:
+                    capped = limit > 0 and speeds[k] >= 0.9 * limit
+                    remaining = max(dl.remaining for dl in transfers)
+                    connections = worker.tuner.update(remaining, speeds[k], min(self.max_connections, budget), capped)
+                if connections != worker.connections:
+                    logging.debug(f"Session #{k}: {connections} connection(s) per transfer")
+                    session.set_connections(connections)
+                    worker.connections = connections
+                worker.fresh = False
@@ -0,0 +1,678 @@
+"""In-process stand-in for the ``mega`` SDK bindings.
+
+Implements the part of the SWIG API the bot uses: MegaApi requests with
+listener callbacks, MegaNode trees, and downloads that report start, update,
+temporary error (including over-quota) and finish on a per-API "SDK thread"
+at simulated speeds. Nothing touches the network or, unless asked, the disk.
+
+    import fakemega
+    fakemega.install()  # registers this module as ``mega``
+    root = fakemega.make_tree(10000)
+    fakemega.register_folder("https://mega.nz/folder/bench#key", root)
+"""
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+
+def install():
+    """Makes ``import mega`` return this module."""
+    sys.modules["mega"] = sys.modules[__name__]
+
+
+class Simulation:
+    """Knobs for simulated requests and transfers.
+
+    ``speed`` is the bandwidth of one MegaApi in bytes per second, shared by
+    its running files; at most ``parallel`` files run at once. With
+    ``connection_speed`` set, a file also can't go faster than that many
+    bytes per second per connection (see setMaxConnections). Each tick of
+    ``tick`` seconds every running file gets an update and may hit a
+    temporary error or an over-quota error (which stalls the whole API for
+    ``over_quota_wait`` seconds) with the given probabilities. A cold
+    fetchNodes decrypts ``fetch_rate`` nodes per second (0: instantly); with
+    a basePath cache from an earlier login it only takes the request
+    latency. With
+    ``realtime`` off, ticks don't sleep and transfers finish as fast as the
+    callbacks allow.
+    """
+    def __init__(self, speed=50 * 1024 ** 2, tick=0.1, parallel=4, connection_speed=0, request_latency=0.0,
+                 fetch_rate=0,
+                 temporary_error_rate=0.0, over_quota_rate=0.0, over_quota_wait=30,
+                 failure_rate=0.0, realtime=True, write_files=False, seed=0):
+        self.speed = speed
+        self.tick = tick
+        self.parallel = parallel
+        self.connection_speed = connection_speed
+        self.request_latency = request_latency
+        self.fetch_rate = fetch_rate
+        self.temporary_error_rate = temporary_error_rate
+        self.over_quota_rate = over_quota_rate
+        self.over_quota_wait = over_quota_wait
+        self.failure_rate = failure_rate
+        self.realtime = realtime
+        self.write_files = write_files
+        self.seed = seed
+
+
+# --- Errors, requests and listeners ---
+
+class MegaError:
+    API_OK = 0
+    API_EINTERNAL = -1
+    API_EARGS = -2
+    API_EAGAIN = -3
+    API_ERATELIMIT = -4
+    API_EFAILED = -5
+    API_ENOENT = -9
+    API_EACCESS = -11
+    API_EINCOMPLETE = -13
+    API_EOVERQUOTA = -17
+
+    _NAMES = {0: "No error", -1: "Internal error", -2: "Invalid argument", -3: "Request failed, retrying",
+              -4: "Rate limit exceeded", -5: "Failed permanently", -9: "Not found", -11: "Access denied",
+              -13: "Incomplete", -17: "Quota exceeded"}
+
+    def __init__(self, code=API_OK, value=0):
+        self._code = code
+        self._value = value
+
+    def getErrorCode(self):
+        return self._code
+
+    def getValue(self):
+        return self._value
+
+    def getErrorString(self):
+        return self._NAMES.get(self._code, "Unknown error")
+
+    def toString(self):
+        return self.getErrorString()
+
+    __str__ = toString
+
+
+class MegaRequest:
+    TYPE_LOGIN = 0
+    TYPE_FETCH_NODES = 9
+    TYPE_ACCOUNT_DETAILS = 10
+    TYPE_EXPORT = 11
+    TYPE_LOGOUT = 13
+    TYPE_GET_PUBLIC_NODE = 14
+    TYPE_PAUSE_TRANSFERS = 24
+    TYPE_CANCEL_TRANSFERS = 27
+
+    def __init__(self, request_type, link=None, node=None):
+        self._type = request_type
+        self._link = link
+        self._node = node
+
+    def getType(self):
+        return self._type
+
+    def getLink(self):
+        return self._link
+
+    def getPublicMegaNode(self):
+        return self._node
+
+    def getMegaAccountDetails(self):
+        return None
+
+    def __str__(self):
+        return f"MegaRequest(type={self._type})"
+
+
+class MegaRequestListener:
+    def onRequestStart(self, api, request):
+        pass
+
+    def onRequestUpdate(self, api, request):
+        pass
+
+    def onRequestFinish(self, api, request, error):
+        pass
+
+    def onRequestTemporaryError(self, api, request, error):
+        pass
+
+
+class MegaTransferListener:
+    def onTransferStart(self, api, transfer):
+        pass
+
+    def onTransferUpdate(self, api, transfer):
+        pass
+
+    def onTransferFinish(self, api, transfer, error):
+        pass
+
+    def onTransferTemporaryError(self, api, transfer, error):
+        pass
+
+
+class MegaListener(MegaRequestListener, MegaTransferListener):
+    pass
+
+
+# --- Nodes ---
+
+_handles = itertools.count(1)
+
+
+class MegaNode:
+    TYPE_UNKNOWN = -1
+    TYPE_FILE = 0
+    TYPE_FOLDER = 1
+    TYPE_ROOT = 2
+
+    __slots__ = ("_name", "_handle", "_type", "_size", "children", "parent")
+
+    def __init__(self, name, node_type=TYPE_FILE, size=0, parent=None):
+        self._name = name
+        self._handle = next(_handles)
+        self._type = node_type
+        self._size = size if node_type == self.TYPE_FILE else 0
+        self.children = [] if node_type != self.TYPE_FILE else None
+        self.parent = parent
+        if parent is not None:
+            parent.children.append(self)
+
+    def getName(self):
+        return self._name
+
+    def getHandle(self):
+        return self._handle
+
+    def getBase64Handle(self):
+        return f"{self._handle:08x}"
+
+    def getType(self):
+        return self._type
+
+    def getSize(self):
+        return self._size
+
+    def isFile(self):
+        return self._type == self.TYPE_FILE
+
+    def isFolder(self):
+        return self._type != self.TYPE_FILE
+
+    def copy(self):
+        return self
+
+
+class MegaNodeList:
+    __slots__ = ("_nodes",)
+
+    def __init__(self, nodes):
+        self._nodes = nodes
+
+    def size(self):
+        return len(self._nodes)
+
+    def get(self, i):
+        return self._nodes[i]
+
+
+def walk(node):
+    """Yields ``node`` and everything below it in pre-order."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.children:
+            stack.extend(reversed(node.children))
+
+
+EXTENSIONS = (".flac", ".mp3", ".jpg", ".png", ".mkv", ".mp4", ".txt", ".pdf", ".zip", ".cue")
+
+
+def make_tree(nodes, fanout=20, folder_ratio=0.05, seed=0, name="bench", max_size=512 * 1024 ** 2):
+    """Builds a synthetic folder tree of exactly ``nodes`` nodes, breadth first.
+
+    File sizes are log-uniform between 1 KB and ``max_size`` so size filters
+    have something to bite on.
+    """
+    rng = random.Random(seed)
+    root = MegaNode(name, MegaNode.TYPE_FOLDER)
+    folders = deque([root])
+    count = 1
+    while count < nodes:
+        parent = folders.popleft() if folders else root
+        for k in range(min(fanout, nodes - count)):
+            if (k == 0 and not folders) or rng.random() < folder_ratio:
+                folders.append(MegaNode(f"Folder {count}", MegaNode.TYPE_FOLDER, parent=parent))
+            else:
+                size = int(1024 * (max_size / 1024) ** rng.random())
+                MegaNode(f"file {count:06}{rng.choice(EXTENSIONS)}", MegaNode.TYPE_FILE, size, parent)
+            count += 1
+    return root
+
+
+def make_chain(depth, files_per_level=1, name="deep"):
+    """Builds a tree ``depth`` folders deep, for recursion-limit checks."""
+    root = node = MegaNode(name, MegaNode.TYPE_FOLDER)
+    for level in range(depth):
+        for k in range(files_per_level):
+            MegaNode(f"file {level}-{k}.bin", MegaNode.TYPE_FILE, 1024, node)
+        node = MegaNode(f"level {level}", MegaNode.TYPE_FOLDER, parent=node)
+    return root
+
+
+_folders = {}
+_files = {}
+
+
+def register_folder(link, root):
+    """Makes ``loginToFolder(link)`` open the tree under ``root``."""
+    _folders[link] = root
+
+
+def register_file(link, node):
+    """Makes ``getPublicNode(link)`` return ``node``."""
+    _files[link] = node
+
+
+def clear_links():
+    _folders.clear()
+    _files.clear()
+
+
+def tree_size(node):
+    return sum(n.getSize() for n in walk(node) if n.getType() == MegaNode.TYPE_FILE)
+
+
+# --- Transfers ---
+
+class MegaTransfer:
+    TYPE_DOWNLOAD = 0
+    TYPE_UPLOAD = 1
+
+    STATE_NONE = 0
+    STATE_QUEUED = 1
+    STATE_ACTIVE = 2
+    STATE_PAUSED = 3
+    STATE_RETRYING = 4
+    STATE_COMPLETING = 5
+    STATE_COMPLETED = 6
+    STATE_CANCELLED = 7
+    STATE_FAILED = 8
+
+    __slots__ = ("_tag", "_folder_tag", "_name", "_path", "_total", "_transferred", "_speed",
+                 "_started", "_state", "_node", "listener")
+
+    def __init__(self, tag, folder_tag, node, path, total, listener):
+        self._tag = tag
+        self._folder_tag = folder_tag
+        self._name = node.getName()
+        self._path = path
+        self._total = total
+        self._transferred = 0
+        self._speed = 0
+        self._started = time.monotonic()
+        self._state = self.STATE_QUEUED
+        self._node = node
+        self.listener = listener
+
+    def getTag(self):
+        return self._tag
+
+    def getFolderTransferTag(self):
+        return self._folder_tag
+
+    def getType(self):
+        return self.TYPE_DOWNLOAD
+
+    def getFileName(self):
+        return self._name
+
+    def getPath(self):
+        return self._path
+
+    def getNodeHandle(self):
+        return self._node.getHandle()
+
+    def getTotalBytes(self):
+        return self._total
+
+    def getTransferredBytes(self):
+        return self._transferred
+
+    def getSpeed(self):
+        return self._speed
+
+    def getMeanSpeed(self):
+        elapsed = time.monotonic() - self._started
+        return int(self._transferred / elapsed) if elapsed > 0 else 0
+
+    def getState(self):
+        return self._state
+
+    def isFolderTransfer(self):
+        return self._node.getType() != MegaNode.TYPE_FILE
+
+    def __str__(self):
+        return f"MegaTransfer({self._tag}, {self._name})"
+
+
+# --- API ---
+
+class MegaApi:
+    """Fake MegaApi; callbacks run on one thread per instance, like the SDK's."""
+    simulation = Simulation()
+    instances = 0
+
+    def __init__(self, appKey, processor=None, basePath=None, userAgent=None, workerThreadCount=1):
+        MegaApi.instances += 1
+        self.app_key = appKey
+        self.base_path = basePath
+        self.user_agent = userAgent
+        self.simulation = type(self).simulation
+        self._rng = random.Random(self.simulation.seed + MegaApi.instances)
+        self._root = None
+        self._pending_root = None
+        self._pending_link = None
+        self._by_handle = None
+        self._tags = itertools.count(1)
+        self._cond = threading.Condition()
+        self._jobs = []  # heap of (due, seq, callable)
+        self._seq = itertools.count()
+        self._queued = deque()  # file transfers waiting for a slot
+        self._running = []
+        self._folders = {}  # tag -> [folder transfer, files left, last error]
+        self._paused = False
+        self._next_tick = 0
+        self._stalled_until = 0
+        self._max_speed = -1
+        self._connections = 4  # per transfer
+        self._thread = threading.Thread(target=self._run, name="fake-mega-sdk", daemon=True)
+        self._thread.start()
+
+    # SDK thread
+
+    def _schedule(self, job, delay=0.0):
+        with self._cond:
+            heapq.heappush(self._jobs, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._jobs and self._jobs[0][0] <= now:
+                        job = heapq.heappop(self._jobs)[2]
+                        break
+                    busy = (self._running or self._queued) and not self._paused
+                    wake = max(self._next_tick, self._stalled_until)
+                    if busy and now >= wake:
+                        job = self._tick
+                        break
+                    timeout = None
+                    if self._jobs:
+                        timeout = self._jobs[0][0] - now
+                    if busy:
+                        timeout = wake - now if timeout is None else min(timeout, wake - now)
+                    self._cond.wait(timeout)
+            job()
+
+    def _request(self, request, listener, finish, error=None, latency=0.0):
+        """Runs a request's callbacks on the SDK thread after the simulated latency."""
+        def run():
+            if listener is not None:
+                listener.onRequestStart(self, request)
+            result = error if error is not None else finish()
+            if listener is not None:
+                listener.onRequestFinish(self, request, result or MegaError())
+        self._schedule(run, self.simulation.request_latency + latency)
+
+    # Requests
+
+    def _cache_file(self, link):
+        return os.path.join(self.base_path, "fake-statecache-" + hashlib.sha1(link.encode()).hexdigest())
+
+    def loginToFolder(self, megaFolderLink, listener=None, tryToResumeFolderLinkFromCache=False):
+        root = _folders.get(megaFolderLink)
+        request = MegaRequest(MegaRequest.TYPE_LOGIN, link=megaFolderLink)
+
+        def finish():
+            if root is None:
+                return MegaError(MegaError.API_ENOENT)
+            self._pending_root = root
+            self._pending_link = megaFolderLink
+            self._root = None
+            self._by_handle = None
+        self._request(request, listener, finish)
+
+    def fetchNodes(self, listener=None):
+        link, root = self._pending_link, self._pending_root
+        cached = self.base_path is not None and link is not None and os.path.exists(self._cache_file(link))
+        latency = 0.0
+        if root is not None and not cached and self.simulation.fetch_rate > 0:
+            latency = sum(1 for _ in walk(root)) / self.simulation.fetch_rate
+
+        def finish():
+            if self._pending_root is None:
+                return MegaError(MegaError.API_EACCESS)
+            self._root = self._pending_root
+            if self.base_path is not None:
+                os.makedirs(self.base_path, exist_ok=True)
+                open(self._cache_file(link), "w").close()
+        self._request(MegaRequest(MegaRequest.TYPE_FETCH_NODES), listener, finish, latency=latency)
+
+    def getPublicNode(self, megaFileLink, listener=None):
+        node = _files.get(megaFileLink)
+        error = MegaError(MegaError.API_ENOENT) if node is None else None
+        self._request(MegaRequest(MegaRequest.TYPE_GET_PUBLIC_NODE, megaFileLink, node), listener,
+                      lambda: None, error)
+
+    def logout(self, listener=None):
+        link = self._pending_link
+
+        def finish():
+            self._root = self._pending_root = self._pending_link = None
+            self._by_handle = None
+            if self.base_path is not None and link is not None and os.path.exists(self._cache_file(link)):
+                os.remove(self._cache_file(link))  # like the SDK, a full logout drops the local cache
+        self._request(MegaRequest(MegaRequest.TYPE_LOGOUT), listener, finish)
+
+    def localLogout(self, listener=None):
+        def finish():
+            self._root = self._pending_root = self._pending_link = None
+            self._by_handle = None
+        self._request(MegaRequest(MegaRequest.TYPE_LOGOUT), listener, finish)
+
+    def getMyEmail(self):
+        return None
+
+    # Nodes
+
+    def getRootNode(self):
+        return self._root
+
+    def getChildren(self, parent, order=0):
+        return MegaNodeList(parent.children or [])
+
+    def getNumChildren(self, parent):
+        return len(parent.children or ())
+
+    def getNodeByHandle(self, handle):
+        if self._root is None:
+            return None
+        if self._by_handle is None:
+            self._by_handle = {n.getHandle(): n for n in walk(self._root)}
+        return self._by_handle.get(handle)
+
+    def authorizeNode(self, node):
+        return node
+
+    def getSize(self, node):
+        if node.getType() == MegaNode.TYPE_FILE:
+            return node.getSize()
+        return tree_size(node)
+
+    def getFingerprint(self, node_or_path):
+        if isinstance(node_or_path, MegaNode):
+            return f"{node_or_path.getSize():x}:{node_or_path.getHandle():x}"
+        return None
+
+    # Transfers
+
+    def startDownload(self, node, localPath, listener=None):
+        self._schedule(lambda: self._start(node, localPath, listener))
+
+    def _start(self, node, path, listener):
+        tag = next(self._tags)
+        if node.getType() == MegaNode.TYPE_FILE:
+            transfer = MegaTransfer(tag, 0, node, path, node.getSize(), listener)
+            self._callback(transfer, "onTransferStart")
+            with self._cond:
+                self._queued.append(transfer)
+                self._cond.notify()
+            return
+        folder = MegaTransfer(tag, 0, node, path, tree_size(node), listener)
+        self._callback(folder, "onTransferStart")
+        base = os.path.dirname(path)
+        count = 0
+        for child in walk(node):
+            if child.getType() != MegaNode.TYPE_FILE:
+                continue
+            child_path = os.path.join(base, *self._relative(node, child))
+            self._queued.append(MegaTransfer(next(self._tags), tag, child, child_path, child.getSize(), listener))
+            count += 1
+        self._folders[tag] = [folder, count, None]
+        if count == 0:
+            self._finish_folder(tag)
+        else:
+            with self._cond:
+                self._cond.notify()
+
+    @staticmethod
+    def _relative(top, node):
+        parts = []
+        while node is not top.parent and node is not None:
+            parts.append(node.getName())
+            node = node.parent
+        return reversed(parts)
+
+    def _callback(self, transfer, name, *args):
+        if transfer.listener is not None:
+            getattr(transfer.listener, name)(self, transfer, *args)
+
+    def _tick(self):
+        sim = self.simulation
+        with self._cond:
+            while self._queued and len(self._running) < sim.parallel:
+                transfer = self._queued.popleft()
+                transfer._state = MegaTransfer.STATE_ACTIVE
+                transfer._started = time.monotonic()
+                self._running.append(transfer)
+                if transfer._folder_tag > 0:
+                    self._callback(transfer, "onTransferStart")
+            running = list(self._running)
+        if not running:
+            return
+        speed = sim.speed if self._max_speed <= 0 else min(sim.speed, self._max_speed)
+        share = max(1, int(speed * sim.tick / len(running)))
+        if sim.connection_speed > 0:
+            share = min(share, max(1, int(sim.connection_speed * self._connections * sim.tick)))
+        for transfer in running:
+            if transfer._state != MegaTransfer.STATE_ACTIVE:
+                continue
+            roll = self._rng.random()
+            if roll < sim.over_quota_rate:
+                self._stalled_until = time.monotonic() + sim.over_quota_wait
+                transfer._speed = 0
+                self._callback(transfer, "onTransferTemporaryError",
+                               MegaError(MegaError.API_EOVERQUOTA, int(sim.over_quota_wait)))
+                break
+            if roll < sim.over_quota_rate + sim.temporary_error_rate:
+                transfer._speed = 0
+                self._callback(transfer, "onTransferTemporaryError", MegaError(MegaError.API_EAGAIN))
+                continue
+            step = min(share, transfer._total - transfer._transferred)
+            transfer._transferred += step
+            transfer._speed = int(step / sim.tick) if sim.tick else step
+            self._callback(transfer, "onTransferUpdate")
+            if transfer._transferred >= transfer._total:
+                failed = self._rng.random() < sim.failure_rate
+                self._complete(transfer, MegaError(MegaError.API_EFAILED) if failed else MegaError())
+        if sim.realtime:
+            self._next_tick = time.monotonic() + sim.tick
+
+    def _complete(self, transfer, error):
+        with self._cond:
+            if transfer in self._running:
+                self._running.remove(transfer)
+        if error.getErrorCode() == MegaError.API_OK:
+            transfer._state = MegaTransfer.STATE_COMPLETED
+            if self.simulation.write_files:
+                self._write(transfer)
+        elif error.getErrorCode() == MegaError.API_EINCOMPLETE:
+            transfer._state = MegaTransfer.STATE_CANCELLED
+        else:
+            transfer._state = MegaTransfer.STATE_FAILED
+        self._callback(transfer, "onTransferFinish", error)
+        entry = self._folders.get(transfer._folder_tag)
+        if entry is not None:
+            entry[0]._transferred += transfer._transferred
+            entry[1] -= 1
+            if error.getErrorCode() != MegaError.API_OK:
+                entry[2] = error
+            if entry[1] == 0:
+                self._finish_folder(transfer._folder_tag)
+
+    def _finish_folder(self, tag):
+        """Finishes a folder transfer once its last file is done, with the last file error if any."""
+        folder, _, error = self._folders.pop(tag)
+        if error is None:
+            folder._state = MegaTransfer.STATE_COMPLETED
+            if self.simulation.write_files:
+                os.makedirs(folder._path, exist_ok=True)
+        else:
+            folder._state = (MegaTransfer.STATE_CANCELLED if error.getErrorCode() == MegaError.API_EINCOMPLETE
+                             else MegaTransfer.STATE_FAILED)
+        self._callback(folder, "onTransferFinish", error or MegaError())
+
+    @staticmethod
+    def _write(transfer):
+        os.makedirs(os.path.dirname(transfer._path) or ".", exist_ok=True)
+        with open(transfer._path, "wb") as f:
+            f.truncate(transfer._total)
+
+    def pauseTransfers(self, pause, listener=None):
+        with self._cond:
+            self._paused = bool(pause)
+            self._cond.notify()
+        for transfer in self._running:
+            transfer._state = MegaTransfer.STATE_PAUSED if pause else MegaTransfer.STATE_ACTIVE
+        self._request(MegaRequest(MegaRequest.TYPE_PAUSE_TRANSFERS), listener, lambda: None)
+
+    def areTransfersPaused(self, direction=MegaTransfer.TYPE_DOWNLOAD):
+        return self._paused
+
+    def cancelTransfers(self, direction=MegaTransfer.TYPE_DOWNLOAD, listener=None):
+        def cancel():
+            with self._cond:
+                transfers = list(self._running) + list(self._queued)
+                self._running.clear()
+                self._queued.clear()
+            for transfer in transfers:
+                self._complete(transfer, MegaError(MegaError.API_EINCOMPLETE))
+        self._schedule(cancel)
+        self._request(MegaRequest(MegaRequest.TYPE_CANCEL_TRANSFERS), listener, lambda: None)
+
+    def setMaxDownloadSpeed(self, bpslimit):
+        self._max_speed = bpslimit
+        return True
+
+    def setMaxConnections(self, direction, connections=None, listener=None):
+        self._connections = connections if connections is not None else direction
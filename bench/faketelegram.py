@@ -0,0 +1,292 @@
+"""Local stand-in for the Telegram Bot API, for driving the bot under load.
+
+Serves ``/bot<token>/<method>`` on the repo's own HTTPServer. Simulated
+users push messages and button presses as updates, which the bot receives
+through long-polled getUpdates or, once it calls setWebhook, as POSTs to its
+webhook over kept-alive connections. Everything the bot sends back is
+recorded per chat so a user can wait for the reply it expects. Every call
+is counted by method.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlsplit
+
+from httpserver import HTTPServer
+
+# Form fields that PTB sends JSON-encoded
+JSON_FIELDS = {"chat_id", "message_id", "offset", "limit", "timeout", "reply_markup", "allowed_updates",
+               "show_alert", "cache_time", "disable_web_page_preview", "disable_notification"}
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class Event:
+    """Something the bot did in a chat: a sent or edited message, or an answered button press."""
+    __slots__ = ("method", "at", "message_id", "text", "buttons", "query_id")
+
+    def __init__(self, method, message_id=None, text=None, markup=None, query_id=None):
+        self.method = method
+        self.at = time.monotonic()
+        self.message_id = message_id
+        self.text = text or ""
+        self.buttons = [b.get("callback_data") for row in (markup or {}).get("inline_keyboard", []) for b in row]
+        self.query_id = query_id
+
+
+class Chat:
+    """One simulated private chat."""
+    def __init__(self, server, chat_id):
+        self.server = server
+        self.id = chat_id
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+        self.events = []
+        self.changed = asyncio.Event()
+        self.messages = {}  # message_id -> last text the bot put there
+
+    def _record(self, event):
+        self.events.append(event)
+        self.changed.set()
+
+    def mark(self):
+        """Position in the event log; pass it to ``expect`` to only look at what comes after."""
+        return len(self.events)
+
+    async def expect(self, predicate, since, timeout=60):
+        """Waits for a bot event after ``since`` matching ``predicate``; returns (event, position)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            for k in range(since, len(self.events)):
+                if predicate(self.events[k]):
+                    return self.events[k], k + 1
+            since = len(self.events)
+            self.changed.clear()
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise asyncio.TimeoutError
+            try:
+                await asyncio.wait_for(self.changed.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+
+    def send(self, text):
+        """Sends a text message from the user; returns the update's timestamp."""
+        message = self.server._message(self.id, text, from_user=self.user)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.server.push({"message": message})
+
+    def press(self, message_id, data):
+        """Presses an inline button under one of the bot's messages."""
+        query_id = str(next(self.server._query_ids))
+        self.server._queries[query_id] = self
+        message = self.server._message(self.id, self.messages.get(message_id, ""), message_id, BOT_USER)
+        return query_id, self.server.push({"callback_query": {
+            "id": query_id, "from": self.user, "chat_instance": str(self.id), "message": message, "data": data,
+        }})
+
+
+class FakeBotAPI:
+    def __init__(self, token):
+        self.token = token
+        self.http = HTTPServer()
+        self.chats = {}
+        self.calls = Counter()
+        self.call_times = deque()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._query_ids = itertools.count(1)
+        self._queries = {}
+        self._new_update = asyncio.Event()
+        self.webhook = None  # (url, secret) after setWebhook
+        self.deliveries = Counter()  # webhook responses by status
+        self._deliver_queue = None
+        self._deliverers = []
+        for method, handler in {
+            "getMe": self._get_me,
+            "getUpdates": self._get_updates,
+            "sendMessage": self._send_message,
+            "editMessageText": self._edit_message_text,
+            "editMessageReplyMarkup": self._edit_message_text,
+            "answerCallbackQuery": self._answer_callback_query,
+            "deleteMessage": self._true,
+            "deleteWebhook": self._delete_webhook,
+            "setWebhook": self._set_webhook,
+            "getWebhookInfo": self._webhook_info,
+            "setMyCommands": self._true,
+            "close": self._true,
+            "logOut": self._true,
+        }.items():
+            route = self._route(method, handler)
+            self.http.route("POST", f"/bot{token}/{method}", route)
+            self.http.route("GET", f"/bot{token}/{method}", route)
+
+    async def start(self, host="127.0.0.1", port=0):
+        await self.http.start(host, port)
+        return self.http._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._stop_delivery()
+        await self.http.stop()
+
+    def chat(self, chat_id):
+        if chat_id not in self.chats:
+            self.chats[chat_id] = Chat(self, chat_id)
+        return self.chats[chat_id]
+
+    def push(self, update):
+        update["update_id"] = next(self._update_ids)
+        if self._deliver_queue is not None:
+            self._deliver_queue.put_nowait(update)
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+        return time.monotonic()
+
+    def _message(self, chat_id, text, message_id=None, from_user=None):
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": from_user or BOT_USER,
+            "text": text,
+        }
+
+    def _route(self, method, handler):
+        async def route(request):
+            self.calls[method] += 1
+            self.call_times.append(time.monotonic())
+            params = {}
+            if request.body:
+                if request.headers.get("content-type", "").startswith("application/json"):
+                    params = json.loads(request.body)
+                else:
+                    for key, values in parse_qs(request.body.decode(), keep_blank_values=True).items():
+                        params[key] = json.loads(values[0]) if key in JSON_FIELDS else values[0]
+            result = await handler(params)
+            return 200, "application/json", json.dumps({"ok": True, "result": result})
+        return route
+
+    async def _true(self, params):
+        return True
+
+    async def _set_webhook(self, params):
+        self._stop_delivery()
+        self.webhook = (params["url"], params.get("secret_token"))
+        self._deliver_queue = asyncio.Queue()
+        for update in self._updates:
+            self._deliver_queue.put_nowait(update)
+        self._updates = []
+        self._deliverers = [asyncio.create_task(self._deliver())
+                            for _ in range(int(params.get("max_connections") or 40))]
+        return True
+
+    async def _delete_webhook(self, params):
+        self._stop_delivery()
+        return True
+
+    def _stop_delivery(self):
+        for task in self._deliverers:
+            task.cancel()
+        self._deliverers = []
+        if self._deliver_queue is not None:
+            while not self._deliver_queue.empty():
+                self._updates.append(self._deliver_queue.get_nowait())
+        self._deliver_queue = None
+        self.webhook = None
+
+    async def _deliver(self):
+        """Posts queued updates to the webhook over one kept-alive connection, retrying failures."""
+        url, secret = self.webhook
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        ssl = None
+        if parts.scheme == "https":
+            import ssl as ssl_module
+            ssl = ssl_module.create_default_context()
+            ssl.check_hostname = False
+            ssl.verify_mode = ssl_module.CERT_NONE
+        queue = self._deliver_queue
+        reader = writer = None
+        while True:
+            update = await queue.get()
+            body = json.dumps(update).encode()
+            head = (f"POST {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                    "Content-Type: application/json\r\n"
+                    + (f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n" if secret else "")
+                    + f"Content-Length: {len(body)}\r\n\r\n")
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=ssl)
+                writer.write(head.encode() + body)
+                await writer.drain()
+                response = await reader.readuntil(b"\r\n\r\n")
+                status = int(response.split(b" ", 2)[1])
+                length = 0
+                for line in response.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                if b"connection: close" in response.lower():
+                    writer.close()
+                    writer = None
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status = 0
+                if writer is not None:
+                    writer.close()
+                writer = None
+            self.deliveries[status] += 1
+            if status != 200:
+                await asyncio.sleep(0.1)  # Telegram retries failed deliveries too
+                queue.put_nowait(update)
+
+    async def _get_me(self, params):
+        return BOT_USER
+
+    async def _webhook_info(self, params):
+        url = self.webhook[0] if self.webhook else ""
+        pending = self._deliver_queue.qsize() if self._deliver_queue is not None else len(self._updates)
+        return {"url": url, "has_custom_certificate": False, "pending_update_count": pending}
+
+    async def _get_updates(self, params):
+        offset = params.get("offset") or 0
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), params.get("timeout") or 0)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:params.get("limit") or 100]
+
+    async def _send_message(self, params):
+        chat = self.chat(params["chat_id"])
+        message = self._message(chat.id, params.get("text", ""))
+        chat.messages[message["message_id"]] = message["text"]
+        chat._record(Event("sendMessage", message["message_id"], message["text"], params.get("reply_markup")))
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    async def _edit_message_text(self, params):
+        chat = self.chat(params["chat_id"])
+        message_id = params["message_id"]
+        text = params.get("text", chat.messages.get(message_id, ""))
+        chat.messages[message_id] = text
+        chat._record(Event("editMessageText", message_id, text, params.get("reply_markup")))
+        message = self._message(chat.id, text, message_id)
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    async def _answer_callback_query(self, params):
+        query_id = str(params.get("callback_query_id"))
+        chat = self._queries.pop(query_id, None)
+        if chat is not None:
+            chat._record(Event("answerCallbackQuery", text=params.get("text"), query_id=query_id))
+        return True
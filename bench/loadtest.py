@@ -0,0 +1,308 @@
+"""Load test: many simulated chats against the real bot, fake Telegram and fake Mega.
+
+    python bench/loadtest.py --chats 200 --concurrency 50 -o load.json
+
+Runs megabot.main() in this process with its Application pointed at a local
+fake Bot API server and the ``mega`` module replaced by fakemega. Each chat
+opens a folder with /dl, sends a selection, confirms it, pauses and resumes
+the download and then either cancels it or waits for it to finish. The
+report (JSON) has per-step handler latency percentiles, event-loop lag,
+memory per open session and the bot's outgoing API call rate.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import fakemega
+fakemega.install()
+
+from faketelegram import FakeBotAPI  # noqa: E402
+
+TOKEN = "123456:LOADTEST"
+SELECTIONS = ("all", "*.flac", "size<50M", "1/", "1-40", "type:file !*.txt")
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": at(0.50), "p90": at(0.90), "p99": at(0.99), "max": values[-1],
+            "mean": statistics.fmean(values)}
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.completed = 0
+        self.cancelled = 0
+        self.lag = []
+        self.rss = []  # (time, rss, open sessions)
+
+
+async def step(stats, name, chat, since, predicate, timeout):
+    """Waits for the bot's reply to the action sent at ``since`` and records its latency."""
+    started = time.monotonic()
+    event, position = await chat.expect(predicate, since, timeout)
+    stats.latency[name].append(event.at - started)
+    return event, position
+
+
+def button(event, action):
+    """The callback data of the ``action`` button under a bot message (data is "action:session id")."""
+    for data in event.buttons:
+        if data and data.split(":", 1)[0] == action:
+            return data
+    return None
+
+
+def finished_text(event):
+    # Status messages start with the session id, e.g. "#3 All downloads finished: ..."
+    return "All downloads finished" in event.text.split("\n", 1)[0]
+
+
+async def run_chat(args, api, stats, chat_id, link, rng):
+    megabot = sys.modules["megabot"]
+    chat = api.chat(chat_id)
+    timeout = args.step_timeout
+    try:
+        since = chat.mark()
+        chat.send(f"/dl f {link}")
+        _, since = await step(stats, "open", chat, since, lambda e: e.text == megabot.SELECTION_HELP, timeout)
+
+        chat.send(rng.choice(SELECTIONS))
+        preview, since = await step(stats, "select", chat, since, lambda e: button(e, "sel_confirm"), timeout)
+
+        chat.press(preview.message_id, button(preview, "sel_confirm"))
+        status, since = await step(stats, "confirm", chat, since,
+                                   lambda e: e.message_id == preview.message_id and e.method == "editMessageText",
+                                   timeout)
+        status, since = await step(stats, "first_status", chat, since,
+                                   lambda e: e.message_id == preview.message_id and
+                                   (button(e, "pause") or finished_text(e)), timeout)
+        finished = finished_text(status)
+
+        if not finished:
+            for action in ("pause", "resume"):
+                query_id, _ = chat.press(preview.message_id, button(status, action))
+                _, since = await step(stats, action, chat, since, lambda e, q=query_id: e.query_id == q, timeout)
+                await asyncio.sleep(args.think_time)
+
+        if rng.random() < args.cancel_ratio:
+            chat.send("/cancel")
+            await step(stats, "cancel", chat, since, lambda e: e.text.startswith(("Cancelling", "No active")),
+                       timeout)
+            stats.cancelled += 1
+        elif not finished:
+            await step(stats, "finish", chat, since,
+                       lambda e: e.message_id == preview.message_id and finished_text(e),
+                       args.finish_timeout)
+        stats.completed += 1
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+        chat.send("/cancel")
+    except Exception as e:
+        stats.errors[type(e).__name__] += 1
+        logging.exception(f"Chat {chat_id} failed")
+
+
+async def sample(stats, interval=0.1):
+    """Samples event-loop lag and memory while the load runs."""
+    megabot = sys.modules["megabot"]
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        stats.lag.append(max(0, now - started - interval))
+        if len(stats.lag) % 10 == 0:
+            stats.rss.append((now, rss_bytes(), len(megabot.sessions)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure(args, workdir, api_port):
+    """Points megabot's settings at the fakes; must run before megabot is imported."""
+    env = {
+        "TELEGRAM_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}/bot",
+        "API_KEY": "loadtest",
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "DOWNLOADS_DIR": os.path.join(workdir, "downloads"),
+        "HTTP_HOST": "127.0.0.1",
+        "HTTP_PORT": "0",
+        "MEGA_POOL_SIZE": str(args.pool_size or args.chats),
+        "MEGA_POOL_ACQUIRE_TIMEOUT": str(args.step_timeout),
+    }
+    if args.webhook or args.workers:
+        env["HTTP_PORT"] = str(free_port())
+    if args.webhook:
+        env["WEBHOOK_URL"] = f"http://127.0.0.1:{env['HTTP_PORT']}"
+    if args.workers:
+        env["WORKER_TOKEN"] = "loadtest"
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+    os.makedirs(os.environ["DOWNLOADS_DIR"], exist_ok=True)
+    fakemega.MegaApi.simulation = fakemega.Simulation(
+        speed=args.speed, tick=args.tick, request_latency=args.mega_latency, fetch_rate=args.fetch_rate,
+        temporary_error_rate=args.error_rate, over_quota_rate=args.over_quota_rate,
+        over_quota_wait=args.over_quota_wait, seed=args.seed,
+    )
+    links = []
+    for k in range(args.folders):
+        link = f"https://mega.nz/folder/load{k}#key"
+        fakemega.register_folder(link, fakemega.make_tree(args.tree, seed=k, max_size=args.max_file_size))
+        links.append(link)
+    return links
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="megabot-load-")
+    api = FakeBotAPI(TOKEN)
+    api_port = await api.start()
+    links = configure(args, workdir, api_port)
+
+    import megabot
+    stats = Stats()
+    bot = asyncio.create_task(megabot.main())
+    await asyncio.sleep(1)  # let polling start
+    baseline = rss_bytes()
+    sampler = asyncio.create_task(sample(stats))
+    workers_stop = asyncio.Event()
+    workers = [asyncio.create_task(worker.run(workers_stop)) for worker in start_workers(args)]
+
+    rng = random.Random(args.seed)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(k):
+        async with slots:
+            await run_chat(args, api, stats, 1000 + k, links[k % len(links)], random.Random(rng.random()))
+
+    started = time.monotonic()
+    chats = []
+    for k in range(args.chats):
+        chats.append(asyncio.create_task(one(k)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.chats)
+    await asyncio.gather(*chats)
+    elapsed = time.monotonic() - started
+
+    sampler.cancel()
+    workers_stop.set()
+    await asyncio.gather(*workers)
+    os.kill(os.getpid(), signal.SIGINT)  # main() stops on SIGINT
+    await asyncio.wait_for(bot, 30)
+    await api.stop()
+    return report(args, api, stats, baseline, started, elapsed)
+
+
+def start_workers(args):
+    """In-process download workers polling the bot, sharing fakemega with it."""
+    from megapool import MegaApiPool
+    from worker import Worker
+    url = f"http://127.0.0.1:{os.environ['HTTP_PORT']}"
+    return [Worker(url, os.environ["WORKER_TOKEN"], f"worker-{k}",
+                   MegaApiPool("loadtest", args.worker_slots), interval=0.5, timeout=args.step_timeout)
+            for k in range(args.workers)]
+
+
+def report(args, api, stats, baseline, started, elapsed):
+    times = [t for t in api.call_times if started <= t <= started + elapsed]
+    per_second = defaultdict(int)
+    for t in times:
+        per_second[int(t)] += 1
+    peak_rss, peak_sessions = baseline, 0
+    for _, rss, sessions in stats.rss:
+        peak_rss = max(peak_rss, rss)
+        peak_sessions = max(peak_sessions, sessions)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed": elapsed,
+        "chats": {"completed": stats.completed, "cancelled": stats.cancelled, "errors": dict(stats.errors)},
+        "latency": {name: percentiles(values) for name, values in stats.latency.items()},
+        "loop_lag": percentiles(stats.lag),
+        "memory": {
+            "baseline_rss": baseline,
+            "peak_rss": peak_rss,
+            "peak_sessions": peak_sessions,
+            "per_session": (peak_rss - baseline) / peak_sessions if peak_sessions else None,
+        },
+        "api_calls": {
+            "total": len(times),
+            "per_second": len(times) / elapsed if elapsed else None,
+            "peak_per_second": max(per_second.values(), default=0),
+            "by_method": dict(api.calls),
+        },
+        "webhook_deliveries": {str(k): v for k, v in api.deliveries.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50, help="simulated chats in total")
+    parser.add_argument("--concurrency", type=int, default=20, help="chats running at once")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which chats are started")
+    parser.add_argument("--folders", type=int, default=4, help="distinct folder links shared by the chats")
+    parser.add_argument("--tree", type=int, default=2000, help="nodes per folder")
+    parser.add_argument("--max-file-size", type=int, default=8 * 1024 ** 2)
+    parser.add_argument("--pool-size", type=int, default=0, help="MEGA_POOL_SIZE (default: one per chat)")
+    parser.add_argument("--speed", type=float, default=200 * 1024 ** 2, help="fake bytes/s per MegaApi")
+    parser.add_argument("--tick", type=float, default=0.1, help="fake SDK progress interval")
+    parser.add_argument("--mega-latency", type=float, default=0.05, help="fake SDK request latency")
+    parser.add_argument("--fetch-rate", type=float, default=0, help="nodes/s of a cold fake fetchNodes (0: instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="temporary errors per transfer tick")
+    parser.add_argument("--over-quota-rate", type=float, default=0.0, help="over-quota errors per transfer tick")
+    parser.add_argument("--over-quota-wait", type=float, default=5)
+    parser.add_argument("--cancel-ratio", type=float, default=0.3, help="share of chats that /cancel")
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause between a user's button presses")
+    parser.add_argument("--step-timeout", type=float, default=60)
+    parser.add_argument("--finish-timeout", type=float, default=600)
+    parser.add_argument("--webhook", action="store_true", help="deliver updates to a webhook instead of polling")
+    parser.add_argument("--workers", type=int, default=0, help="download in this many worker.py instances")
+    parser.add_argument("--worker-slots", type=int, default=8, help="downloads at once per worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # megabot's basicConfig is a no-op once logging is configured here
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s\t%(asctime)s %(message)s")
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
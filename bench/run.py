@@ -0,0 +1,400 @@
+"""Benchmarks for the bot's hot paths, run against the fake ``mega`` module.
+
+    python bench/run.py                      # full suite, JSON on stdout
+    python bench/run.py --quick -o out.json  # smaller trees, fewer repeats
+    python bench/run.py -k selection         # only benchmarks matching "selection"
+    python bench/run.py --compare base.json  # flag regressions against an earlier run
+
+Each result records the best and median wall time of ``repeat`` runs of a
+benchmark; the best time is what --compare looks at.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import fakemega
+fakemega.install()
+
+from mega import MegaApi, MegaError, MegaRequestListener, MegaTransfer  # noqa: E402
+from folderindex import build_index  # noqa: E402
+from listing import ListingPager  # noqa: E402
+from selection import expand_ranges, parse_selection, selection_roots, summarize  # noqa: E402
+from status import format_transfers  # noqa: E402
+from transferlistener import TransferListener, FolderTransferListener  # noqa: E402
+
+TREE_SIZES = (1000, 10000, 50000, 200000)
+QUICK_TREE_SIZES = (1000, 10000)
+TRANSFER_COUNTS = (10, 100, 500)
+
+_benchmarks = []
+
+
+def benchmark(name):
+    def register(fn):
+        _benchmarks.append((name, fn))
+        return fn
+    return register
+
+
+def measure(fn, repeat, number=1):
+    """Times ``number`` calls of ``fn``, ``repeat`` times; returns seconds per call."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - started) / number)
+    return times
+
+
+def result(name, times, **extra):
+    entry = {
+        "name": name,
+        "best": min(times),
+        "median": statistics.median(times),
+        "repeat": len(times),
+        "unit": "s",
+    }
+    entry.update(extra)
+    return entry
+
+
+class Trees:
+    """Synthetic trees and their indexes, built once and shared by benchmarks."""
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self._roots = {}
+        self._indexes = {}
+        self.api = MegaApi("bench")
+
+    def root(self, size):
+        if size not in self._roots:
+            self._roots[size] = fakemega.make_tree(size, seed=size)
+        return self._roots[size]
+
+    def index(self, size):
+        if size not in self._indexes:
+            self._indexes[size] = build_index(self.api, self.root(size))
+        return self._indexes[size]
+
+
+# --- Tree walk and listing ---
+
+@benchmark("tree_walk")
+def bench_tree_walk(ctx):
+    for size in ctx.trees.sizes:
+        root = ctx.trees.root(size)
+        times = measure(lambda: build_index(ctx.trees.api, root), ctx.repeat)
+        index = ctx.trees.index(size)
+        memory = sum(a.itemsize * len(a) for a in
+                     (index.handles, index.parents, index.depths, index.sizes, index.ends, index.name_offsets))
+        memory += sys.getsizeof(index.names)
+        yield result(f"tree_walk[{size}]", times, nodes=size, nodes_per_second=size / min(times),
+                     index_bytes=memory)
+    root = fakemega.make_chain(5000)
+    yield result("tree_walk[deep5000]", measure(lambda: build_index(ctx.trees.api, root), ctx.repeat),
+                 nodes=10001)
+
+
+@benchmark("listing")
+def bench_listing(ctx):
+    for size in ctx.trees.sizes:
+        index = ctx.trees.index(size)
+
+        def first_page():
+            ListingPager(index).render()
+
+        def ten_pages():
+            pager = ListingPager(index)
+            pager.render()
+            for _ in range(10):
+                if not pager.next():
+                    break
+                pager.render()
+
+        def collapse_all():
+            pager = ListingPager(index)
+            pager.render()
+            for i in range(1, min(len(index), 2000)):
+                if index.is_folder(i):
+                    pager.collapsed.add(i)
+            pager.render()
+
+        yield result(f"listing.first_page[{size}]", measure(first_page, ctx.repeat, 10), nodes=size)
+        yield result(f"listing.ten_pages[{size}]", measure(ten_pages, ctx.repeat), nodes=size)
+        yield result(f"listing.collapsed[{size}]", measure(collapse_all, ctx.repeat), nodes=size)
+
+
+# --- Selection ---
+
+@benchmark("expand_ranges")
+def bench_expand_ranges(ctx):
+    many = ",".join(f"{i * 3}-{i * 3 + 1}" for i in range(1000))
+    cases = {"single": "5", "wide": "0-199999", "many1000": many}
+    for label, text in cases.items():
+        yield result(f"expand_ranges.{label}", measure(lambda: expand_ranges(text), ctx.repeat, 100),
+                     chars=len(text))
+
+
+SELECTIONS = {
+    "all": "all",
+    "range": "1-5000",
+    "glob": "*.flac",
+    "regex": "/file 0[0-4]/i",
+    "size": "size>100M type:file",
+    "subtree_exclude": "1/ !3/ !*.txt",
+}
+
+
+@benchmark("selection")
+def bench_selection(ctx):
+    size = ctx.trees.sizes[-1]
+    index = ctx.trees.index(size)
+    for label, text in SELECTIONS.items():
+        selected = parse_selection(text, index)
+        yield result(f"selection.parse.{label}[{size}]", measure(lambda: parse_selection(text, index), ctx.repeat),
+                     nodes=size, selected=len(selected))
+        roots = selection_roots(index, selected)
+        yield result(f"selection.roots.{label}[{size}]",
+                     measure(lambda: selection_roots(index, selected), ctx.repeat), roots=len(roots))
+        yield result(f"selection.summarize.{label}[{size}]",
+                     measure(lambda: summarize(index, selected), ctx.repeat))
+
+
+# --- Status rendering and transfer callbacks ---
+
+class FakeTransfer:
+    """Minimal MegaTransfer for driving listener callbacks directly."""
+    __slots__ = ("tag", "folder_tag", "name", "total", "transferred", "speed")
+
+    def __init__(self, tag, name, total, folder_tag=0):
+        self.tag = tag
+        self.folder_tag = folder_tag
+        self.name = name
+        self.total = total
+        self.transferred = 0
+        self.speed = 0
+
+    def getTag(self):
+        return self.tag
+
+    def getFolderTransferTag(self):
+        return self.folder_tag
+
+    def getFileName(self):
+        return self.name
+
+    def getTotalBytes(self):
+        return self.total
+
+    def getTransferredBytes(self):
+        return self.transferred
+
+    def getSpeed(self):
+        return self.speed
+
+    def getMeanSpeed(self):
+        return self.speed
+
+    def getType(self):
+        return MegaTransfer.TYPE_DOWNLOAD
+
+
+def make_listeners(count, finished_ratio=0.5):
+    listeners = []
+    for i in range(count):
+        tl = TransferListener(handle=i)
+        transfer = FakeTransfer(i + 1, f"file {i:05}.flac", 50 * 1024 ** 2)
+        tl.onTransferStart(None, transfer)
+        transfer.transferred = (i * 7919) % transfer.total
+        transfer.speed = 2 * 1024 ** 2
+        tl.onTransferUpdate(None, transfer)
+        if i < count * finished_ratio:
+            transfer.transferred = transfer.total
+            tl.onTransferFinish(None, transfer, MegaError(MegaError.API_EFAILED if i % 10 == 0 else 0))
+        listeners.append(tl)
+    return listeners
+
+
+@benchmark("status")
+def bench_status(ctx):
+    for count in TRANSFER_COUNTS:
+        listeners = make_listeners(count)
+        running = [tl for tl in listeners if not tl.is_finished]
+
+        def lines():
+            for tl in running:
+                tl.getStatus_telegram()
+
+        yield result(f"status.getStatus_telegram[{count}]", measure(lines, ctx.repeat, 10), transfers=len(running))
+        text = format_transfers(listeners, False)
+        yield result(f"status.format_running[{count}]",
+                     measure(lambda: format_transfers(listeners, False), ctx.repeat, 10), chars=len(text))
+        yield result(f"status.format_finished[{count}]",
+                     measure(lambda: format_transfers(listeners, True), ctx.repeat, 10))
+
+
+@benchmark("transfer_update")
+def bench_transfer_update(ctx):
+    calls = 20000 if ctx.quick else 200000
+    TransferListener.log_interval = 30
+    logging.disable(logging.CRITICAL)
+    try:
+        tl = TransferListener()
+        transfer = FakeTransfer(1, "file.bin", calls * 1024)
+        tl.onTransferStart(None, transfer)
+
+        def updates():
+            for _ in range(calls):
+                transfer.transferred += 1024
+                tl.onTransferUpdate(None, transfer)
+
+        times = measure(updates, ctx.repeat)
+        yield result("transfer_update.file", [t / calls for t in times], calls=calls)
+
+        folder = FolderTransferListener(calls * 1024)
+        files = [FakeTransfer(i + 2, f"file {i}.bin", calls * 1024, folder_tag=1) for i in range(8)]
+
+        def folder_updates():
+            for k in range(calls):
+                f = files[k & 7]
+                f.transferred += 1024
+                folder.onTransferUpdate(None, f)
+
+        times = measure(folder_updates, ctx.repeat)
+        yield result("transfer_update.folder", [t / calls for t in times], calls=calls)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+@benchmark("simulated_download")
+def bench_simulated_download(ctx):
+    """A whole folder download through the fake SDK thread, callbacks included."""
+    files = 1000 if ctx.quick else 10000
+    root = fakemega.make_tree(files, fanout=50, folder_ratio=0.02, seed=1, max_size=1024 * 1024)
+    total = fakemega.tree_size(root)
+    MegaApi.simulation = fakemega.Simulation(speed=total * 10, tick=0.1, parallel=8, realtime=False)
+    logging.disable(logging.CRITICAL)
+    try:
+        api = MegaApi("bench")
+        login(api, root)
+
+        def download():
+            done = threading.Event()
+            listener = FolderTransferListener(api.getSize(root), on_finish=done.set)
+            api.startDownload(root, "/nonexistent/bench", listener)
+            done.wait(120)
+            return listener
+
+        times = measure(download, ctx.repeat)
+        listener = download()
+        yield result(f"simulated_download[{files}]", times, files=listener.files_done,
+                     bytes=listener.transfered_size)
+    finally:
+        logging.disable(logging.NOTSET)
+        MegaApi.simulation = fakemega.Simulation()
+
+
+class _Waiter(MegaRequestListener):
+    def __init__(self):
+        self.done = threading.Event()
+
+    def onRequestFinish(self, api, request, error):
+        self.done.set()
+
+
+def login(api, root, link="https://mega.nz/folder/bench#key"):
+    """Logs ``api`` into ``root`` through the fake folder-link requests."""
+    fakemega.register_folder(link, root)
+    for request in (lambda l: api.loginToFolder(link, l), api.fetchNodes):
+        waiter = _Waiter()
+        request(waiter)
+        waiter.done.wait(10)
+
+
+# --- Runner ---
+
+class Context:
+    def __init__(self, quick, repeat):
+        self.quick = quick
+        self.repeat = repeat
+        self.trees = Trees(QUICK_TREE_SIZES if quick else TREE_SIZES)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(HERE),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Returns (name, old, new) for results slower than ``baseline`` by more than ``threshold``."""
+    old = {r["name"]: r["best"] for r in baseline["results"]}
+    slower = []
+    for r in results:
+        before = old.get(r["name"])
+        if before and r["best"] > before * (1 + threshold):
+            slower.append((r["name"], before, r["best"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="match", help="only run benchmarks whose name contains this")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs for a fast check")
+    parser.add_argument("--repeat", type=int, default=None, help="runs per benchmark (default 5, 3 with --quick)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    ctx = Context(args.quick, args.repeat or (3 if args.quick else 5))
+    results = []
+    for name, fn in _benchmarks:
+        if args.match and args.match not in name:
+            continue
+        started = time.perf_counter()
+        results.extend(fn(ctx))
+        print(f"{name}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "quick": args.quick,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        for name, before, after in slower:
+            print(f"REGRESSION {name}: {before * 1e3:.3f}ms -> {after * 1e3:.3f}ms", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
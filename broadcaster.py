@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter
+
+# BadRequests after which the message can never be edited again
+GONE_ERRORS = ("message to edit not found", "chat not found", "message can't be edited")
+
+
+class TokenBucket:
+    """Spaces out Telegram API calls to ``rate`` per second with bursts of ``capacity``."""
+    def __init__(self, rate=20, capacity=20):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+
+    def block(self, seconds):
+        """Stops handing out tokens for ``seconds`` (e.g. after a RetryAfter)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _StatusMessage:
+    __slots__ = ("chat_id", "message_id", "render", "on_done", "last")
+
+    def __init__(self, chat_id, message_id, render, on_done):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.render = render
+        self.on_done = on_done
+        self.last = None
+
+
+class StatusBroadcaster:
+    """Single task that keeps every registered status message up to date.
+
+    Each tick renders all messages, skips those whose text and buttons are
+    unchanged and spends tokens from one global bucket on the rest. When a
+    tick has more changes than the bucket can pay for within ``interval`` the
+    next tick is pushed back, up to ``max_interval``.
+    """
+    def __init__(self, interval=2, max_interval=30, rate=20):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.bucket = TokenBucket(rate, rate)
+        self.bot = None
+        self._messages = {}
+        self._task = None
+
+    def register(self, bot, chat_id, message_id, render, on_done=None):
+        """Tracks a status message.
+
+        ``render()`` returns (text, reply_markup, done). Once a tick renders
+        ``done`` and the final text is sent, the message is dropped and
+        ``await on_done()`` runs. The same happens as soon as the message
+        can't be edited any more (the bot was blocked, the message deleted),
+        so whatever ``on_done`` tears down isn't left behind.
+        """
+        self.bot = bot
+        self._messages[(chat_id, message_id)] = _StatusMessage(chat_id, message_id, render, on_done)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unregister(self, chat_id, message_id):
+        self._messages.pop((chat_id, message_id), None)
+
+    async def _run(self):
+        while self._messages:
+            started = time.monotonic()
+            edits = 0
+            for key, message in list(self._messages.items()):
+                try:
+                    edits += await self._update(message)
+                except Exception as e:
+                    logging.warning(f"Failed to render status message {key}: {e}")
+            elapsed = time.monotonic() - started
+            delay = min(self.max_interval, max(self.interval, edits / self.bucket.rate))
+            await asyncio.sleep(max(0, delay - elapsed))
+
+    async def _update(self, message):
+        text, markup, done = message.render()
+        state = (text, markup.to_json() if markup else None)
+        if state == message.last:
+            if done:
+                await self._finish(message)
+            return 0
+        await self.bucket.acquire()
+        if (message.chat_id, message.message_id) not in self._messages:
+            return 0  # unregistered while waiting for a token
+        try:
+            await self.bot.edit_message_text(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                text=text,
+                reply_markup=markup,
+                parse_mode=ParseMode.MARKDOWN,
+            )
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logging.warning(f"Flood limit hit, pausing status edits for {retry_after}s")
+            self.bucket.block(retry_after)
+            return 1
+        except (Forbidden, ChatMigrated) as e:
+            return await self._gone(message, e)
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in GONE_ERRORS):
+                return await self._gone(message, e)
+            if "not modified" not in str(e):
+                logging.warning(f"Failed to edit status message: {e}")
+        message.last = state
+        if done:
+            await self._finish(message)
+        return 1
+
+    async def _gone(self, message, error):
+        """Drops a message that can't be edited any more; its ``on_done`` still runs."""
+        logging.warning(f"Status message {(message.chat_id, message.message_id)} is gone, dropping it: {error}")
+        await self._finish(message)
+        return 1
+
+    async def _finish(self, message):
+        self.unregister(message.chat_id, message.message_id)
+        if message.on_done is not None:
+            await message.on_done()
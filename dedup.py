@@ -0,0 +1,130 @@
+import logging
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    handle INTEGER,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS files_handle ON files (handle);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+# Partial downloads the SDK keeps next to their target
+TEMP_PREFIXES = (".getxfer.",)
+
+
+class DownloadIndex:
+    """Persistent map of Mega node handles and fingerprints to local files.
+
+    Finished downloads are recorded with their handle and fingerprint. A
+    periodic scan of the downloads directory picks up files that got there
+    some other way; only their size and mtime are stored, and a fingerprint
+    is computed lazily the first time a node of the same size is looked up.
+    Safe to use from several threads.
+    """
+    def __init__(self, path, skip_dirs=()):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.skip_dirs = {os.path.abspath(d) for d in skip_dirs}
+
+    def record(self, path, size, handle=None, fingerprint=None):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, handle, fingerprint) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime, handle, fingerprint),
+            )
+
+    def scan(self, root):
+        """Brings the index in line with ``root``; unchanged files cost one stat each."""
+        with self._lock:
+            known = {p: (s, m) for p, s, m in self._db.execute("SELECT path, size, mtime FROM files")}
+        seen = set()
+        changed = []
+        stack = [root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError as e:
+                logging.warning(f"Couldn't scan {e.filename}: {e.strerror}")
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.abspath(entry.path) not in self.skip_dirs:
+                            stack.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False) or entry.name.startswith(TEMP_PREFIXES):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    seen.add(entry.path)
+                    if known.get(entry.path) != (st.st_size, st.st_mtime):
+                        changed.append((entry.path, st.st_size, st.st_mtime))
+        gone = [(p,) for p in known if p not in seen]
+        with self._lock, self._db:
+            # A changed file keeps no handle or fingerprint: its content may differ
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime, handle, fingerprint) VALUES (?, ?, ?, NULL, NULL)",
+                changed,
+            )
+            self._db.executemany("DELETE FROM files WHERE path = ?", gone)
+        if changed or gone:
+            logging.info(f"Download index: {len(changed)} new or changed, {len(gone)} removed")
+
+    def find(self, handle, size, fingerprint, local_fingerprint):
+        """Returns the path of an existing copy of a node, or None.
+
+        Matches by handle first, then by fingerprint among files of the same
+        size; ``local_fingerprint(path)`` computes missing fingerprints.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size, mtime FROM files WHERE handle = ? AND size = ?", (handle, size)
+            ).fetchall()
+        for path, _, mtime in rows:
+            if self._unchanged(path, size, mtime):
+                return path
+        if not fingerprint:
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, size, mtime, fingerprint FROM files WHERE size = ?", (size,)
+            ).fetchall()
+        for path, _, mtime, known in rows:
+            if not self._unchanged(path, size, mtime):
+                continue
+            if known is None:
+                known = local_fingerprint(path)
+                if known is None:
+                    continue
+                with self._lock:
+                    self._db.execute("UPDATE files SET fingerprint = ? WHERE path = ?", (known, path))
+            if known == fingerprint:
+                return path
+        return None
+
+    def _unchanged(self, path, size, mtime):
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+            return False
+        return st.st_size == size and st.st_mtime == mtime
+
+    def close(self):
+        with self._lock:
+            self._db.close()
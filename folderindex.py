@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from mega import MegaNode
+
+from metrics import TREE_WALK_SECONDS
+from utils import convert_size
+
+
+class FolderIndex:
+    """Compact, array-backed pre-order listing of a Mega folder tree.
+
+    Entry ``i`` is described by parallel arrays: its node handle, the index of
+    its parent (-1 for the root), its depth, its size (-1 for folders), the
+    index one past the end of its subtree and the offset of its name in one
+    shared string. Entries are numbered exactly like the old tab-indented
+    listing, so indices typed by users stay the same.
+    """
+    __slots__ = ("handles", "parents", "depths", "sizes", "ends", "name_offsets", "names", "built_at")
+
+    def __init__(self):
+        self.handles = array("Q")
+        self.parents = array("i")
+        self.depths = array("H")
+        self.sizes = array("q")
+        self.ends = array("i")
+        self.name_offsets = array("L", [0])
+        self.names = ""
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.handles)
+
+    def name(self, i):
+        return self.names[self.name_offsets[i]:self.name_offsets[i + 1]]
+
+    def is_folder(self, i):
+        return self.sizes[i] < 0
+
+    def format_entry(self, i):
+        """Formats entry ``i`` the way the listing shows it (no index prefix)."""
+        depth = self.depths[i]
+        if self.sizes[i] < 0:
+            return "\t" * depth + "./" + self.name(i)
+        return "\t" * depth + self.name(i) + "\t" + convert_size(self.sizes[i])
+
+    def subtree_size(self, i):
+        """Total bytes of the files at or below entry ``i``."""
+        return sum(s for s in self.sizes[i:self.ends[i]] if s > 0)
+
+
+def build_index(api, root):
+    """Walks the tree under ``root`` iteratively and returns a FolderIndex.
+
+    Child lists are kept on an explicit stack so deep trees can't hit the
+    recursion limit; each MegaNodeList stays referenced while its nodes are
+    in use since the nodes it returns are owned by the list.
+    """
+    with TREE_WALK_SECONDS.time():
+        return _walk(api, root)
+
+
+def _walk(api, root):
+    index = FolderIndex()
+    handles, parents, depths, sizes = index.handles, index.parents, index.depths, index.sizes
+    offsets = index.name_offsets
+    names = []
+    name_len = 0
+    stack = []
+
+    def visit(node, parent, depth):
+        nonlocal name_len
+        i = len(handles)
+        name = node.getName() or ""
+        handles.append(node.getHandle())
+        parents.append(parent)
+        depths.append(depth)
+        names.append(name)
+        name_len += len(name)
+        offsets.append(name_len)
+        if node.getType() == MegaNode.TYPE_FILE:
+            sizes.append(node.getSize())
+            return
+        sizes.append(-1)
+        children = api.getChildren(node)
+        count = children.size()
+        if count:
+            stack.append([children, 0, count, i, depth + 1])
+
+    visit(root, -1, 0)
+    while stack:
+        frame = stack[-1]
+        children, k, count, parent, depth = frame
+        if k >= count:
+            stack.pop()
+            continue
+        frame[1] = k + 1
+        visit(children.get(k), parent, depth)
+
+    index.names = "".join(names)
+    n = len(handles)
+    ends = array("i", range(1, n + 1))
+    for i in range(n - 1, 0, -1):
+        p = parents[i]
+        if ends[i] > ends[p]:
+            ends[p] = ends[i]
+    index.ends = ends
+    return index
+
+
+class IndexCache:
+    """LRU + TTL cache of FolderIndex objects keyed by folder link or handle.
+
+    Concurrent requests for the same key share a single tree walk.
+    """
+    def __init__(self, max_entries=32, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._building = {}
+
+    def get(self, key):
+        index = self._entries.get(key)
+        if index is None:
+            return None
+        if time.monotonic() - index.built_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return index
+
+    def put(self, key, index):
+        self._entries[key] = index
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_build(self, key, api, root):
+        """Returns the cached index for ``key``, walking ``root`` in a thread on a miss."""
+        index = self.get(key)
+        if index is not None:
+            return index
+        building = self._building.get(key)
+        if building is not None:
+            return await asyncio.shield(building)
+        task = asyncio.ensure_future(asyncio.to_thread(build_index, api, root))
+        self._building[key] = task
+        try:
+            started = time.monotonic()
+            index = await asyncio.shield(task)
+            logging.info(f"Indexed {len(index)} nodes in {time.monotonic() - started:.2f}s")
+            self.put(key, index)
+            return index
+        finally:
+            self._building.pop(key, None)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers  # lower-cased names
+        self.body = body
+
+
+class HTTPServer:
+    """Small HTTP/1.1 server running on the bot's own event loop.
+
+    Handlers are coroutines registered per (method, path) that take a
+    Request and return (status, content_type, body). Connections are kept
+    alive between requests for up to ``keepalive_timeout`` idle seconds, so
+    frequent callers such as Telegram's webhook delivery don't pay for a new
+    (TLS) connection every time.
+    """
+    def __init__(self, keepalive_timeout=15):
+        self.keepalive_timeout = keepalive_timeout
+        self._routes = {}
+        self._server = None
+        self._closing = False
+        self._idle = set()  # writers of connections waiting for their next request
+        self._connections = set()  # tasks serving a connection
+
+    def route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def start(self, host, port, ssl=None):
+        self._closing = False
+        self._server = await asyncio.start_server(self._handle, host, port, ssl=ssl)
+        logging.info(f"HTTP server listening on {host}:{port}{' (TLS)' if ssl else ''}")
+
+    async def stop(self, timeout=10):
+        """Stops listening, closes idle connections and lets requests in progress finish."""
+        if self._server is None:
+            return
+        self._closing = True
+        self._server.close()
+        for writer in list(self._idle):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=timeout)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive and not self._closing:
+                self._idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError):
+                    return
+                finally:
+                    self._idle.discard(writer)
+                try:
+                    status, content_type, body, keep_alive = await self._dispatch(head, reader)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                except Exception as e:
+                    logging.error(f"HTTP handler failed: {e}")
+                    status, content_type, body, keep_alive = 500, "text/plain", b"internal error\n", False
+                keep_alive = keep_alive and not self._closing
+                if isinstance(body, str):
+                    body = body.encode()
+                head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+                try:
+                    writer.write(head.encode("latin-1") + body)
+                    await writer.drain()
+                except ConnectionError:
+                    return
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _dispatch(self, head, reader):
+        """Reads the rest of a request and runs its handler; returns (status, content_type, body, keep_alive)."""
+        if len(head) > MAX_HEADER_BYTES:
+            return 400, "text/plain", "headers too large\n", False
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            return 400, "text/plain", "bad request line\n", False
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        path, _, query = target.partition("?")
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            return 400, "text/plain", "bad content length\n", False
+        if length > MAX_BODY_BYTES:
+            return 413, "text/plain", "body too large\n", False
+        body = await reader.readexactly(length) if length else b""
+
+        handler = self._routes.get((method, path))
+        if handler is None:
+            if any(p == path for _, p in self._routes):
+                return 405, "text/plain", "method not allowed\n", keep_alive
+            return 404, "text/plain", "not found\n", keep_alive
+        status, content_type, body = await handler(Request(method, path, query, headers, body))
+        return status, content_type, body, keep_alive
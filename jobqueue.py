@@ -0,0 +1,325 @@
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from metrics import DOWNLOADED_BYTES
+from transferlistener import TransferListener
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE,
+    session_key INTEGER,
+    chat_id INTEGER,
+    link TEXT NOT NULL,
+    handle INTEGER,
+    save_to TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    transferred INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, id);
+"""
+
+# Job states; a worker reports 'queued' for a job it gives back unfinished
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL = (DONE, FAILED, CANCELLED)
+
+TOKEN_HEADER = "x-megabot-worker-token"
+POLL_PATH = "/workers/poll"
+
+
+class JobQueue:
+    """SQLite queue of downloads handed to worker processes.
+
+    Only the front-end opens the database; workers claim jobs and report
+    progress through the WorkerHub endpoint. A claimed job is leased to its
+    worker until ``lease_until`` and every report extends the lease; jobs
+    of a worker that stops reporting go back to the queue. Jobs of
+    journaled sessions carry a ``key`` (journal id and handle) so a
+    restarted front-end re-attaches to them instead of queuing them twice.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def enqueue(self, link, handle, save_to, priority=0, chat_id=None, key=None, session_key=None):
+        """Queues a download; returns (id, state, transferred, total, error) of the job it went to."""
+        with self._db:
+            if key is not None:
+                row = self._db.execute(
+                    "SELECT id, state, transferred, total, error FROM jobs WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] != CANCELLED:
+                    return row
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, worker = NULL, error = NULL, updated = ? WHERE id = ?",
+                        (QUEUED, time.time(), row[0]),
+                    )
+                    return row[0], QUEUED, row[2], row[3], None
+            cur = self._db.execute(
+                "INSERT INTO jobs (key, session_key, chat_id, link, handle, save_to, priority, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, session_key, chat_id, link, handle, save_to, priority, time.time()),
+            )
+            return cur.lastrowid, QUEUED, 0, 0, None
+
+    def claim(self, worker, limit, lease_until):
+        """Leases up to ``limit`` queued jobs to ``worker``, best priority first."""
+        with self._db:
+            rows = self._db.execute(
+                "SELECT id, link, handle, save_to FROM jobs WHERE state = ? ORDER BY priority, id LIMIT ?",
+                (QUEUED, limit),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, updated = ? WHERE id = ?",
+                ((RUNNING, worker, lease_until, time.time(), row[0]) for row in rows),
+            )
+        return [{"id": row[0], "link": row[1], "handle": row[2], "save_to": row[3]} for row in rows]
+
+    def report(self, worker, rows, lease_until):
+        """Stores (id, state, transferred, total, error) rows from ``worker`` and extends its leases.
+
+        Returns the reported ids that are no longer the worker's to run
+        (cancelled, or handed to another worker after its lease ran out).
+        """
+        now = time.time()
+        with self._db:
+            owned = {row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE worker = ? AND state = ?", (worker, RUNNING)
+            )}
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, transferred = ?, total = ?, error = ?,"
+                " updated = ? WHERE id = ?",
+                ((state, None if state == QUEUED else worker, lease_until, transferred, total, error, now, job_id)
+                 for job_id, state, transferred, total, error in rows if job_id in owned),
+            )
+        return {row[0] for row in rows} - owned
+
+    def cancel(self, ids):
+        with self._db:
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND state IN (?, ?)",
+                ((CANCELLED, time.time(), job_id, QUEUED, RUNNING) for job_id in ids),
+            )
+
+    def expire(self, now):
+        """Puts jobs whose worker stopped reporting back in the queue; returns their ids."""
+        with self._db:
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE state = ? AND lease_until < ?", (RUNNING, now)
+            )]
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, worker = NULL, updated = ? WHERE id = ?",
+                ((QUEUED, now, job_id) for job_id in ids),
+            )
+        return ids
+
+    def cancel_orphans(self, session_keys):
+        """Cancels unfinished jobs of sessions that won't be resumed, e.g. after a restart."""
+        keys = list(session_keys)
+        marks = ", ".join("?" * len(keys))
+        cur = self._db.execute(
+            f"UPDATE jobs SET state = ?, updated = ? WHERE state IN (?, ?)"
+            f" AND (session_key IS NULL OR session_key NOT IN ({marks}))",
+            (CANCELLED, time.time(), QUEUED, RUNNING, *keys),
+        )
+        return cur.rowcount
+
+    def purge(self, older_than):
+        """Deletes finished jobs last updated before ``older_than``."""
+        cur = self._db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?, ?) AND updated < ?", (*FINAL, older_than)
+        )
+        return cur.rowcount
+
+    def counts(self):
+        """Returns {state: jobs} for unfinished jobs."""
+        return dict(self._db.execute(
+            "SELECT state, COUNT(*) FROM jobs WHERE state IN (?, ?) GROUP BY state", (QUEUED, RUNNING)
+        ).fetchall())
+
+    def close(self):
+        try:
+            self._db.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to close job queue: {e}")
+
+
+class RemoteTransfer(TransferListener):
+    """Status of a download running on a worker process, fed by its reports.
+
+    Never registered with the SDK; it stands in for a TransferListener in
+    a session's ``current_dls`` so status messages, the journal and the
+    bandwidth manager treat both alike. ``paused``, ``speed_limit`` and
+    ``connections`` are set by the session and sent to the worker.
+    """
+    def __init__(self, name, total_size, is_folder=False, on_finish=None, handle=None):
+        super(RemoteTransfer, self).__init__(on_finish, handle)
+        self.set_name(name)
+        self.total_size = total_size or 1 # Avoid divide by zero
+        self.job_id = None
+        self.is_folder = is_folder
+        self.waiting = True  # queued until a worker claims it
+        self.files_done = 0
+        self.files_failed = 0
+        self.paused = False
+        self.speed_limit = 0
+        self.connections = None
+
+    def apply(self, report):
+        """Takes over the progress in one of the worker's report rows."""
+        self.waiting = False
+        transferred = int(report.get("transferred", 0))
+        if transferred > self.transfered_size:
+            DOWNLOADED_BYTES.inc(transferred - self.transfered_size)
+            self.transfered_size = transferred
+        self.total_size = int(report.get("total") or self.total_size)
+        self.speed = report.get("speed", 0)
+        self.smooth_speed = report.get("smooth_speed", self.speed)
+        self.over_quota = bool(report.get("over_quota"))
+        self.error = report.get("error")
+        self.files_done = report.get("files_done", 0)
+        self.files_failed = report.get("files_failed", 0)
+
+    def finish(self, error=None):
+        if self.is_finished:
+            return
+        self.is_finished = True
+        self.error = error
+        if self.on_finish is not None:
+            self.on_finish()
+
+    def getStatus_telegram(self, size=15):
+        if self.waiting and not self.is_finished:
+            return f"{self.transfer_name} Waiting for a worker"
+        status = super(RemoteTransfer, self).getStatus_telegram(size)
+        if not self.is_folder:
+            return status
+        return status + f" ({self.files_done} files" + (f", {self.files_failed} failed)" if self.files_failed else ")")
+
+
+class WorkerHub:
+    """Front-end end of the remote download workers.
+
+    Sessions hand their downloads to ``submit`` instead of starting them on
+    their own MegaApi. Workers POST to ``/workers/poll`` every few seconds
+    with their progress and free slots; the answer carries the jobs they
+    claimed and, per running job, whether to pause or cancel it and its
+    speed limit and connections. Workers need the shared token, the same
+    links and the same downloads volume path as the front-end.
+    """
+    def __init__(self, queue, token, lease=60):
+        self.queue = queue
+        self.token = token.encode()
+        self.lease = lease
+        self.on_over_quota = None  # called with the server's wait in seconds
+        self.workers = {}  # worker id -> (last poll, slots, running jobs)
+        self._transfers = {}  # job id -> RemoteTransfer
+
+    def attach(self, http_server):
+        http_server.route("POST", POLL_PATH, self._poll)
+
+    def submit(self, transfer, link, handle, save_to, priority=0, chat_id=None, key=None, session_key=None):
+        """Queues ``transfer``'s download, or re-attaches it to the job queued under ``key`` before."""
+        job_id, state, transferred, total, error = self.queue.enqueue(
+            link, handle, save_to, priority, chat_id, key, session_key
+        )
+        transfer.job_id = job_id
+        transfer.transfered_size = transferred
+        transfer.total_size = total or transfer.total_size
+        if state in FINAL:
+            transfer.finish(error if state != DONE else None)
+            return
+        transfer.waiting = state == QUEUED
+        self._transfers[job_id] = transfer
+
+    def cancel(self, transfers):
+        """Cancels the jobs of unfinished ``transfers``; their workers drop them on their next poll."""
+        ids = [t.job_id for t in transfers if t.job_id is not None and not t.is_finished]
+        self.queue.cancel(ids)
+        for job_id in ids:
+            transfer = self._transfers.pop(job_id, None)
+            if transfer is not None:
+                transfer.finish("Cancelled")
+
+    def expire(self):
+        """Requeues the jobs of workers that stopped polling and forgets those workers."""
+        now = time.time()
+        for job_id in self.queue.expire(now):
+            transfer = self._transfers.get(job_id)
+            if transfer is not None:
+                transfer.waiting = True
+                transfer.speed = transfer.smooth_speed = 0
+        for worker, (seen, _, _) in list(self.workers.items()):
+            if seen < now - self.lease:
+                logging.warning(f"Worker {worker} stopped polling")
+                del self.workers[worker]
+
+    def _controls(self, job_id):
+        transfer = self._transfers.get(job_id)
+        if transfer is None:
+            return {}  # re-attached once its session is resumed
+        return {"paused": transfer.paused, "speed_limit": transfer.speed_limit, "connections": transfer.connections}
+
+    async def _poll(self, request):
+        if not hmac.compare_digest(request.headers.get(TOKEN_HEADER, "").encode(), self.token):
+            return 403, "text/plain", "forbidden\n"
+        try:
+            message = json.loads(request.body)
+            worker = str(message["worker"])
+            reports = {int(r["id"]): r for r in message.get("jobs", [])}
+            free = int(message.get("free", 0))
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Rejected malformed worker poll: {e}")
+            return 400, "text/plain", "bad poll\n"
+
+        now = time.time()
+        rows = [(job_id, r.get("state", RUNNING), int(r.get("transferred", 0)), int(r.get("total", 0)),
+                 r.get("error")) for job_id, r in reports.items()]
+        lost = self.queue.report(worker, rows, now + self.lease)
+        running = []
+        for job_id, report in reports.items():
+            state = report.get("state", RUNNING)
+            transfer = self._transfers.get(job_id)
+            if job_id in lost:
+                continue
+            if state == RUNNING:
+                running.append(job_id)
+            if transfer is None:
+                continue
+            if state == QUEUED:
+                transfer.waiting = True
+            else:
+                transfer.apply(report)
+            if state in FINAL:
+                del self._transfers[job_id]
+                transfer.finish(report.get("error") if state != DONE else None)
+        if message.get("over_quota_wait") is not None and self.on_over_quota is not None:
+            self.on_over_quota(max(0, message["over_quota_wait"]))
+
+        claimed = self.queue.claim(worker, free, now + self.lease) if free > 0 else []
+        for job in claimed:
+            running.append(job["id"])
+            transfer = self._transfers.get(job["id"])
+            if transfer is not None:
+                transfer.waiting = False
+        controls = {str(job_id): self._controls(job_id) for job_id in running}
+        for job_id in lost:
+            controls[str(job_id)] = {"cancel": True}
+        self.workers[worker] = (now, free - len(claimed) + len(running), len(running))
+        if claimed:
+            logging.info(f"Worker {worker} claimed {len(claimed)} job(s)")
+        return 200, "application/json", json.dumps({"jobs": claimed, "controls": controls})
@@ -0,0 +1,107 @@
+import logging
+import os
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    link TEXT NOT NULL,
+    save_to TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    category TEXT NOT NULL DEFAULT '',
+    status_chat_id INTEGER,
+    status_message_id INTEGER,
+    created REAL NOT NULL,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transfers (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    handle INTEGER NOT NULL,
+    save_to TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    transferred INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, handle)
+);
+"""
+
+# Columns added since the first schema, with their definitions for older journals
+ADDED_COLUMNS = {"sessions": [("category", "TEXT NOT NULL DEFAULT ''")]}
+
+# Transfer states; 'queued' and 'active' rows are resumed after a restart
+QUEUED, ACTIVE, DONE, FAILED = "queued", "active", "done", "failed"
+
+
+class Journal:
+    """SQLite record of download sessions so they survive a restart.
+
+    Sessions are journaled once the user has picked what to download. The
+    selected handles, target directories, category, status message and
+    progress are stored; closed sessions (finished or cancelled) are
+    skipped on resume.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            for name, definition in columns:
+                if name not in existing:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def open_session(self, chat_id, link, save_to, priority=0, category=""):
+        cur = self._db.execute(
+            "INSERT INTO sessions (chat_id, link, save_to, priority, category, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, link, save_to, priority, category, time.time()),
+        )
+        return cur.lastrowid
+
+    def set_status_message(self, session_id, chat_id, message_id):
+        self._db.execute(
+            "UPDATE sessions SET status_chat_id = ?, status_message_id = ? WHERE id = ?",
+            (chat_id, message_id, session_id),
+        )
+
+    def add_transfers(self, session_id, transfers):
+        """Records (handle, save_to) downloads of a session."""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO transfers (session_id, handle, save_to) VALUES (?, ?, ?)",
+                ((session_id, h, save_to) for h, save_to in transfers),
+            )
+
+    def update_transfers(self, session_id, rows):
+        """Stores (handle, state, transferred, total) progress rows in one transaction."""
+        with self._db:
+            self._db.executemany(
+                "UPDATE transfers SET state = ?, transferred = ?, total = ? WHERE session_id = ? AND handle = ?",
+                ((state, transferred, total, session_id, h) for h, state, transferred, total in rows),
+            )
+
+    def close_session(self, session_id):
+        self._db.execute("UPDATE sessions SET closed = 1 WHERE id = ?", (session_id,))
+
+    def unfinished_sessions(self):
+        """Returns (id, chat_id, link, save_to, priority, category, status_chat_id, status_message_id) rows."""
+        return self._db.execute(
+            "SELECT id, chat_id, link, save_to, priority, category, status_chat_id, status_message_id"
+            " FROM sessions WHERE closed = 0 ORDER BY id"
+        ).fetchall()
+
+    def pending_transfers(self, session_id):
+        """Returns (handle, save_to) for transfers that never finished."""
+        return self._db.execute(
+            "SELECT handle, save_to FROM transfers WHERE session_id = ? AND state IN (?, ?)",
+            (session_id, QUEUED, ACTIVE),
+        ).fetchall()
+
+    def close(self):
+        try:
+            self._db.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to close journal: {e}")
@@ -0,0 +1,105 @@
+from itertools import islice
+
+PAGE_LINES = 60
+PAGE_CHARS = 3500  # leaves room for markup under Telegram's 4096 limit
+MAX_TOGGLES = 8  # collapse/expand buttons per page
+
+
+def iter_visible(index, start, collapsed):
+    """Yields the indices shown from ``start`` on, skipping collapsed subtrees."""
+    ends = index.ends
+    n = len(index)
+    i = start
+    while i < n:
+        yield i
+        i = ends[i] if i in collapsed else i + 1
+
+
+def iter_lines(index, start, collapsed):
+    """Yields (index, line) pairs lazily, one listing line per visible entry."""
+    for i in iter_visible(index, start, collapsed):
+        line = f"{i} {index.format_entry(i)}"
+        if i in collapsed:
+            line += f" [+{index.ends[i] - i - 1} hidden]"
+        yield i, line
+
+
+class ListingPager:
+    """Splits a FolderIndex listing into Telegram-sized pages on demand.
+
+    Only the page being shown is rendered. Start positions of visited pages
+    are remembered so "previous" doesn't need to re-scan from the top.
+    """
+    def __init__(self, index, page_lines=PAGE_LINES, page_chars=PAGE_CHARS):
+        self.index = index
+        self.page_lines = page_lines
+        self.page_chars = page_chars
+        self.collapsed = set()
+        self.starts = [0]
+        self.page = 0
+        self._next_start = None
+        self._folders = []
+
+    def render(self):
+        """Returns the current page as a Markdown code block."""
+        lines = []
+        folders = []
+        length = 0
+        self._next_start = None
+        ends = self.index.ends
+        for i, line in islice(iter_lines(self.index, self.starts[self.page], self.collapsed), self.page_lines + 1):
+            if len(lines) == self.page_lines or (lines and length + len(line) + 1 > self.page_chars):
+                self._next_start = i
+                break
+            line = line[:self.page_chars]
+            lines.append(line)
+            length += len(line) + 1
+            if ends[i] > i + 1:
+                folders.append(i)
+        self._folders = folders
+        if not lines:
+            return "Empty folder."
+        return "```\n" + "\n".join(lines) + "\n```"
+
+    def buttons(self):
+        """Returns keyboard rows of (label, callback_data) for the rendered page."""
+        rows = []
+        toggles = [
+            (f"{'▸' if i in self.collapsed else '▾'} {i}", f"ls:tog:{i}")
+            for i in self._folders[:MAX_TOGGLES]
+        ]
+        for k in range(0, len(toggles), 4):
+            rows.append(toggles[k:k + 4])
+        nav = []
+        if self.page > 0:
+            nav.append(("◀ Prev", "ls:prev"))
+        if self._next_start is not None:
+            nav.append(("Next ▶", "ls:next"))
+        if nav:
+            rows.append(nav)
+        return rows
+
+    def next(self):
+        if self._next_start is None:
+            return False
+        del self.starts[self.page + 1:]
+        self.starts.append(self._next_start)
+        self.page += 1
+        return True
+
+    def prev(self):
+        if self.page == 0:
+            return False
+        self.page -= 1
+        return True
+
+    def toggle(self, i):
+        """Collapses or expands folder ``i``; later page boundaries are recomputed."""
+        if i < 0 or i >= len(self.index) or not self.index.is_folder(i):
+            return False
+        if i in self.collapsed:
+            self.collapsed.discard(i)
+        else:
+            self.collapsed.add(i)
+        del self.starts[self.page + 1:]
+        return True
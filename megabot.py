@@ -1,8 +1,12 @@
 import logging
 import os
+import re
 import shlex
 import asyncio
-import math
+import secrets
+import signal
+import ssl
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -11,86 +15,371 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 
 # Import your existing Mega helper classes
-from requestlistener import RequestListener
-from transferlistener import TransferListener
-from mega import (MegaApi, MegaNode, MegaTransfer)
+from requestlistener import RequestListener, RequestError
+from transferlistener import TransferListener, FolderTransferListener
+from megapool import MegaApiPool, PoolExhausted
+from sdkcache import SdkCache
+from folderindex import IndexCache, build_index
+from listing import ListingPager
+from scheduler import DownloadScheduler
+from bandwidth import BandwidthManager, parse_rate
+from broadcaster import StatusBroadcaster
+from httpserver import HTTPServer
+from webhook import Webhook
+from updateprocessor import ChatSerialUpdateProcessor
+from journal import Journal, ACTIVE, DONE, FAILED
+from jobqueue import JobQueue, RemoteTransfer, WorkerHub
+from quota import QuotaManager
+from dedup import DownloadIndex
+from status import format_transfers, format_jobs, format_batch
+from postprocess import Pipeline, PostJob, load_plugins, parse_steps
+from sessions import SessionRegistry
+from selection import SelectionError, parse_selection, relative_dir, selection_roots, summarize
+from utils import convert_size, parse_size, is_folder_link
+from metrics import (REGISTRY, Gauge, SDK_REQUEST_SECONDS, TELEGRAM_API_SECONDS,
+                     EVENT_LOOP_LAG_SECONDS, FOLDER_OPEN_SECONDS)
+from mega import (MegaNode, MegaTransfer, MegaRequest)
 
 # Load Environment Variables
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # token is appended
+TELEGRAM_CONNECTIONS = int(os.getenv("TELEGRAM_CONNECTIONS", "64"))  # concurrent Bot API requests
 API_KEY = os.getenv("API_KEY")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "300"))  # seconds per SDK request
+MEGA_POOL_SIZE = int(os.getenv("MEGA_POOL_SIZE", "16"))  # max concurrent MegaApi workers, one per open session
+MEGA_POOL_IDLE_TIMEOUT = float(os.getenv("MEGA_POOL_IDLE_TIMEOUT", "300"))  # seconds
+MEGA_POOL_ACQUIRE_TIMEOUT = float(os.getenv("MEGA_POOL_ACQUIRE_TIMEOUT", "15"))  # seconds; the chat waits meanwhile
+SDK_CACHE_DIR = os.getenv("SDK_CACHE_DIR")  # SDK node caches per folder link; DATA_DIR/sdkcache by default
+SDK_CACHE_MAX_SIZE = parse_size(os.getenv("SDK_CACHE_MAX_SIZE", "10G"))  # 0 disables the cache
+SDK_CACHE_SLOTS = int(os.getenv("SDK_CACHE_SLOTS", "2"))  # caches per link, for sessions opening it at once
+SDK_CACHE_EVICT_INTERVAL = float(os.getenv("SDK_CACHE_EVICT_INTERVAL", "600"))  # seconds
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "32"))  # folder listings kept in memory
+INDEX_CACHE_TTL = float(os.getenv("INDEX_CACHE_TTL", "900"))  # seconds
+MAX_ACTIVE_DOWNLOADS = int(os.getenv("MAX_ACTIVE_DOWNLOADS", "6"))  # across all chats
+MAX_CHAT_DOWNLOADS = int(os.getenv("MAX_CHAT_DOWNLOADS", "3"))  # per chat
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", "2"))  # seconds between status refreshes
+STATUS_MAX_INTERVAL = float(os.getenv("STATUS_MAX_INTERVAL", "30"))  # ceiling under load
+STATUS_EDITS_PER_SECOND = float(os.getenv("STATUS_EDITS_PER_SECOND", "20"))  # global edit budget
+MAX_CHAT_SESSIONS = int(os.getenv("MAX_CHAT_SESSIONS", "2"))  # open sessions per chat; keep well below MEGA_POOL_SIZE
+BATCH_MAX_LINKS = int(os.getenv("BATCH_MAX_LINKS", "200"))  # links per /batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # links of one batch resolved at once
+BATCH_FOLDER_WORKERS = int(os.getenv("BATCH_FOLDER_WORKERS", "2"))  # pool workers all batches may use for folder links
+BATCH_MAX_FILE_SIZE = int(os.getenv("BATCH_MAX_FILE_SIZE", str(1024 * 1024)))  # bytes of an attached link list
+STATUS_MAX_LINES = int(os.getenv("STATUS_MAX_LINES", "20"))  # transfer lines per status message
+TRANSFER_LOG_INTERVAL = float(os.getenv("TRANSFER_LOG_INTERVAL", "30"))  # seconds between progress log lines
+TRANSFER_LOG_LEVEL = os.getenv("TRANSFER_LOG_LEVEL", "DEBUG").upper()  # level of progress log lines
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8000"))  # serves /metrics and the webhook
+HTTP_TLS_CERT = os.getenv("HTTP_TLS_CERT")  # HTTPS when both cert and key are set
+HTTP_TLS_KEY = os.getenv("HTTP_TLS_KEY")
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # updates handled at once, one per chat
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))  # updates taken in, waiting for their chat included
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL of this server (WEBHOOK_PATH is appended); long polling when unset
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # parallel deliveries from Telegram
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))  # queued updates before answering 503
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # seconds
+WEBHOOK_SELF_SIGNED = os.getenv("WEBHOOK_SELF_SIGNED", "").lower() in ("1", "true", "yes")  # upload HTTP_TLS_CERT
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "10"))  # seconds
+QUOTA_BASE_BACKOFF = float(os.getenv("QUOTA_BASE_BACKOFF", "60"))  # seconds, when the server gives no wait
+QUOTA_MAX_BACKOFF = float(os.getenv("QUOTA_MAX_BACKOFF", "3600"))  # seconds
+DOWNLOADS_DIR = os.getenv("DOWNLOADS_DIR", "/downloads")
+GLOBAL_SPEED_LIMIT = parse_rate(os.getenv("GLOBAL_SPEED_LIMIT", "off"))  # e.g. 50M (bytes/s) over all downloads
+CHAT_SPEED_LIMIT = parse_rate(os.getenv("CHAT_SPEED_LIMIT", "off"))  # per chat, over all its sessions
+MAX_TRANSFER_CONNECTIONS = int(os.getenv("MAX_TRANSFER_CONNECTIONS", "6"))  # ceiling of the per-transfer tuning
+TOTAL_CONNECTIONS = int(os.getenv("TOTAL_CONNECTIONS", "64"))  # shared out over running transfers, at least 1 each
+BANDWIDTH_INTERVAL = float(os.getenv("BANDWIDTH_INTERVAL", "5"))  # seconds between limit/connection rebalances
+POSTPROCESS = os.getenv("POSTPROCESS", "")  # steps run on finished downloads, e.g. "hash extract move:/media/{category}"
+POSTPROCESS_THREADS = int(os.getenv("POSTPROCESS_THREADS", "2"))  # workers for hashing, moving, hooks
+POSTPROCESS_PROCESSES = int(os.getenv("POSTPROCESS_PROCESSES", "1"))  # workers for extraction; 0 uses threads
+POSTPROCESS_PLUGINS = os.getenv("POSTPROCESS_PLUGINS", "").split()  # modules registering extra steps
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}  # may use /limit
+DEDUP_SCAN_INTERVAL = float(os.getenv("DEDUP_SCAN_INTERVAL", "3600"))  # seconds between downloads dir scans
+WORKER_TOKEN = os.getenv("WORKER_TOKEN")  # hands downloads to worker.py processes when set
+WORKER_LEASE = float(os.getenv("WORKER_LEASE", "60"))  # seconds without a poll before a worker's jobs are requeued
+WORKER_JOB_RETENTION = float(os.getenv("WORKER_JOB_RETENTION", "86400"))  # seconds finished jobs stay queryable
 
 # Set up logging
 logging.basicConfig(
     level=logging.INFO, format="%(levelname)s\t%(asctime)s %(message)s"
 )
 
+TransferListener.log_interval = TRANSFER_LOG_INTERVAL
+TransferListener.log_level = logging.getLevelName(TRANSFER_LOG_LEVEL)
+
+sdk_cache = None
+if SDK_CACHE_MAX_SIZE > 0:
+    sdk_cache = SdkCache(SDK_CACHE_DIR or os.path.join(DATA_DIR, "sdkcache"), SDK_CACHE_MAX_SIZE, SDK_CACHE_SLOTS)
+mega_pool = MegaApiPool(API_KEY, MEGA_POOL_SIZE, MEGA_POOL_IDLE_TIMEOUT, cache=sdk_cache)
+folder_indexes = IndexCache(INDEX_CACHE_SIZE, INDEX_CACHE_TTL)
+batch_folder_slots = asyncio.Semaphore(max(1, min(BATCH_FOLDER_WORKERS, MEGA_POOL_SIZE // 2)))
+scheduler = DownloadScheduler(MAX_ACTIVE_DOWNLOADS, MAX_CHAT_DOWNLOADS)
+load_plugins(POSTPROCESS_PLUGINS)
+pipeline = Pipeline(parse_steps(POSTPROCESS), POSTPROCESS_THREADS, POSTPROCESS_PROCESSES)
+bandwidth = BandwidthManager(GLOBAL_SPEED_LIMIT, CHAT_SPEED_LIMIT, MAX_TRANSFER_CONNECTIONS, TOTAL_CONNECTIONS)
+broadcaster = StatusBroadcaster(STATUS_INTERVAL, STATUS_MAX_INTERVAL, STATUS_EDITS_PER_SECOND)
+sessions = SessionRegistry()  # every open MegaSession by id, for commands, metrics and the journal
+journal = Journal(os.path.join(DATA_DIR, "journal.db"))
+downloads_index = DownloadIndex(os.path.join(DATA_DIR, "downloads.db"), skip_dirs=[DATA_DIR])
+job_queue = worker_hub = None
+if WORKER_TOKEN:
+    job_queue = JobQueue(os.path.join(DATA_DIR, "jobs.db"))
+    worker_hub = WorkerHub(job_queue, WORKER_TOKEN, WORKER_LEASE)
+
+def pause_for_quota():
+    """Pauses every session's transfers so over-quota retries don't hold connections."""
+    for mega_session in sessions:
+        mega_session.pause_transfers(True)
+
+def resume_after_quota():
+    for mega_session in sessions:
+        if not mega_session.paused:
+            mega_session.pause_transfers(False)
+    scheduler.wakeup()
+
+quota = QuotaManager(QUOTA_BASE_BACKOFF, QUOTA_MAX_BACKOFF, on_pause=pause_for_quota, on_resume=resume_after_quota)
+scheduler.quota = quota
+TransferListener.on_over_quota = quota.report_threadsafe
+if worker_hub is not None:
+    worker_hub.on_over_quota = quota.report_threadsafe
+
 # Define states for ConversationHandler
-(AWAIT_FILE_CHOICE, AWAIT_LINK_CONFIRM) = range(2)
-
-# --- Helper functions from original bot ---
-
-def convert_size(size_bytes):
-    if size_bytes == 0:
-        return "0B"
-    size_name = ("B", "KB", "MB", "GB", "TB", "PB")
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return "%s %s" % (s, size_name[i])
-
-def expand_ranges(msg):
-    output = set()
-    for item in msg.split(','):
-        if '-' in item:
-            start, end = map(int, item.split('-'))
-            output.update(range(start, end + 1))
-        else:
-            output.add(int(item))
-    return output
+(AWAIT_FILE_CHOICE, AWAIT_LINK_CONFIRM, AWAIT_SELECTION_CONFIRM) = range(3)
+
+MEGA_LINK_RE = re.compile(r'https?://(?:www\.)?mega(?:\.co)?\.nz/\S+|https?://mega\.io/\S+')
+BATCH_USAGE = (
+    "Usage: /batch <category> [--dir optional_subdir] [--priority n] followed by links, "
+    "or as the caption of a .txt file with one link per line, or as a reply to such a message."
+)
+
+SELECTION_HELP = (
+    "Choose what to download: indices and ranges ('1,3,5-7'), a subtree ('12/'), "
+    "globs ('*.flac'), regexes ('/live/i'), extensions ('.mp3'), sizes ('size>100M'), "
+    "'type:file' and '!term' to exclude. Send /cancel to abort."
+)
 
 # --- MegaSession class (modified for Telegram) ---
 
 class MegaSession:
-    def __init__(self, api, listener):
+    def __init__(self, api, listener, pool=None, chat_id=None, link=None, owner=None):
         self._api = api
         self._listener = listener
-        self.backlog = []
+        self._pool = pool
+        self.id = None  # assigned by the session registry
+        self.chat_id = chat_id
+        self.owner = owner  # user who started the session
+        self.link = link
+        self.sources = {}  # handle -> link it came from, where that isn't ``link`` (batches)
+        self.category = ""
+        self.save_to = DOWNLOADS_DIR
+        self.priority = 0
+        self.selection = None  # IntervalSet previewed and waiting for confirmation
+        self.journal_id = None  # set once the selection is journaled
+        self.backlog = []  # heap of queued downloads, drained by the scheduler
+        self.active = 0  # downloads started by the scheduler and not finished yet
+        self.paused = False
         self.current_dls = []
-        self.files_list = []  # Store file list for selection
-
-    def ls_telegram(self, path, files, depth):
-        """Creates a file list for Telegram (no ANSI codes)."""
-        if path is None:
-            return "INFO: Not logged in"
-        if path.getType() == MegaNode.TYPE_FILE:
-            size = f"{convert_size(path.getSize())}"
-            files.append(
-                {"name": "\t" * depth + path.getName() + "\t" + size, "handle": path.getHandle()}
-            )
-        else:
-            name = "\t" * depth + "./" + path.getName()
-            files.append({"name": name, "handle": path.getHandle()})
-            children = self._api.getChildren(path)
-            for i in range(children.size()):
-                self.ls_telegram(children.get(i), files, depth + 1)
+        self.post_jobs = []  # PostJobs of finished downloads
+        self.status_message = None  # (chat_id, message_id) updated by the broadcaster
+        self.index = None  # FolderIndex of the opened link, shared via folder_indexes
+        self.pager = None
 
-    def download(self, node, save_to):
+    async def load_index(self, key=None):
+        """Indexes the tree under cwd off the event loop, reusing cached walks for ``key``."""
         if self._listener.cwd is None:
             logging.info("Not logged in")
-            return
-        transfer_listener = TransferListener()
+            return None
+        if key is None:
+            self.index = await asyncio.to_thread(build_index, self._api, self._listener.cwd)
+        else:
+            self.index = await folder_indexes.get_or_build(key, self._api, self._listener.cwd)
+        self.pager = ListingPager(self.index)
+        return self.index
+
+    def download(self, node, save_to, on_finish=None, size=None):
+        """Starts downloading ``node``; ``on_finish(session)`` is called from the SDK thread.
+
+        ``size`` is the node's total size if already known. With remote
+        workers the download is queued for one of them instead.
+        """
         if node is None:
             logging.error("Node not found")
-            return
+            return False
+        name = node.getName()
+        target = save_to + "/" + name
+        handle = node.getHandle()
+        record = None
+        if node.getType() == MegaNode.TYPE_FILE:
+            record = (target, node.getSize(), handle, self._api.getFingerprint(node))
+        if size is None:
+            size = self._api.getSize(node)
+
+        def finished():
+            if transfer_listener.error is None:
+                if record is not None:
+                    downloads_index.record(*record)
+                if pipeline.steps:
+                    # Appended before on_finish so the session can't look done in between
+                    job = PostJob(target, {"name": name, "category": self.category, "chat_id": self.chat_id})
+                    self.post_jobs.append(job)
+                    pipeline.submit_threadsafe(job)
+            if on_finish is not None:
+                on_finish(self)
+
+        if worker_hub is not None:
+            transfer_listener = RemoteTransfer(name, size, record is None, finished, handle)
+            self.current_dls.append(transfer_listener)
+            key = f"{self.journal_id}:{handle}" if self.journal_id is not None else None
+            worker_hub.submit(transfer_listener, self.sources.get(handle, self.link), handle, save_to,
+                              self.priority, self.chat_id, key, self.journal_id)
+            return True
+        if record is None:
+            transfer_listener = FolderTransferListener(size, on_finish=finished, handle=handle)
+        else:
+            transfer_listener = TransferListener(on_finish=finished, handle=handle)
         self.current_dls.append(transfer_listener)
-        self._api.startDownload(
-            node, save_to + "/" + node.getName(), transfer_listener
-        )
+        self._api.startDownload(node, target, transfer_listener)
+        return True
+
+    def _remote_transfers(self):
+        return [dl for dl in self.current_dls if isinstance(dl, RemoteTransfer) and not dl.is_finished]
+
+    def pause_transfers(self, pause):
+        if worker_hub is None:
+            self._api.pauseTransfers(pause)
+            return
+        for dl in self._remote_transfers():
+            dl.paused = pause
+
+    def cancel_transfers(self):
+        if worker_hub is None:
+            self._api.cancelTransfers(MegaTransfer.TYPE_DOWNLOAD)
+            return
+        worker_hub.cancel(self.current_dls)
+
+    def set_speed_limit(self, limit):
+        """Caps this session's downloads at ``limit`` bytes/s; 0 lifts the cap."""
+        if worker_hub is None:
+            self._api.setMaxDownloadSpeed(limit)
+            return
+        # Every remote download runs on a MegaApi of its own, so each gets a share
+        remote = self._remote_transfers()
+        for dl in remote:
+            dl.speed_limit = max(1, limit // len(remote)) if limit else 0
+
+    def set_connections(self, connections):
+        """Sets the connections per download on this session's MegaApi."""
+        if worker_hub is None:
+            self._api.setMaxConnections(MegaTransfer.TYPE_DOWNLOAD, connections)
+            return
+        for dl in self._remote_transfers():
+            dl.connections = connections
+
+    def _reuse_existing(self, node, save_to):
+        """Satisfies a file download from a copy already on disk, hard-linking it if needed."""
+        return self._reuse_file(save_to + "/" + node.getName(), node.getHandle(), node.getSize(),
+                                self._api.getFingerprint(node))
+
+    def _reuse_file(self, target, handle, size, fingerprint):
+        existing = downloads_index.find(handle, size, fingerprint, self._api.getFingerprint)
+        if existing is None:
+            return False
+        if os.path.abspath(existing) != os.path.abspath(target):
+            if os.path.exists(target):
+                return False  # something else is in the way; let the SDK deal with it
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.link(existing, target)
+            except OSError as e:
+                logging.info(f"Couldn't hard-link {existing} to {target}: {e}")
+                return False
+            downloads_index.record(target, size, handle, fingerprint)
+        logging.info(f"Reusing {existing} for {target}")
+        return True
+
+    def _folder_files(self, node, save_to):
+        """Lists (handle, directory, name, size, fingerprint) of the files a download of folder ``node`` makes."""
+        files = []
+        lists = []  # nodes are owned by their MegaNodeList, so every list stays referenced
+        stack = [(node, save_to + "/" + node.getName())]
+        while stack:
+            folder, path = stack.pop()
+            children = self._api.getChildren(folder)
+            lists.append(children)
+            for k in range(children.size()):
+                child = children.get(k)
+                if child.getType() == MegaNode.TYPE_FILE:
+                    files.append((child.getHandle(), path, child.getName(), child.getSize(),
+                                  self._api.getFingerprint(child)))
+                else:
+                    stack.append((child, path + "/" + child.getName()))
+        return files
+
+    def _reuse_folder(self, node, save_to):
+        """Reuses what it can of a folder download; returns (reused, missing) files."""
+        reused, missing = [], []
+        for handle, path, name, size, fingerprint in self._folder_files(node, save_to):
+            if self._reuse_file(path + "/" + name, handle, size, fingerprint):
+                reused.append((name, size, handle))
+            else:
+                missing.append((handle, path))
+        return reused, missing
+
+    async def start_download(self, node, save_to, on_finish=None):
+        """Downloads ``node`` unless an identical file was already fetched.
+
+        A folder with some of its files already on disk is split up: those
+        are reused and the rest are queued one by one. Returns True when a
+        transfer was started.
+        """
+        await asyncio.to_thread(os.makedirs, save_to, exist_ok=True)  # e.g. the root's folders in the link
+        if node is not None and node.getType() == MegaNode.TYPE_FILE:
+            if await asyncio.to_thread(self._reuse_existing, node, save_to):
+                self.current_dls.append(
+                    TransferListener.already_downloaded(node.getName(), node.getSize(), node.getHandle())
+                )
+                return False
+        size = None
+        if node is not None and node.getType() != MegaNode.TYPE_FILE:
+            reused, missing = await asyncio.to_thread(self._reuse_folder, node, save_to)
+            if reused:
+                logging.info(f"Session #{self.id}: reused {len(reused)} file(s) of {node.getName()}, "
+                             f"{len(missing)} still to download")
+                self.current_dls.extend(TransferListener.already_downloaded(*file) for file in reused)
+                for handle, path in missing:
+                    scheduler.submit(self, handle, path, self.priority)
+                return False
+            size = await asyncio.to_thread(self._api.getSize, node)  # walks the whole subtree
+        return self.download(node, save_to, on_finish, size)
+
+    def progress_rows(self):
+        """Returns journal rows (handle, state, transferred, total) for started transfers."""
+        rows = []
+        for dl in self.current_dls:
+            if dl.is_finished:
+                state = FAILED if dl.error else DONE
+            else:
+                state = ACTIVE
+            rows.append((dl.handle, state, dl.transfered_size, dl.total_size))
+        return rows
+
+    def downloads_done(self):
+        """True once nothing is queued and every started transfer has finished."""
+        return not self.backlog and not self.active and all(dl.is_finished for dl in self.current_dls)
+
+    def is_done(self):
+        """True once the downloads are done and so is their post-processing."""
+        return self.downloads_done() and all(job.is_finished for job in self.post_jobs)
 
     def pwd(self):
         if self._listener.cwd is None:
@@ -98,82 +387,212 @@ class MegaSession:
             return
         return self._listener.cwd.getName()
 
-    def wait(self):
-        self._listener.event.wait()
+    async def _request(self, name, start, *request_types, timeout=REQUEST_TIMEOUT):
+        """Issues an SDK request and awaits its completion without blocking the loop."""
+        future = self._listener.expect(*request_types)
+        with SDK_REQUEST_SECONDS.time(name):
+            start(self._listener)
+            return await asyncio.wait_for(future, timeout)
 
-    def quit(self):
+    def _cache_state(self):
+        return self._pool.cache_state(self._api) if self._pool is not None else "uncached"
+
+    async def login_to_folder(self, link, timeout=REQUEST_TIMEOUT):
+        def login(listener):
+            if self._cache_state() != "warm":
+                self._api.loginToFolder(link, listener)
+                return
+            try:
+                # Loads the node tree from the basePath cache and fetches only what changed
+                self._api.loginToFolder(link, listener, True)
+            except (TypeError, NotImplementedError):
+                # SDK builds without tryToResumeFolderLinkFromCache
+                self._api.loginToFolder(link, listener)
+        await self._request("login", login, MegaRequest.TYPE_LOGIN, timeout=timeout)
+
+    async def fetch_nodes(self, timeout=REQUEST_TIMEOUT):
+        return await self._request(
+            "fetch_nodes", self._api.fetchNodes, MegaRequest.TYPE_FETCH_NODES, timeout=timeout
+        )
+
+    async def open_folder(self, link, timeout=REQUEST_TIMEOUT):
+        """Logs into a folder link and fetches its nodes, returning the root node."""
+        with FOLDER_OPEN_SECONDS.time(self._cache_state()):
+            await self.login_to_folder(link, timeout)
+            return await self.fetch_nodes(timeout)
+
+    async def get_public_node(self, link, timeout=REQUEST_TIMEOUT):
+        return await self._request(
+            "get_public_node", lambda l: self._api.getPublicNode(link, l), MegaRequest.TYPE_GET_PUBLIC_NODE,
+            timeout=timeout
+        )
+
+    async def resolve_public_node(self, link, timeout=REQUEST_TIMEOUT):
+        """Looks up a file link through a listener of its own, so many can be in flight on one worker."""
+        listener = RequestListener()
+        future = listener.expect(MegaRequest.TYPE_GET_PUBLIC_NODE)
+        with SDK_REQUEST_SECONDS.time("get_public_node"):
+            self._api.getPublicNode(link, listener)
+            return await asyncio.wait_for(future, timeout)
+
+    async def authorize_node(self, handle, timeout=REQUEST_TIMEOUT):
+        """Looks up and authorizes a node off the event loop.
+
+        authorizeNode copies the whole subtree for folders, which can take a
+        while on large trees, so it runs in a worker thread.
+        """
+        def authorize():
+            node = self._api.getNodeByHandle(handle)
+            if node is None or worker_hub is not None:
+                return node  # workers log into the link themselves
+            return self._api.authorizeNode(node)
+        with SDK_REQUEST_SECONDS.time("authorize_node"):
+            return await asyncio.wait_for(asyncio.to_thread(authorize), timeout)
+
+    async def quit(self):
+        """Hands the MegaApi worker back to the pool it was leased from."""
+        if worker_hub is not None:
+            worker_hub.cancel(self.current_dls)
+        if self._pool is not None:
+            await self._pool.release(self._api, self._listener)
         del self._listener
         del self._api
         logging.info("Bye!")
         return True
 
-# --- Status Update Job ---
-
-async def status_update_job(context: ContextTypes.DEFAULT_TYPE):
-    """Job to update the download status message."""
-    job_data = context.job.data
-    chat_id = job_data["chat_id"]
-    message_id = job_data["message_id"]
-    
-    mega_session = context.chat_data.get("mega_session")
-    if not mega_session:
-        await context.bot.edit_message_text(
-            chat_id=chat_id, message_id=message_id, text="Session closed."
-        )
-        context.job.schedule_removal()
+async def close_session(mega_session):
+    """Unregisters a session and releases its MegaApi worker."""
+    if mega_session not in sessions:
         return
+    sessions.remove(mega_session)
+    if mega_session.journal_id is not None:
+        journal.update_transfers(mega_session.journal_id, mega_session.progress_rows())
+        journal.close_session(mega_session.journal_id)
+    await mega_session.quit()
 
-    # Check for over-quota retries
-    period = job_data.get("retry_period", 1)
-    if any([dl.over_quota for dl in mega_session.current_dls]):
-        status_text = "Current downloads:\n```\n"
-        status_text += "\n".join([tl.getStatus_telegram() for tl in mega_session.current_dls])
-        status_text += "\n```"
-        status_text += f"\nOver quota. Retrying connection in {period}s"
-        
-        await context.bot.edit_message_text(
-            chat_id=chat_id, message_id=message_id, text=status_text, parse_mode=ParseMode.MARKDOWN
-        )
-        job_data["retry_period"] = 2 ** period
-        context.job.data = job_data
-        # Reschedule the job with the new delay
-        context.job_queue.run_once(status_update_job, period, data=job_data, name=f"status_{chat_id}")
-        return
+def draft_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """The session the user is still setting up in this chat with /dl, if any."""
+    session_id = context.chat_data.get("drafts", {}).get(update.effective_user.id)
+    return sessions.get(session_id, update.effective_chat.id)
 
-    # Regular update
-    if any([not dl.is_finished for dl in mega_session.current_dls]):
-        status_text = "Current downloads:\n```\n"
-        status_text += "\n".join([tl.getStatus_telegram() for tl in mega_session.current_dls])
-        status_text += "\n```"
-        
-        keyboard = [[
-            InlineKeyboardButton("⏸ Pause", callback_data="pause"),
-            InlineKeyboardButton("▶ Resume", callback_data="resume")
-        ]]
-        
-        try:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=status_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logging.warning(f"Failed to edit status message: {e}")
-        # Reschedule for next update
-        context.job_queue.run_once(status_update_job, 2, data=job_data, name=f"status_{chat_id}")
+def set_draft(context, user_id, mega_session):
+    context.chat_data.setdefault("drafts", {})[user_id] = mega_session.id
+
+def clear_draft(context, user_id):
+    context.chat_data.get("drafts", {}).pop(user_id, None)
+
+def describe_session(mega_session):
+    if mega_session.status_message is None:
+        state = "choosing files"
+    elif mega_session.paused:
+        state = "paused"
     else:
-        # All downloads finished
-        status_text = "All downloads finished:\n```\n"
-        status_text += "\n".join([tl.getStatus_telegram() for tl in mega_session.current_dls])
-        status_text += "\n```"
-        await context.bot.edit_message_text(
-            chat_id=chat_id, message_id=message_id, text=status_text, parse_mode=ParseMode.MARKDOWN
-        )
+        done = sum(1 for dl in mega_session.current_dls if dl.is_finished)
+        state = f"{done}/{len(mega_session.current_dls) + len(mega_session.backlog)} done"
+    return f"#{mega_session.id} {mega_session.link} ({state})"
+
+async def session_from_args(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Finds the session a command is about.
+
+    That is the id given as first argument, else the user's own session in
+    progress, else the chat's only session. Replies and returns None when
+    nothing matches or the chat has several sessions to choose from.
+    """
+    chat_id = update.effective_chat.id
+    if context.args:
+        try:
+            session_id = int(context.args[0].lstrip("#"))
+        except ValueError:
+            await update.message.reply_text("Session ids are numbers, see /sessions.")
+            return None
+        mega_session = sessions.get(session_id, chat_id)
+        if mega_session is None:
+            await update.message.reply_text(f"No session #{session_id} in this chat, see /sessions.")
+        return mega_session
+
+    mega_session = draft_session(update, context)
+    if mega_session is not None:
+        return mega_session
+    chat_sessions = sessions.for_chat(chat_id)
+    if len(chat_sessions) == 1:
+        return chat_sessions[0]
+    if not chat_sessions:
+        await update.message.reply_text("No active session. Start with /dl.")
+        return None
+    command = update.message.text.split()[0]
+    await update.message.reply_text(
+        f"{len(chat_sessions)} sessions are open here, add the id (e.g. {command} {chat_sessions[0].id}):\n"
+        + "\n".join(describe_session(s) for s in chat_sessions)
+    )
+    return None
+
+def session_from_callback(update: Update):
+    """Returns the session whose id ends the button's callback data, if it belongs to this chat."""
+    session_id = update.callback_query.data.rsplit(":", 1)[-1]
+    return sessions.get(int(session_id), update.effective_chat.id)
+
+def listing_markup(mega_session):
+    rows = mega_session.pager.buttons()
+    if not rows:
+        return None
+    prefix = f"ls:{mega_session.id}:"
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=prefix + data[3:]) for label, data in row] for row in rows]
+    )
+
+async def send_listing(update: Update, mega_session):
+    """Sends the current listing page with its navigation buttons."""
+    text = mega_session.pager.render()
+    await update.message.reply_text(
+        text, reply_markup=listing_markup(mega_session), parse_mode=ParseMode.MARKDOWN
+    )
+
+# --- Status Rendering ---
+
+def render_status(mega_session):
+    """Renders a session's status message as (text, reply_markup, done)."""
+    header = f"#{mega_session.id} "
+    if mega_session.is_done():
+        text = header + format_transfers(mega_session.current_dls, True, STATUS_MAX_LINES)
+        return text + format_jobs(mega_session.post_jobs, True, STATUS_MAX_LINES), None, True
+
+    status_text = header + format_transfers(mega_session.current_dls, mega_session.downloads_done(), STATUS_MAX_LINES)
+    status_text += format_jobs(mega_session.post_jobs, False, STATUS_MAX_LINES)
+    if mega_session.backlog:
+        status_text += f"\n{len(mega_session.backlog)} queued"
+    if mega_session.paused:
+        status_text += "\nPaused."
+    limits = bandwidth.worker(mega_session)
+    if limits is not None and limits.speed_limit:
+        status_text += f"\nLimited to {format_rate(limits.speed_limit)}"
+    if quota.over_quota:
+        mins, sec = divmod(int(quota.eta()), 60)
+        status_text += f"\nOver quota. Transfers resume in {mins:02}:{sec:02}"
+    elif any(dl.over_quota for dl in mega_session.current_dls):
+        status_text += "\nOver quota. Waiting for the server to allow more transfers."
+    keyboard = [[
+        InlineKeyboardButton("⏸ Pause", callback_data=f"pause:{mega_session.id}"),
+        InlineKeyboardButton("▶ Resume", callback_data=f"resume:{mega_session.id}")
+    ]]
+    return status_text, InlineKeyboardMarkup(keyboard), False
+
+def track_status(bot, mega_session, chat_id, message_id):
+    """Hands the session's status message over to the broadcaster."""
+    mega_session.status_message = (chat_id, message_id)
+    if mega_session.journal_id is not None:
+        journal.set_status_message(mega_session.journal_id, chat_id, message_id)
+
+    async def on_done():
         mega_session.current_dls.clear()
-        context.chat_data["mega_session"] = None  # Clear session
-        context.job.schedule_removal() # Stop the job
+        await close_session(mega_session)
+
+    broadcaster.register(bot, chat_id, message_id, lambda: render_status(mega_session), on_done)
+
+def journal_selection(mega_session, transfers, save_to, priority):
+    """Records a session's selected (handle, save_to) downloads so they can be resumed after a restart."""
+    mega_session.journal_id = journal.open_session(mega_session.chat_id, mega_session.link, save_to, priority,
+                                                  mega_session.category)
+    journal.add_transfers(mega_session.journal_id, transfers)
 
 # --- Bot Command Handlers ---
 
@@ -183,46 +602,82 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("pong")
 
+async def list_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_sessions = sessions.for_chat(update.effective_chat.id)
+    if not chat_sessions:
+        await update.message.reply_text("No active session. Start with /dl.")
+        return
+    await update.message.reply_text("\n".join(describe_session(s) for s in chat_sessions))
+
 async def ls(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    mega_session = context.chat_data.get("mega_session")
+    mega_session = await session_from_args(update, context)
     if mega_session:
-        files = []
-        mega_session.ls_telegram(mega_session._listener.cwd, files, 0)
-        output = "```\n" + "\n".join(
-            f"{i} {n['name']}" for i, n in enumerate(files)
-        ) + "\n```"
-        await update.message.reply_text(output, parse_mode=ParseMode.MARKDOWN)
-    else:
-        await update.message.reply_text("No active session. Start with /dl.")
+        if mega_session.index is None and await mega_session.load_index() is None:
+            await update.message.reply_text("INFO: Not logged in")
+            return
+        await send_listing(update, mega_session)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    mega_session = context.chat_data.get("mega_session")
-    if mega_session:
-        mega_session._api.cancelTransfers(MegaTransfer.TYPE_DOWNLOAD)
-        pwd = mega_session.pwd()
-        mega_session.current_dls.clear()
-        context.chat_data["mega_session"] = None
-        
-        # Stop any running status jobs for this chat
-        jobs = context.job_queue.get_jobs_by_name(f"status_{update.effective_chat.id}")
-        for job in jobs:
-            job.schedule_removal()
-            
-        await update.message.reply_text(f"Cancelling download and closing session for `{pwd}`", parse_mode=ParseMode.MARKDOWN)
-    else:
-        await update.message.reply_text("No active session to cancel.")
-    return ConversationHandler.END
+    mega_session = await session_from_args(update, context)
+    if not mega_session:
+        return None
+    scheduler.remove(mega_session)
+    mega_session.cancel_transfers()
+    for job in mega_session.post_jobs:
+        pipeline.cancel(job)
+    pwd = mega_session.pwd() or mega_session.link
+    mega_session.current_dls.clear()
+    if mega_session.status_message:
+        broadcaster.unregister(*mega_session.status_message)
+    was_draft = draft_session(update, context) is mega_session
+    await close_session(mega_session)
+
+    await update.message.reply_text(f"Cancelling download and closing session #{mega_session.id} for `{pwd}`", parse_mode=ParseMode.MARKDOWN)
+    if was_draft:
+        # It was the user's session in progress; the conversation ends with it
+        clear_draft(context, update.effective_user.id)
+        return ConversationHandler.END
+    return None
 
 # --- /dl Conversation ---
 
+def category_dir(cat):
+    """The download directory of a /dl category, or None if there is no such category."""
+    match cat:
+        case 'f' | 's':
+            return DOWNLOADS_DIR
+        case _:
+            return None
+
+def parse_flags(dir_path, flags):
+    """Applies the --dir and --priority flags of /dl and /batch; returns (save_to, priority)."""
+    split_flags = shlex.split(flags)
+    if "--dir" in split_flags:
+        dir_path += "/" + split_flags[split_flags.index("--dir") + 1].strip()
+        os.makedirs(dir_path, exist_ok=True)
+    priority = 0  # lower starts first
+    if "--priority" in split_flags:
+        priority = int(split_flags[split_flags.index("--priority") + 1])
+    return dir_path, priority
+
 async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Starts the /dl conversation."""
     if not context.args:
-        await update.message.reply_text("Usage: /dl <category> <link> [--dir optional_subdir]")
+        await update.message.reply_text("Usage: /dl <category> <link> [--dir optional_subdir] [--priority n]")
         return ConversationHandler.END
 
-    if context.chat_data.get("mega_session"):
-        await update.message.reply_text("A session is already active. Use /cancel before starting a new one.")
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    draft = draft_session(update, context)
+    if draft is not None:
+        # Starting over drops the selection the user hadn't confirmed yet
+        clear_draft(context, user_id)
+        await close_session(draft)
+
+    if len(sessions.for_chat(chat_id)) >= MAX_CHAT_SESSIONS:
+        await update.message.reply_text(
+            f"This chat already has {MAX_CHAT_SESSIONS} open sessions. Wait for one to finish or /cancel one."
+        )
         return ConversationHandler.END
 
     try:
@@ -230,105 +685,157 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         link = context.args[1]
         flags = " ".join(context.args[2:])
     except IndexError:
-        await update.message.reply_text("Usage: /dl <category> <link> [--dir optional_subdir]")
+        await update.message.reply_text("Usage: /dl <category> <link> [--dir optional_subdir] [--priority n]")
         return ConversationHandler.END
 
-    match cat:
-        case 'f' | 's':
-            dir_path = '/downloads'
-        case _:
-            await update.message.reply_text("Category doesn't exist.")
-            return ConversationHandler.END
+    dir_path = category_dir(cat)
+    if dir_path is None:
+        await update.message.reply_text("Category doesn't exist.")
+        return ConversationHandler.END
 
     try:
-        split_flags = shlex.split(flags)
-        if "--dir" in split_flags:
-            dir_path += "/" + split_flags[split_flags.index("--dir") + 1].strip()
-            os.makedirs(dir_path, exist_ok=True)
+        dir_path, priority = parse_flags(dir_path, flags)
     except Exception as e:
         await update.message.reply_text(f"Error parsing flags or creating directory: {e}")
         return ConversationHandler.END
-    
-    context.chat_data["download_dir"] = dir_path
+
     await update.message.reply_text("Initializing session...")
 
-    api = MegaApi(API_KEY, None, None, "megabot-telegram")
-    listener = RequestListener()
-    mega_session = MegaSession(api, listener)
-    context.chat_data["mega_session"] = mega_session
+    try:
+        api, listener = await mega_pool.acquire(
+            MEGA_POOL_ACQUIRE_TIMEOUT, link.strip() if is_folder_link(link) else None
+        )
+    except PoolExhausted as e:
+        await update.message.reply_text(f"{e}. Try again later.")
+        return ConversationHandler.END
+    mega_session = MegaSession(api, listener, mega_pool, chat_id, link.strip(), owner=user_id)
+    mega_session.save_to = dir_path
+    mega_session.priority = priority
+    mega_session.category = cat
+    sessions.add(mega_session)
+    set_draft(context, user_id, mega_session)
+
+    if is_folder_link(link):
+        try:
+            await mega_session.open_folder(link.strip())
+        except (RequestError, asyncio.TimeoutError) as e:
+            await update.message.reply_text(f"Couldn't open `{link}`: {str(e) or 'request timed out'}", parse_mode=ParseMode.MARKDOWN)
+            clear_draft(context, user_id)
+            await close_session(mega_session)
+            return ConversationHandler.END
 
-    if any(f in link for f in ["folder", "#F!"]):
-        api.loginToFolder(link.strip(), listener)
-        mega_session.wait()
-        
         folder_name = mega_session.pwd()
-        await update.message.reply_text(f"Opened folder: `{folder_name}`", parse_mode=ParseMode.MARKDOWN)
-        
+        await update.message.reply_text(f"Opened folder: `{folder_name}` (session #{mega_session.id})", parse_mode=ParseMode.MARKDOWN)
+
         try:
-            files = []
-            mega_session.ls_telegram(mega_session._listener.cwd, files, 0)
-            mega_session.files_list = files  # Save for next step
-            
-            output = "```\n" + "\n".join(
-                f"{i} {n['name']}" for i, n in enumerate(files)
-            ) + "\n```"
-            await update.message.reply_text(output, parse_mode=ParseMode.MARKDOWN)
-            await update.message.reply_text("Choose files to download (e.g., '1,3,5-7'). Send /cancel to abort.")
+            await mega_session.load_index(link.strip())  # Save for next step
+            await send_listing(update, mega_session)
+            await update.message.reply_text(SELECTION_HELP)
             return AWAIT_FILE_CHOICE
-        
+
         except Exception as e:
             await update.message.reply_text(f"Couldn't open `{link}`: {e}", parse_mode=ParseMode.MARKDOWN)
-            context.chat_data["mega_session"] = None
+            clear_draft(context, user_id)
+            await close_session(mega_session)
             return ConversationHandler.END
-    
+
     else:
         # Single file link
-        api.getPublicNode(link.strip(), listener)
-        mega_session.wait()
-        files = []
-        mega_session.ls_telegram(mega_session._listener.cwd, files, 0)
-        mega_session.files_list = files # Save for callback
-        
+        try:
+            await mega_session.get_public_node(link.strip())
+        except (RequestError, asyncio.TimeoutError) as e:
+            await update.message.reply_text(f"Couldn't open `{link}`: {str(e) or 'request timed out'}", parse_mode=ParseMode.MARKDOWN)
+            clear_draft(context, user_id)
+            await close_session(mega_session)
+            return ConversationHandler.END
+        index = await mega_session.load_index() # Save for callback
+
         keyboard = [[
-            InlineKeyboardButton("✅ Download", callback_data="dl_confirm"),
-            InlineKeyboardButton("❌ Cancel", callback_data="dl_cancel")
+            InlineKeyboardButton("✅ Download", callback_data=f"dl_confirm:{mega_session.id}"),
+            InlineKeyboardButton("❌ Cancel", callback_data=f"dl_cancel:{mega_session.id}")
         ]]
         await update.message.reply_text(
-            f"Found file:\n```\n{files[0]['name']}\n```\nDo you want to download?",
+            f"Found file (session #{mega_session.id}):\n```\n{index.format_entry(0)}\n```\nDo you want to download?",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode=ParseMode.MARKDOWN
         )
         return AWAIT_LINK_CONFIRM
 
 async def handle_file_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handles the user's file selection message."""
-    mega_session = context.chat_data.get("mega_session")
-    dir_path = context.chat_data.get("download_dir", "/downloads")
-    
+    """Parses the user's selection and shows a preview before anything starts."""
+    mega_session = draft_session(update, context)
+
     if not mega_session:
         await update.message.reply_text("Session expired. Please start again with /dl.")
         return ConversationHandler.END
 
+    index = mega_session.index
     try:
-        selected_indices = expand_ranges(update.message.text)
-    except Exception as e:
-        await update.message.reply_text(f"Invalid format. Try again (e.g., '1,3,5-7') or /cancel. Error: {e}")
+        selected = await asyncio.to_thread(parse_selection, update.message.text, index)
+    except SelectionError as e:
+        await update.message.reply_text(f"Invalid selection: {e}. Try again or /cancel.")
         return AWAIT_FILE_CHOICE # Stay in this state
 
-    status_message = await update.message.reply_text("Starting downloads...")
-    
-    for n in selected_indices:
-        try:
-            handle = mega_session.files_list[n]["handle"]
-            node = mega_session._api.getNodeByHandle(handle)
-            node = mega_session._api.authorizeNode(node)
-            mega_session.download(node, dir_path)
-        except Exception as e:
-            await update.message.reply_text(f"Error downloading file {n}: {e}")
+    files, folders, total = summarize(index, selected)
+    if not selected:
+        await update.message.reply_text("Nothing matched. Try again or /cancel.")
+        return AWAIT_FILE_CHOICE
 
-    if mega_session.current_dls:
-        job_data = {"chat_id": update.effective_chat.id, "message_id": status_message.message_id}
-        context.job_queue.run_once(status_update_job, 0, data=job_data, name=f"status_{update.effective_chat.id}")
+    mega_session.selection = selected
+    keyboard = [[
+        InlineKeyboardButton("✅ Download", callback_data=f"sel_confirm:{mega_session.id}"),
+        InlineKeyboardButton("✏️ Change", callback_data=f"sel_change:{mega_session.id}")
+    ]]
+    await update.message.reply_text(
+        f"Selected {files} files in {folders} folders, {convert_size(total)} in total.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return AWAIT_SELECTION_CONFIRM
+
+def submit_selection(mega_session, selected, dir_path, priority):
+    """Queues the selected entries and returns the (handle, save_to) pairs that were queued.
+
+    The selection is first reduced to its roots, so a folder whose whole
+    subtree is selected becomes a single folder transfer. Each root goes
+    where it sits in the link, so equally named files can't collide.
+    """
+    index = mega_session.index
+    transfers = []
+    for n in selection_roots(index, selected):
+        handle = index.handles[n]
+        path = relative_dir(index, n)
+        save_to = dir_path + "/" + path if path else dir_path
+        scheduler.submit(mega_session, handle, save_to, priority)
+        transfers.append((handle, save_to))
+    return transfers
+
+async def handle_selection_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Starts the previewed selection or goes back to choosing."""
+    query = update.callback_query
+    await query.answer()
+
+    mega_session = session_from_callback(update)
+    selected = mega_session.selection if mega_session else None
+
+    if not mega_session or selected is None:
+        await query.edit_message_text("Session expired. Please start again with /dl.")
+        return ConversationHandler.END
+
+    mega_session.selection = None
+    if query.data.startswith("sel_change"):
+        await query.edit_message_text(SELECTION_HELP)
+        return AWAIT_FILE_CHOICE
+
+    await query.edit_message_text("Starting downloads...")
+    clear_draft(context, update.effective_user.id)
+    transfers = submit_selection(mega_session, selected, mega_session.save_to, mega_session.priority)
+
+    if mega_session.backlog or mega_session.current_dls:
+        journal_selection(mega_session, transfers, mega_session.save_to, mega_session.priority)
+        track_status(context.bot, mega_session, update.effective_chat.id, query.message.message_id)
+    else:
+        await query.edit_message_text("Nothing in that selection can be downloaded. Start again with /dl.")
+        await close_session(mega_session)
 
     return ConversationHandler.END
 
@@ -337,60 +844,447 @@ async def handle_link_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
 
-    mega_session = context.chat_data.get("mega_session")
-    dir_path = context.chat_data.get("download_dir", "/downloads")
-    
+    mega_session = session_from_callback(update)
+    clear_draft(context, update.effective_user.id)
+
     if not mega_session:
         await query.edit_message_text("Session expired. Please start again with /dl.")
         return ConversationHandler.END
 
-    if query.data == "dl_confirm":
+    if query.data.startswith("dl_confirm"):
         await query.edit_message_text("Starting download...")
         try:
             node = mega_session._listener.cwd
-            mega_session.download(node, dir_path)
-            
-            job_data = {"chat_id": update.effective_chat.id, "message_id": query.message.message_id}
-            context.job_queue.run_once(status_update_job, 0, data=job_data, name=f"status_{update.effective_chat.id}")
-            
+            dir_path = mega_session.save_to
+            scheduler.submit(mega_session, save_to=dir_path, priority=mega_session.priority, node=node)
+            journal_selection(mega_session, [(node.getHandle(), dir_path)], dir_path, mega_session.priority)
+            track_status(context.bot, mega_session, update.effective_chat.id, query.message.message_id)
+
         except Exception as e:
             logging.error(f"Error downloading: {e}")
             await query.edit_message_text(f"Error downloading: {e}")
-            
-    elif query.data == "dl_cancel":
+
+    else:
         await query.edit_message_text("Download cancelled.")
-        context.chat_data["mega_session"] = None
+        await close_session(mega_session)
 
     return ConversationHandler.END
 
+async def selection_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Releases the session when a /dl conversation is abandoned."""
+    mega_session = draft_session(update, context)
+    clear_draft(context, update.effective_user.id)
+    if mega_session and not mega_session.current_dls:
+        await close_session(mega_session)
+
+# --- Batch Downloads ---
+
+async def batch_text(message):
+    """The text of a message plus the contents of its attached link list, if any."""
+    text = message.text or message.caption or ""
+    document = message.document
+    if document is not None:
+        if document.file_size and document.file_size > BATCH_MAX_FILE_SIZE:
+            raise ValueError(f"the attached file is larger than {convert_size(BATCH_MAX_FILE_SIZE)}")
+        data = await (await document.get_file()).download_as_bytearray()
+        text += "\n" + data.decode("utf-8", errors="replace")
+    return text
+
+async def resolve_link(mega_session, link):
+    """Resolves one batch link to (node, size); folders are authorized so the batch worker can download them."""
+    if not is_folder_link(link):
+        node = await mega_session.resolve_public_node(link)
+        return node, node.getSize()
+    # A folder login ties up a whole worker, so it gets its own for as long as it takes
+    api, listener = await mega_pool.acquire(MEGA_POOL_ACQUIRE_TIMEOUT, link)
+    worker = MegaSession(api, listener, mega_pool)
+    try:
+        root = await worker.open_folder(link)
+        return await asyncio.to_thread(lambda: (api.authorizeNode(root), api.getSize(root)))
+    finally:
+        await worker.quit()
+
+async def run_batch(bot, mega_session, links, chat_id, message_id):
+    """Resolves a batch's links concurrently, reports them in one message and queues them all."""
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def resolve(link):
+        # Folder links share a few pool workers with every other batch, leaving the rest to sessions
+        async with batch_folder_slots if is_folder_link(link) else slots:
+            try:
+                return await resolve_link(mega_session, link)
+            except (RequestError, PoolExhausted, asyncio.TimeoutError) as e:
+                return str(e) or "request timed out"
+            except Exception as e:
+                logging.error(f"Couldn't resolve {link}: {e}")
+                return str(e) or type(e).__name__
+
+    results = await asyncio.gather(*(resolve(link) for link in links))
+    if mega_session not in sessions:
+        return  # cancelled while resolving
+    resolved, failed = [], []
+    for link, result in zip(links, results):
+        if isinstance(result, str):
+            failed.append((link, result))
+        elif result[0] is None:
+            failed.append((link, "not found"))
+        else:
+            node, size = result
+            resolved.append((node.getName(), size, node.getType() != MegaNode.TYPE_FILE))
+            mega_session.sources[node.getHandle()] = link
+            scheduler.submit(mega_session, save_to=mega_session.save_to, priority=mega_session.priority, node=node)
+
+    try:
+        await bot.edit_message_text(format_batch(resolved, failed, STATUS_MAX_LINES), chat_id, message_id,
+                                    disable_web_page_preview=True)
+    except TelegramError as e:
+        logging.warning(f"Couldn't report batch session #{mega_session.id}: {e}")
+    if not resolved:
+        await close_session(mega_session)
+        return
+    try:
+        message_id = (await bot.send_message(chat_id, "Starting downloads...")).message_id
+    except TelegramError as e:
+        # The downloads are queued already: show their status in the report instead
+        logging.warning(f"Couldn't send a status message for batch session #{mega_session.id}: {e}")
+    track_status(bot, mega_session, chat_id, message_id)
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Downloads every link of a message, an attached .txt file or the message replied to."""
+    message = update.message
+    chat_id = update.effective_chat.id
+    try:
+        text = await batch_text(message)
+        if message.reply_to_message is not None:
+            text += "\n" + await batch_text(message.reply_to_message)
+    except ValueError as e:
+        await message.reply_text(f"Couldn't read the links: {e}")
+        return
+
+    # dict.fromkeys drops repeated links and keeps the order
+    links = list(dict.fromkeys(link.rstrip(".,;)>") for link in MEGA_LINK_RE.findall(text)))
+    args = MEGA_LINK_RE.sub(" ", (message.text or message.caption or "")).split()[1:]
+    if not args or not links:
+        await message.reply_text(BATCH_USAGE)
+        return
+    if len(links) > BATCH_MAX_LINKS:
+        await message.reply_text(f"That's {len(links)} links; a batch takes at most {BATCH_MAX_LINKS}.")
+        return
+    dir_path = category_dir(args[0])
+    if dir_path is None:
+        await message.reply_text("Category doesn't exist.")
+        return
+    try:
+        dir_path, priority = parse_flags(dir_path, " ".join(args[1:]))
+    except Exception as e:
+        await message.reply_text(f"Error parsing flags or creating directory: {e}")
+        return
+    if len(sessions.for_chat(chat_id)) >= MAX_CHAT_SESSIONS:
+        await message.reply_text(
+            f"This chat already has {MAX_CHAT_SESSIONS} open sessions. Wait for one to finish or /cancel one."
+        )
+        return
+
+    try:
+        api, listener = await mega_pool.acquire(MEGA_POOL_ACQUIRE_TIMEOUT)
+    except PoolExhausted as e:
+        await message.reply_text(f"{e}. Try again later.")
+        return
+    mega_session = MegaSession(api, listener, mega_pool, chat_id, f"batch of {len(links)} links",
+                               owner=update.effective_user.id)
+    mega_session.save_to = dir_path
+    mega_session.priority = priority
+    mega_session.category = args[0]
+    sessions.add(mega_session)
+    reply = await message.reply_text(f"Resolving {len(links)} links (session #{mega_session.id})...")
+    # Resolving runs in the background so this chat's other updates (e.g. /cancel) aren't held up
+    context.application.create_task(
+        run_batch(context.bot, mega_session, links, chat_id, reply.message_id), update=update
+    )
+
+# --- Listing Navigation Callback ---
+
+async def listing_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles next/prev page and folder collapse/expand buttons on listings."""
+    query = update.callback_query
+    _, session_id, *action = query.data.split(":")
+    mega_session = sessions.get(int(session_id), update.effective_chat.id)
+
+    if not mega_session or mega_session.pager is None:
+        await query.answer("This session is no longer active.")
+        return
+
+    pager = mega_session.pager
+    if action[0] == "next":
+        changed = pager.next()
+    elif action[0] == "prev":
+        changed = pager.prev()
+    else:
+        changed = pager.toggle(int(action[1]))
+    await query.answer()
+    if changed:
+        await query.edit_message_text(
+            pager.render(), reply_markup=listing_markup(mega_session), parse_mode=ParseMode.MARKDOWN
+        )
+
 # --- Pause/Resume Callback ---
 
 async def pause_resume_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles pause/resume button presses from status messages."""
     query = update.callback_query
-    mega_session = context.chat_data.get("mega_session")
-    
+    mega_session = session_from_callback(update)
+
     if not mega_session:
         await query.answer("This session is no longer active.")
         return
 
-    pause = query.data == "pause"
-    mega_session._api.pauseTransfers(pause)
-    await query.answer(f"Transfers {'paused' if pause else 'resumed'}")
+    pause = query.data.startswith("pause")
+    mega_session.paused = pause
+    # Every session leases its own MegaApi, so this leaves other sessions' transfers alone
+    if pause or not quota.over_quota:
+        mega_session.pause_transfers(pause)
+    if not pause:
+        scheduler.wakeup()
+    await query.answer(f"Session #{mega_session.id} {'paused' if pause else 'resumed'}")
+
+# --- Bandwidth ---
+
+def format_rate(limit):
+    return f"{convert_size(limit)}/s" if limit else "none"
+
+LIMIT_USAGE = (
+    "Usage: /limit [global <speed|off>] [chat <speed|off>] [chat <chat id> <speed|off|default>] "
+    "[connections <n|auto>]\nSpeeds are bytes per second, e.g. 50M or 512K."
+)
+
+def describe_limits():
+    overrides = ", ".join(f"chat {chat_id}: {format_rate(limit)}" for chat_id, limit in bandwidth.chat_limits.items())
+    connections = bandwidth.fixed_connections or f"auto (up to {bandwidth.max_connections})"
+    lines = [
+        f"Global limit: {format_rate(bandwidth.global_limit)}",
+        f"Per-chat limit: {format_rate(bandwidth.chat_limit)}" + (f" ({overrides})" if overrides else ""),
+        f"Connections per transfer: {connections}, {bandwidth.total_connections} in total",
+    ]
+    for mega_session in sessions:
+        limits = bandwidth.worker(mega_session)
+        if limits is None or limits.speed_limit is None:
+            continue
+        speed = sum(dl.smooth_speed for dl in mega_session.current_dls if not dl.is_finished)
+        lines.append(f"#{mega_session.id} (chat {mega_session.chat_id}): {format_rate(int(speed))} now, "
+                     f"limit {format_rate(limits.speed_limit)}, {limits.connections} connection(s)")
+    return "\n".join(lines)
+
+async def limit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows or overrides speed limits and connections per transfer (admins only)."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("Only admins can change limits.")
+        return
+    args = context.args
+    try:
+        if not args:
+            pass
+        elif args[0] == "global" and len(args) == 2:
+            bandwidth.global_limit = parse_rate(args[1])
+        elif args[0] == "chat" and len(args) == 2:
+            bandwidth.chat_limit = parse_rate(args[1])
+        elif args[0] == "chat" and len(args) == 3:
+            chat_id = int(args[1])
+            if args[2] == "default":
+                bandwidth.chat_limits.pop(chat_id, None)
+            else:
+                bandwidth.chat_limits[chat_id] = parse_rate(args[2])
+        elif args[0] == "connections" and len(args) == 2:
+            if args[1] == "auto":
+                bandwidth.fixed_connections = None
+            elif int(args[1]) >= 1:
+                bandwidth.fixed_connections = int(args[1])
+            else:
+                raise ValueError("at least one connection is needed")
+        else:
+            await update.message.reply_text(LIMIT_USAGE)
+            return
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid limit: {e}\n{LIMIT_USAGE}")
+        return
+    if args:
+        logging.info(f"User {update.effective_user.id} set limits: {' '.join(args)}")
+        bandwidth.rebalance(sessions)
+    await update.message.reply_text(describe_limits())
+
+async def bandwidth_job(context: ContextTypes.DEFAULT_TYPE):
+    """Re-splits speed limits by what each session uses and retunes connections."""
+    bandwidth.rebalance(sessions)
+
+# --- Pool Maintenance ---
+
+async def pool_reap_job(context: ContextTypes.DEFAULT_TYPE):
+    """Tears down MegaApi workers that have been idle too long."""
+    mega_pool.reap()
+
+async def sdk_cache_evict_job(context: ContextTypes.DEFAULT_TYPE):
+    """Keeps the SDK cache directory within SDK_CACHE_MAX_SIZE."""
+    await asyncio.to_thread(sdk_cache.evict)
+
+# --- Journal ---
+
+async def journal_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    """Writes the progress of every journaled session in one batch per session."""
+    for mega_session in sessions:
+        if mega_session.journal_id is not None:
+            journal.update_transfers(mega_session.journal_id, mega_session.progress_rows())
+
+async def resume_session(application, row):
+    """Reopens a journaled session and re-queues the downloads that never finished."""
+    session_id, chat_id, link, save_to, priority, category, status_chat_id, status_message_id = row
+    pending = journal.pending_transfers(session_id)
+    if not pending:
+        journal.close_session(session_id)
+        return
+    api, listener = await mega_pool.acquire(link=link if is_folder_link(link) else None)
+    mega_session = MegaSession(api, listener, mega_pool, chat_id, link)
+    mega_session.journal_id = session_id
+    mega_session.save_to = save_to
+    mega_session.priority = priority
+    mega_session.category = category  # post-processing rules may use it
+    try:
+        if is_folder_link(link):
+            await mega_session.open_folder(link)
+            for handle, target in pending:
+                scheduler.submit(mega_session, handle, target, priority)
+        else:
+            node = await mega_session.get_public_node(link)
+            scheduler.submit(mega_session, save_to=pending[0][1], priority=priority, node=node)
+    except (RequestError, asyncio.TimeoutError) as e:
+        logging.error(f"Couldn't resume session {session_id} ({link}): {str(e) or 'request timed out'}")
+        journal.close_session(session_id)
+        await mega_session.quit()
+        return
+
+    sessions.add(mega_session)
+    logging.info(f"Resumed session {session_id} as #{mega_session.id} with {len(pending)} pending downloads")
+    if status_message_id is not None:
+        track_status(application.bot, mega_session, status_chat_id, status_message_id)
+
+async def resume_sessions(application):
+    """Resumes every unfinished session, file by file.
+
+    Partly downloaded files start over: there's no SDK transfer cache to
+    continue them from. Files finished before the restart are indexed
+    first, so the downloads re-queued here reuse them instead.
+    """
+    rows = journal.unfinished_sessions()
+    if rows:
+        await asyncio.to_thread(downloads_index.scan, DOWNLOADS_DIR)
+    for row in rows:
+        try:
+            await resume_session(application, row)
+        except Exception as e:
+            logging.error(f"Couldn't resume session {row[0]}: {e}")
+
+# --- Remote Workers ---
+
+async def worker_expire_job(context: ContextTypes.DEFAULT_TYPE):
+    """Requeues the jobs of workers that stopped polling and drops old finished jobs."""
+    worker_hub.expire()
+    job_queue.purge(time.time() - WORKER_JOB_RETENTION)
+
+# --- Download Index ---
+
+async def dedup_scan_job(context: ContextTypes.DEFAULT_TYPE):
+    """Picks up files that appeared in the downloads directory since the last scan."""
+    await asyncio.to_thread(downloads_index.scan, DOWNLOADS_DIR)
+
+# --- Metrics ---
+
+def _running_transfers():
+    for mega_session in sessions:
+        for dl in mega_session.current_dls:
+            if not dl.is_finished:
+                yield dl
+
+Gauge("megabot_active_transfers", "Transfers started and not finished",
+      callback=lambda: scheduler.active)
+Gauge("megabot_queued_transfers", "Selected downloads waiting for a scheduler slot",
+      callback=lambda: scheduler.queued)
+Gauge("megabot_sessions", "Open Mega sessions", callback=lambda: len(sessions))
+Gauge("megabot_sdk_cache_bytes", "Size of the SDK cache directory as of the last eviction pass",
+      callback=lambda: sdk_cache.size if sdk_cache is not None else 0)
+Gauge("megabot_over_quota_seconds", "Seconds until transfers resume after an over-quota error",
+      callback=quota.eta)
+Gauge("megabot_download_speed_bytes", "Aggregate download speed",
+      callback=lambda: sum(dl.speed for dl in _running_transfers()))
+# Per session rather than per transfer: file names are neither unique nor a bounded label set
+Gauge("megabot_session_speed_bytes", "Smoothed download speed of each session with running transfers", ("session",),
+      callback=lambda: [((str(s.id),), sum(dl.smooth_speed for dl in running)) for s in sessions
+                        if (running := [dl for dl in s.current_dls if not dl.is_finished])])
+Gauge("megabot_speed_limit_bytes", "Download speed limit applied to each session, 0 for none", ("session",),
+      callback=lambda: [((str(s.id),), w.speed_limit) for s in sessions
+                        if (w := bandwidth.worker(s)) is not None and w.speed_limit is not None])
+Gauge("megabot_workers", "Remote download workers that polled within WORKER_LEASE",
+      callback=lambda: len(worker_hub.workers) if worker_hub is not None else 0)
+Gauge("megabot_worker_jobs", "Downloads in the remote worker queue", ("state",),
+      callback=lambda: [((state,), n) for state, n in job_queue.counts().items()] if job_queue is not None else [])
+Gauge("megabot_transfer_connections", "Connections per transfer applied to each session", ("session",),
+      callback=lambda: [((str(s.id),), w.connections) for s in sessions
+                        if (w := bandwidth.worker(s)) is not None and w.connections is not None])
+
+class MetricsRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency of every Bot API call."""
+    async def do_request(self, url, method, *args, **kwargs):
+        with TELEGRAM_API_SECONDS.time(url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+async def metrics_endpoint(request):
+    return 200, "text/plain; version=0.0.4", REGISTRY.render()
+
+async def monitor_loop_lag(interval=0.5):
+    """Measures how late the event loop wakes up from a short sleep."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0, time.monotonic() - started - interval))
+
+def server_ssl_context():
+    if not (HTTP_TLS_CERT and HTTP_TLS_KEY):
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(HTTP_TLS_CERT, HTTP_TLS_KEY)
+    return context
 
 # --- Main Function ---
 
 async def main():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    if MAX_CHAT_SESSIONS * 2 > MEGA_POOL_SIZE:
+        # Every open session, drafts included, holds a worker until it closes
+        logging.warning(f"MAX_CHAT_SESSIONS={MAX_CHAT_SESSIONS} lets one chat take more than half "
+                        f"of the {MEGA_POOL_SIZE} Mega workers")
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .request(MetricsRequest(connection_pool_size=TELEGRAM_CONNECTIONS))
+        .concurrent_updates(ChatSerialUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+    )
+    if WEBHOOK_URL:
+        builder = builder.updater(None)
+    application = builder.build()
+    Gauge("megabot_pending_updates", "Updates received and not yet picked up by a handler",
+          callback=application.update_queue.qsize)
 
     # Conversation handler for the /dl command
     dl_handler = ConversationHandler(
         entry_points=[CommandHandler("dl", dl_command)],
         states={
             AWAIT_FILE_CHOICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_file_selection)],
-            AWAIT_LINK_CONFIRM: [CallbackQueryHandler(handle_link_callback, pattern="^(dl_confirm|dl_cancel)$")],
+            AWAIT_LINK_CONFIRM: [CallbackQueryHandler(handle_link_callback, pattern="^dl_(confirm|cancel):\\d+$")],
+            AWAIT_SELECTION_CONFIRM: [
+                CallbackQueryHandler(handle_selection_callback, pattern="^sel_(confirm|change):\\d+$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_file_selection),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, selection_timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        allow_reentry=True,  # /dl again drops the selection in progress
         conversation_timeout=600 # 10 minutes
     )
 
@@ -398,11 +1292,80 @@ async def main():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("ping", ping))
     application.add_handler(CommandHandler("ls", ls))
+    application.add_handler(CommandHandler("sessions", list_sessions))
     application.add_handler(CommandHandler("cancel", cancel)) # Standalone cancel
-    application.add_handler(CallbackQueryHandler(pause_resume_callback, pattern="^(pause|resume)$"))
+    application.add_handler(CommandHandler("limit", limit_command))
+    application.add_handler(CommandHandler("batch", batch_command))
+    application.add_handler(MessageHandler(filters.CaptionRegex(r"^/batch(@\w+)?(\s|$)"), batch_command))
+    application.add_handler(CallbackQueryHandler(pause_resume_callback, pattern="^(pause|resume):\\d+$"))
+    application.add_handler(CallbackQueryHandler(listing_callback, pattern="^ls:\\d+:(next|prev|tog:\\d+)$"))
+
+    application.job_queue.run_repeating(bandwidth_job, BANDWIDTH_INTERVAL, name="bandwidth")
+    application.job_queue.run_repeating(pool_reap_job, MEGA_POOL_IDLE_TIMEOUT / 2, name="pool_reap")
+    if sdk_cache is not None:
+        application.job_queue.run_repeating(sdk_cache_evict_job, SDK_CACHE_EVICT_INTERVAL, first=0,
+                                            name="sdk_cache_evict")
+    application.job_queue.run_repeating(journal_flush_job, JOURNAL_FLUSH_INTERVAL, name="journal_flush")
+    application.job_queue.run_repeating(dedup_scan_job, DEDUP_SCAN_INTERVAL, first=0, name="dedup_scan")
+    if worker_hub is not None:
+        application.job_queue.run_repeating(worker_expire_job, WORKER_LEASE / 2, name="worker_expire")
+
+    http_server = HTTPServer()
+    http_server.route("GET", "/metrics", metrics_endpoint)
+    webhook = None
+    if WEBHOOK_URL:
+        webhook = Webhook(application, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_PENDING)
+        webhook.attach(http_server)
+    if worker_hub is not None:
+        worker_hub.attach(http_server)
+        # Jobs of sessions that won't be resumed are dropped; the rest are re-attached on resume
+        cancelled = job_queue.cancel_orphans(row[0] for row in journal.unfinished_sessions())
+        if cancelled:
+            logging.info(f"Cancelled {cancelled} queued download(s) of sessions that ended with the last run")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    quota.bind(loop)
+    pipeline.bind(loop)
 
     logging.info("Starting bot...")
-    await application.run_polling()
+    async with application:
+        await application.start()
+        await http_server.start(HTTP_HOST, HTTP_PORT, ssl=server_ssl_context())
+        if webhook is not None:
+            certificate = open(HTTP_TLS_CERT, "rb") if WEBHOOK_SELF_SIGNED else None
+            try:
+                await webhook.register(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, WEBHOOK_MAX_CONNECTIONS, certificate)
+            finally:
+                if certificate is not None:
+                    certificate.close()
+        else:
+            await application.updater.start_polling()
+        lag_monitor = asyncio.create_task(monitor_loop_lag())
+        resumer = asyncio.create_task(resume_sessions(application))
+        try:
+            await stop.wait()
+        finally:
+            lag_monitor.cancel()
+            resumer.cancel()
+            if webhook is not None:
+                # Telegram keeps what we turn away and redelivers it after the restart
+                await webhook.drain(WEBHOOK_DRAIN_TIMEOUT)
+            else:
+                await application.updater.stop()
+            await application.stop()
+            await http_server.stop()
+            pipeline.close()
+            for mega_session in sessions:
+                if mega_session.journal_id is not None:
+                    journal.update_transfers(mega_session.journal_id, mega_session.progress_rows())
+            journal.close()
+            downloads_index.close()
+            if job_queue is not None:
+                job_queue.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
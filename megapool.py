@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+from mega import (MegaApi, MegaRequest, MegaTransfer)
+
+from requestlistener import RequestListener, RequestError
+
+
+class PoolExhausted(Exception):
+    """Raised when no MegaApi worker frees up within the acquire timeout."""
+
+
+class MegaApiPool:
+    """Bounded pool of MegaApi workers shared by all sessions.
+
+    Every MegaApi brings its own SDK threads, connections and node tree, so
+    sessions lease one for their lifetime and hand it back when they close.
+    Returned workers are logged out of their folder and kept idle for reuse
+    until ``idle_timeout`` seconds pass without a lease.
+
+    With an SdkCache, workers for folder links are created with one of the
+    link's cache directories as basePath and keep it until they are torn
+    down; they only log out locally, so the node tree stays on disk and an
+    idle worker is handed out again preferably for the same link.
+    """
+    def __init__(self, api_key, size=4, idle_timeout=300, user_agent="megabot-telegram", cache=None):
+        self.api_key = api_key
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.user_agent = user_agent
+        self.cache = cache
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []  # (api, listener, released_at), most recently used last
+        self._leases = {}  # id(api) -> CacheLease of workers using the SDK cache
+        self.leased = 0
+
+    def _create(self, lease=None):
+        # Tear down idle workers first so the pool never holds more than ``size``
+        while self._idle and self.leased + len(self._idle) > self.size:
+            self._drop(self._idle.pop(0)[0])
+        logging.info("Creating MegaApi worker ({}/{}{})".format(
+            self.leased + len(self._idle), self.size, ", cached" if lease else ""))
+        api = MegaApi(self.api_key, None, lease.path if lease else None, self.user_agent)
+        if lease is not None:
+            self._leases[id(api)] = lease
+        return api, RequestListener()
+
+    def _drop(self, api):
+        """Forgets a worker and frees its cache directory."""
+        lease = self._leases.pop(id(api), None)
+        if lease is not None:
+            self.cache.release(lease)
+
+    def _take_idle(self, key):
+        """Pops the most recently used idle worker whose cache key is ``key`` (None: uncached)."""
+        for k in range(len(self._idle) - 1, -1, -1):
+            lease = self._leases.get(id(self._idle[k][0]))
+            if (lease.key if lease else None) == key:
+                api, listener, _ = self._idle.pop(k)
+                return api, listener
+        return None
+
+    def cache_state(self, api):
+        """Returns "warm" if ``api``'s cache holds an earlier login, "cold" if it's empty, else "uncached"."""
+        lease = self._leases.get(id(api))
+        if lease is None:
+            return "uncached"
+        return "warm" if lease.warm else "cold"
+
+    async def acquire(self, timeout=None, link=None):
+        """Leases an (api, listener) pair, waiting up to ``timeout`` for a free slot.
+
+        ``link`` is the folder link the worker will open; it picks the SDK
+        cache directory when there is a cache.
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolExhausted(f"All {self.size} Mega workers are busy")
+        self.leased += 1
+        if link is not None and self.cache is not None:
+            worker = self._take_idle(self.cache.key(link))
+            if worker is not None:
+                return worker
+            lease = await asyncio.to_thread(self.cache.lease, link)
+            if lease is not None:
+                return self._create(lease)
+            # Every cache slot of this link is busy: open it the slow way
+        worker = self._take_idle(None)
+        if worker is not None:
+            return worker
+        return self._create()
+
+    async def release(self, api, listener):
+        """Resets a leased worker's folder login and returns it to the pool."""
+        lease = self._leases.get(id(api))
+        try:
+            try:
+                api.cancelTransfers(MegaTransfer.TYPE_DOWNLOAD)
+                api.pauseTransfers(False)
+                api.setMaxDownloadSpeed(0)  # the next session gets its own limit
+                future = listener.expect(MegaRequest.TYPE_LOGOUT)
+                if lease is not None:
+                    api.localLogout(listener)  # a full logout would wipe the cache
+                else:
+                    api.logout(listener)
+                await asyncio.wait_for(future, 30)
+            except (RequestError, asyncio.TimeoutError) as e:
+                # A worker that can't be reset cleanly is not reused
+                logging.warning(f"Dropping MegaApi worker after failed logout: {str(e) or 'timed out'}")
+                self._drop(api)
+                return
+            if lease is not None:
+                lease.warm = lease.warm or await asyncio.to_thread(lambda: bool(os.listdir(lease.path)))
+            listener.cwd = None
+            # Idle before the slot frees up, so a waiting acquire reuses it rather than making another
+            self._idle.append((api, listener, time.monotonic()))
+        finally:
+            self.leased -= 1
+            self._slots.release()
+
+    def reap(self):
+        """Tears down workers that have been idle longer than ``idle_timeout``."""
+        cutoff = time.monotonic() - self.idle_timeout
+        keep = []
+        for worker in self._idle:
+            if worker[2] >= cutoff:
+                keep.append(worker)
+            else:
+                self._drop(worker[0])
+        reaped = len(self._idle) - len(keep)
+        self._idle = keep
+        if reaped:
+            logging.info(f"Tore down {reaped} idle MegaApi worker(s)")
+        return reaped
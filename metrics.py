@@ -0,0 +1,172 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Minimal Prometheus text-format metrics. Counters and histograms may be
+# updated from SDK callback threads, so updates take a lock.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def header(self):
+        return f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items()) or ([((), 0)] if not self.labelnames else [])
+        return "".join(f"{self.name}{_labels(self.labelnames, k)} {v}\n" for k, v in items)
+
+
+class Gauge(_Metric):
+    """Gauge set directly or computed at scrape time by ``callback``.
+
+    ``callback`` returns a number, or an iterable of (label_values, value)
+    pairs for labelled gauges.
+    """
+    kind = "gauge"
+
+    def __init__(self, *args, callback=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.callback is not None:
+            value = self.callback()
+            items = list(value) if self.labelnames else [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return "".join(f"{self.name}{_labels(self.labelnames, k)} {v}\n" for k, v in items)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        names = self.labelnames + ("le",)
+        out = []
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                out.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}\n")
+            out.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {state[-1]}\n")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {state[-2]}\n")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {state[-1]}\n")
+        return "".join(out)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        return "".join(m.header() + m.render() for m in self._metrics)
+
+
+REGISTRY = Registry()
+
+# --- Bot metrics ---
+
+DOWNLOADED_BYTES = Counter(
+    "megabot_downloaded_bytes_total", "Bytes received by all downloads")
+OVER_QUOTA_EVENTS = Counter(
+    "megabot_over_quota_events_total", "Transfer over-quota errors reported by the SDK")
+SDK_REQUEST_SECONDS = Histogram(
+    "megabot_sdk_request_seconds", "Latency of Mega SDK requests", ("request",))
+TREE_WALK_SECONDS = Histogram(
+    "megabot_tree_walk_seconds", "Time spent indexing a folder tree")
+TELEGRAM_API_SECONDS = Histogram(
+    "megabot_telegram_api_seconds", "Latency of Telegram Bot API calls", ("method",))
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "megabot_event_loop_lag_seconds", "How late the event loop runs a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+WEBHOOK_REQUESTS = Counter(
+    "megabot_webhook_requests_total", "Webhook deliveries by outcome", ("result",))
+UPDATE_SECONDS = Histogram(
+    "megabot_update_seconds", "Time from an update being picked up to the end of its handlers")
+POSTPROCESS_SECONDS = Histogram(
+    "megabot_postprocess_seconds", "Duration of post-processing steps, including the wait for a worker",
+    ("step",), buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+POSTPROCESS_FAILURES = Counter(
+    "megabot_postprocess_failures_total", "Post-processing jobs that failed, by step", ("step",))
+FOLDER_OPEN_SECONDS = Histogram(
+    "megabot_folder_open_seconds", "Folder link login plus node fetch, by SDK cache state", ("cache",),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
@@ -0,0 +1,612 @@
+import asyncio
+import errno
+import functools
+import hashlib
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import POSTPROCESS_SECONDS, POSTPROCESS_FAILURES
+
+CHUNK_SIZE = 1024 * 1024
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+HASH_SUFFIXES = {".md5": "md5", ".sha1": "sha1", ".sha256": "sha256", ".sha512": "sha512"}
+SUMS_FILES = {"MD5SUMS": "md5", "SHA1SUMS": "sha1", "SHA256SUMS": "sha256", "SHA512SUMS": "sha512"}
+ARCHIVE_RE = re.compile(r'\.(zip|tar|tgz|tbz2|txz|tar\.gz|tar\.bz2|tar\.xz|7z|rar|(?:7z|zip)\.001)$', re.I)
+# Volumes after the first are extracted along with it
+LATER_VOLUME_RE = re.compile(r'\.part(?!0*1\.rar$)\d+\.rar$|\.(?:7z|zip)\.(?!001$)\d{3}$', re.I)
+PROGRESS_RE = re.compile(rb'(\d+)%')
+
+
+class StepError(Exception):
+    """A post-processing step failed; the message is shown in the status message."""
+
+
+def iter_files(paths):
+    """Every regular file in ``paths``, which may be files or directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def copy_stream(src, dst, on_chunk, chunk_size=CHUNK_SIZE):
+    """Copies file object ``src`` to ``dst`` in chunks, calling ``on_chunk(n)`` after each."""
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return
+        dst.write(chunk)
+        on_chunk(len(chunk))
+
+
+def unique_path(path):
+    """``path``, or ``path (n)`` with the first n that doesn't exist yet."""
+    if not os.path.lexists(path):
+        return path
+    for n in itertools.count(1):
+        candidate = f"{path} ({n})"
+        if not os.path.lexists(candidate):
+            return candidate
+
+
+# --- Steps ---
+
+STEPS = {}
+
+
+def register_step(cls):
+    """Class decorator making a Step available by its ``name`` in the POSTPROCESS setting."""
+    STEPS[cls.name] = cls
+    return cls
+
+
+class Step:
+    """One stage of the post-processing pipeline.
+
+    ``run`` gets the paths the previous stage left (files or directories)
+    and returns the paths for the next one. It runs on a worker thread, or
+    in a worker process when ``in_process`` is set, in which case the step
+    must be picklable. ``report(done, total)`` updates the progress shown
+    in the session's status message. ``context`` has the download's
+    ``name``, ``category`` and ``chat_id``.
+    """
+    name = None
+    label = None  # shown while the step runs, e.g. "hashing"
+    in_process = False
+
+    def __init__(self, arg=None):
+        self.arg = arg
+
+    def run(self, paths, context, report):
+        raise NotImplementedError
+
+
+def _read_sums(path):
+    """(file name, digest) pairs of a checksum list; a bare digest gives an empty name."""
+    pairs = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            parts = line.strip().split(None, 1)
+            if parts and not parts[0].startswith("#"):
+                pairs.append((parts[1].lstrip("*") if len(parts) > 1 else "", parts[0].lower()))
+    return pairs
+
+
+@register_step
+class HashStep(Step):
+    """Hashes every file and verifies it against a sidecar (``file.sha256``)
+    or a ``SHA256SUMS``-style list next to it, if there is one.
+
+    The argument is the algorithm for files without one (default sha256).
+    """
+    name = "hash"
+    label = "hashing"
+
+    def __init__(self, arg=None):
+        super().__init__(arg or "sha256")
+        hashlib.new(self.arg)  # fails early on an unknown algorithm
+
+    def run(self, paths, context, report):
+        files = [f for f in iter_files(paths)
+                 if os.path.basename(f) not in SUMS_FILES and not f.endswith(tuple(HASH_SUFFIXES))]
+        expected = self._expected(files)
+        total = sum(os.path.getsize(f) for f in files)
+        done = 0
+        mismatched = []
+        for path in files:
+            algorithm, digest = expected.get(path, (self.arg, None))
+            h = hashlib.new(algorithm)
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    h.update(chunk)
+                    done += len(chunk)
+                    report(done, total)
+            if digest is None:
+                logging.info(f"{algorithm} {h.hexdigest()} {path}")
+            elif h.hexdigest() != digest:
+                logging.warning(f"Checksum mismatch for {path}: {h.hexdigest()} != {digest}")
+                mismatched.append(os.path.basename(path))
+        if mismatched:
+            raise StepError(f"checksum mismatch: {', '.join(mismatched[:5])}"
+                            + (f" and {len(mismatched) - 5} more" if len(mismatched) > 5 else ""))
+        return paths
+
+    @staticmethod
+    def _expected(files):
+        expected = {}
+        for directory in {os.path.dirname(f) for f in files}:
+            for name, algorithm in SUMS_FILES.items():
+                sums = os.path.join(directory, name)
+                if os.path.isfile(sums):
+                    for target, digest in _read_sums(sums):
+                        expected[os.path.normpath(os.path.join(directory, target))] = (algorithm, digest)
+        for path in files:
+            for suffix, algorithm in HASH_SUFFIXES.items():
+                if os.path.isfile(path + suffix):
+                    for _, digest in _read_sums(path + suffix)[:1]:
+                        expected[path] = (algorithm, digest)
+        return expected
+
+
+class _CountingReader:
+    """Read-through wrapper counting the bytes taken from an archive."""
+    def __init__(self, f):
+        self._f = f
+        self.count = 0
+
+    def read(self, n=-1):
+        data = self._f.read(n)
+        self.count += len(data)
+        return data
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def seekable(self):
+        return self._f.seekable()
+
+
+def _safe_join(root, member, directory=False):
+    target = os.path.normpath(os.path.join(root, member))
+    if directory and target == os.path.normpath(root):
+        return target  # "." or "./" of archives made with e.g. ``tar czf x.tgz .``
+    if os.path.isabs(member) or not target.startswith(os.path.join(root, "")):
+        raise StepError(f"refusing to extract {member} outside the archive's folder")
+    return target
+
+
+@register_step
+class ExtractStep(Step):
+    """Extracts zip and tar archives, and 7z and rar ones if a 7z binary is
+    installed, into a folder named after the archive.
+
+    Members are streamed to disk chunk by chunk; links and special files are
+    skipped. With the argument ``delete`` extracted archives are removed.
+    Runs in a worker process, so large archives don't compete with the bot
+    for the GIL.
+    """
+    name = "extract"
+    label = "extracting"
+    in_process = True
+
+    def run(self, paths, context, report):
+        archives = [f for f in iter_files(paths) if ARCHIVE_RE.search(f) and not LATER_VOLUME_RE.search(f)]
+        total = sum(os.path.getsize(v) for a in archives for v in self._volumes(a))
+        done = 0
+        extracted = {}
+        for archive in archives:
+            dest = unique_path(re.sub(r'(?:\.part0*1)?' + ARCHIVE_RE.pattern, "", archive, flags=re.I))
+            size = sum(os.path.getsize(v) for v in self._volumes(archive))
+            os.makedirs(dest)
+            try:
+                self._extract(archive, dest, lambda n, base=done: report(base + n, total))
+            except BaseException:
+                shutil.rmtree(dest, ignore_errors=True)
+                raise
+            done += size
+            report(done, total)
+            extracted[archive] = dest
+            if self.arg == "delete":
+                for volume in self._volumes(archive):
+                    os.remove(volume)
+        result = []
+        for path in paths:
+            if path in extracted:
+                result.append(extracted[path])
+                if self.arg == "delete":
+                    continue
+            result.append(path)
+        return result
+
+    @staticmethod
+    def _volumes(archive):
+        m = re.search(r'\.part0*1\.rar$|\.(?:7z|zip)\.001$', archive, re.I)
+        if m is None:
+            return [archive]
+        stem = archive[:m.start()]
+        pattern = re.compile(re.escape(os.path.basename(stem)) + f"(?:{LATER_VOLUME_RE.pattern})", re.I)
+        directory = os.path.dirname(archive)
+        return [archive] + sorted(os.path.join(directory, n) for n in os.listdir(directory) if pattern.match(n))
+
+    def _extract(self, archive, dest, progress):
+        lower = archive.lower()
+        with open(archive, "rb") as raw:
+            reader = _CountingReader(raw)
+            if lower.endswith(".zip"):
+                with zipfile.ZipFile(reader) as zf:
+                    for info in zf.infolist():
+                        target = _safe_join(dest, info.filename, info.is_dir())
+                        if info.is_dir():
+                            os.makedirs(target, exist_ok=True)
+                            continue
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with zf.open(info) as src, open(target, "wb") as dst:
+                            copy_stream(src, dst, lambda _: progress(reader.count))
+                return
+            if not lower.endswith((".7z", ".rar", ".001")):
+                # Stream mode never seeks back, so multi-GB tarballs are read exactly once
+                with tarfile.open(fileobj=reader, mode="r|*") as tf:
+                    for member in tf:
+                        target = _safe_join(dest, member.name, member.isdir())
+                        if member.isdir():
+                            os.makedirs(target, exist_ok=True)
+                        elif member.isfile():
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            with tf.extractfile(member) as src, open(target, "wb") as dst:
+                                copy_stream(src, dst, lambda _: progress(reader.count))
+                return
+        self._extract_with_7z(archive, dest, progress)
+
+    @staticmethod
+    def _extract_with_7z(archive, dest, progress):
+        tool = shutil.which("7z") or shutil.which("7zz")
+        if tool is None:
+            raise StepError(f"can't extract {os.path.basename(archive)}: 7z is not installed")
+        size = os.path.getsize(archive)
+        proc = subprocess.Popen([tool, "x", "-y", "-bsp1", "-bso0", f"-o{dest}", archive],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        while chunk := proc.stdout.read1(4096):
+            percents = PROGRESS_RE.findall(chunk)
+            if percents:
+                progress(size * int(percents[-1]) // 100)
+        stderr = proc.stderr.read().decode(errors="replace").strip()
+        if proc.wait() != 0:
+            raise StepError(f"7z failed on {os.path.basename(archive)}: {stderr.splitlines()[-1] if stderr else proc.returncode}")
+
+
+@register_step
+class MoveStep(Step):
+    """Moves the results into a directory.
+
+    The argument is the destination, with ``{category}``, ``{chat_id}`` and
+    ``{name}`` filled in from the download. Renames when it can; across
+    filesystems files are copied in chunks and then removed.
+    """
+    name = "move"
+    label = "moving"
+
+    def __init__(self, arg=None):
+        if not arg:
+            raise ValueError("move needs a destination, e.g. move:/media/{category}")
+        try:
+            arg.format(category="", chat_id=0, name="")
+        except (KeyError, IndexError) as e:
+            raise ValueError(f"move destination {arg} has an unknown field {e}")
+        super().__init__(arg)
+
+    def run(self, paths, context, report):
+        dest_dir = self.arg.format(**context)
+        os.makedirs(dest_dir, exist_ok=True)
+        total = sum(os.path.getsize(f) for f in iter_files(paths))
+        done = 0
+
+        def copied(n):
+            nonlocal done
+            done += n
+            report(done, total)
+
+        moved = []
+        for path in paths:
+            target = unique_path(os.path.join(dest_dir, os.path.basename(path.rstrip("/"))))
+            size = sum(os.path.getsize(f) for f in iter_files([path]))
+            try:
+                os.rename(path, target)
+                copied(size)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                self._copy(path, target, copied)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            moved.append(target)
+        return moved
+
+    @staticmethod
+    def _copy(path, target, copied):
+        if os.path.isdir(path):
+            os.makedirs(target)
+            for name in sorted(os.listdir(path)):
+                MoveStep._copy(os.path.join(path, name), os.path.join(target, name), copied)
+            shutil.copystat(path, target)
+        elif os.path.isfile(path):
+            with open(path, "rb") as src, open(target, "wb") as dst:
+                copy_stream(src, dst, copied)
+            shutil.copystat(path, target)
+
+
+@register_step
+class ChmodStep(Step):
+    """Sets permissions; the argument is the octal mode for files (default 644).
+
+    Directories get the same mode plus execute wherever it grants read.
+    """
+    name = "chmod"
+    label = "setting permissions"
+
+    def __init__(self, arg=None):
+        super().__init__(int(arg or "644", 8))
+
+    def run(self, paths, context, report):
+        dir_mode = self.arg | ((self.arg & 0o444) >> 2)
+        targets = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    targets.append((root, dir_mode))
+                    targets.extend((os.path.join(root, name), self.arg) for name in files)
+            elif os.path.exists(path):
+                targets.append((path, self.arg))
+        for k, (target, mode) in enumerate(targets, 1):
+            if not os.path.islink(target):
+                os.chmod(target, mode)
+            report(k, len(targets))
+        return paths
+
+
+@register_step
+class HookStep(Step):
+    """Runs a command with the paths appended as arguments.
+
+    ``MEGABOT_NAME``, ``MEGABOT_CATEGORY`` and ``MEGABOT_CHAT_ID`` are set in
+    its environment. A non-zero exit fails the job with the last line the
+    command wrote to stderr.
+    """
+    name = "hook"
+    label = "running hook"
+    timeout = 3600
+
+    def __init__(self, arg=None):
+        if not arg:
+            raise ValueError("hook needs a command, e.g. 'hook:/usr/local/bin/notify --quiet'")
+        super().__init__(shlex.split(arg))
+
+    def run(self, paths, context, report):
+        env = dict(os.environ, MEGABOT_NAME=str(context.get("name", "")),
+                   MEGABOT_CATEGORY=str(context.get("category", "")), MEGABOT_CHAT_ID=str(context.get("chat_id", "")))
+        try:
+            proc = subprocess.run(self.arg + list(paths), env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            raise StepError(f"{self.arg[0]} timed out")
+        if proc.returncode != 0:
+            lines = proc.stderr.decode(errors="replace").strip().splitlines()
+            raise StepError(f"{os.path.basename(self.arg[0])} exited with {proc.returncode}"
+                            + (f": {lines[-1]}" if lines else ""))
+        return paths
+
+
+def load_plugins(modules):
+    """Imports modules that register extra steps with ``register_step``."""
+    for module in modules:
+        importlib.import_module(module)
+
+
+def parse_steps(spec):
+    """Builds the steps of a POSTPROCESS spec such as ``hash extract:delete move:/media/{category}``.
+
+    Steps are separated by spaces (quote ones with spaces in them), each
+    ``name`` or ``name:argument``.
+    """
+    steps = []
+    for token in shlex.split(spec or ""):
+        name, _, arg = token.partition(":")
+        cls = STEPS.get(name)
+        if cls is None:
+            raise ValueError(f"Unknown post-processing step '{name}' (known: {', '.join(sorted(STEPS))})")
+        steps.append(cls(arg or None))
+    return steps
+
+
+# --- Jobs ---
+
+class PostJob:
+    """Post-processing of one finished download, shown in its session's status message."""
+    __slots__ = ("id", "name", "paths", "context", "state", "step", "done", "total", "error", "task")
+
+    def __init__(self, path, context):
+        self.id = None
+        self.name = os.path.basename(path.rstrip("/"))
+        self.paths = [path]
+        self.context = context
+        self.state = QUEUED
+        self.step = None
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.task = None
+
+    @property
+    def is_finished(self):
+        return self.state in (DONE, FAILED)
+
+    def getStatus_telegram(self):
+        name = self.name[:21] + "..." if len(self.name) > 24 else self.name
+        if self.error:
+            return f"{name}: ERROR ({self.step.name if self.step else 'post'}): {self.error}"
+        if self.state == DONE:
+            return f"{name} Processed"
+        if self.state == QUEUED or self.step is None:
+            return f"{name} Waiting for post-processing"
+        progress = f" {int(100 * self.done / self.total)}%" if self.total else ""
+        return f"{name} {self.step.label}{progress}"
+
+
+def _thread_reporter(job):
+    def report(done, total):
+        job.state = RUNNING
+        job.done = done
+        job.total = total
+    return report
+
+
+def _run_step(step, paths, context, report):
+    report(0, 0)
+    return step.run(paths, context, report)
+
+
+# Set in worker processes by _init_worker
+_progress_queue = None
+
+
+def _init_worker(queue):
+    global _progress_queue
+    _progress_queue = queue
+
+
+class _QueueReporter:
+    """Sends a worker process's progress to the bot, at most every ``interval`` seconds."""
+    interval = 0.5
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._next = 0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if now >= self._next or done == total:
+            self._next = now + self.interval
+            _progress_queue.put((self.job_id, done, total))
+
+
+def _run_step_in_process(step, paths, context, job_id):
+    return _run_step(step, paths, context, _QueueReporter(job_id))
+
+
+class Pipeline:
+    """Runs the configured steps on every finished download.
+
+    Each download becomes a PostJob whose steps run one after the other.
+    Steps run on a bounded thread pool, or on a bounded process pool when
+    they are ``in_process`` (extraction), so a multi-GB archive neither
+    blocks the event loop nor starves the SDK callback threads of the GIL.
+    Worker processes report progress over a queue drained by a thread.
+    """
+    def __init__(self, steps, threads=2, processes=1):
+        self.steps = steps
+        self.threads = threads
+        self.processes = processes  # 0 runs in_process steps on the thread pool too
+        self._thread_pool = None
+        self._process_pool = None
+        self._progress = None
+        self._jobs = {}  # job id -> job, while it runs
+        self._ids = itertools.count(1)
+        self._loop = None
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def submit_threadsafe(self, job):
+        """Queues a job from an SDK callback thread."""
+        self._loop.call_soon_threadsafe(self.submit, job)
+
+    def submit(self, job):
+        job.id = next(self._ids)
+        job.task = self._loop.create_task(self._run(job))
+
+    def cancel(self, job):
+        """Drops a job; a step already running on a worker is left to finish."""
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def _executor(self, step):
+        if not step.in_process or self.processes <= 0:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(self.threads, thread_name_prefix="postprocess")
+            return self._thread_pool
+        if self._process_pool is None:
+            # spawn rather than fork: forking a process running SDK threads isn't safe
+            context = multiprocessing.get_context("spawn")
+            self._progress = context.Queue()
+            self._process_pool = ProcessPoolExecutor(self.processes, mp_context=context,
+                                                     initializer=_init_worker, initargs=(self._progress,))
+            threading.Thread(target=self._drain, args=(self._progress,), name="postprocess-progress",
+                             daemon=True).start()
+        return self._process_pool
+
+    def _drain(self, queue):
+        while (item := queue.get()) is not None:
+            job_id, done, total = item
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.state = RUNNING
+                job.done = done
+                job.total = total
+
+    async def _run(self, job):
+        self._jobs[job.id] = job
+        paths = job.paths
+        try:
+            for step in self.steps:
+                job.step = step
+                job.done = job.total = 0
+                executor = self._executor(step)
+                if isinstance(executor, ProcessPoolExecutor):
+                    call = functools.partial(_run_step_in_process, step, paths, job.context, job.id)
+                else:
+                    call = functools.partial(_run_step, step, paths, job.context, _thread_reporter(job))
+                with POSTPROCESS_SECONDS.time(step.name):
+                    paths = await self._loop.run_in_executor(executor, call)
+            job.paths = paths
+            job.state = DONE
+            logging.info(f"Post-processed {job.name}: {', '.join(paths)}")
+        except asyncio.CancelledError:
+            job.error = "cancelled"
+            job.state = FAILED
+            raise
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.state = FAILED
+            POSTPROCESS_FAILURES.inc(1, job.step.name)
+            logging.error(f"Post-processing of {job.name} failed in {job.step.name}: {job.error}")
+        finally:
+            self._jobs.pop(job.id, None)
+
+    def close(self):
+        """Stops the worker pools; jobs still running are abandoned."""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._progress.put(None)
@@ -0,0 +1,72 @@
+import logging
+import random
+import time
+
+
+class QuotaManager:
+    """Over-quota state shared by every session.
+
+    When any transfer reports API_EOVERQUOTA, all transfers are paused until
+    the wait time reported by the server has passed (or, if the server gave
+    none, a capped exponential backoff), plus some jitter so every worker
+    doesn't hit the server at the same moment. ``on_pause`` and
+    ``on_resume`` are called on the event loop when the state changes.
+    """
+    def __init__(self, base_backoff=60, max_backoff=3600, jitter=0.1, on_pause=None, on_resume=None):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.resume_at = 0
+        self._attempt = 0
+        self._last_resume = 0
+        self._timer = None
+        self._loop = None
+
+    @property
+    def over_quota(self):
+        return self._timer is not None
+
+    def eta(self):
+        """Seconds left until transfers resume, 0 when not over quota."""
+        if self._timer is None:
+            return 0
+        return max(0, self.resume_at - time.monotonic())
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def report_threadsafe(self, wait):
+        """Reports an over-quota error from an SDK callback thread."""
+        self._loop.call_soon_threadsafe(self.report, wait)
+
+    def report(self, wait):
+        """Records an over-quota error; ``wait`` is the server's delay in seconds (0 if unknown)."""
+        now = time.monotonic()
+        if self._timer is not None and wait <= 0:
+            return  # already waiting; repeated reports from other transfers add nothing
+        if now - self._last_resume > self.max_backoff:
+            self._attempt = 0
+        if wait <= 0:
+            wait = min(self.max_backoff, self.base_backoff * 2 ** self._attempt)
+        self._attempt += 1
+        wait *= 1 + random.uniform(0, self.jitter)
+        resume_at = now + min(wait, self.max_backoff * (1 + self.jitter))
+        if resume_at <= self.resume_at and self._timer is not None:
+            return
+        self.resume_at = resume_at
+        paused = self._timer is None
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_at(self._loop.time() + (resume_at - now), self._resume)
+        logging.warning(f"Over quota, pausing transfers for {resume_at - now:.0f}s")
+        if paused and self.on_pause is not None:
+            self.on_pause()
+
+    def _resume(self):
+        self._timer = None
+        self._last_resume = time.monotonic()
+        logging.info("Quota wait over, resuming transfers")
+        if self.on_resume is not None:
+            self.on_resume()
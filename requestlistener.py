@@ -1,28 +1,61 @@
-import threading
+import asyncio
 import logging
 from mega import ( MegaRequestListener, MegaError, MegaRequest)
 
+
+class RequestError(Exception):
+    """Raised when the SDK finishes an awaited request with an error."""
+    def __init__(self, request_type, error):
+        self.request_type = request_type
+        self.error_code = error.getErrorCode()
+        super(RequestError, self).__init__(error.toString())
+
+
 class RequestListener(MegaRequestListener):
+    """Request listener that resolves asyncio futures from SDK threads.
+
+    The SDK calls back on its own worker thread, so results are handed over
+    to the event loop with ``call_soon_threadsafe`` instead of blocking a
+    coroutine on a ``threading.Event``.
+    """
     def __init__(self):
         self.cwd = None
-        self.event = threading.Event()
+        self._loop = None
+        self._pending = None
         super(RequestListener, self).__init__()
 
+    def expect(self, *request_types):
+        """Returns a future for the next finished request of ``request_types``.
+
+        Must be called from the event loop before the SDK call is issued.
+        Requests of other types (e.g. a late answer to a request that already
+        timed out) never resolve it.
+        """
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        self._pending = (future, request_types)
+        return future
+
+    def _finish(self, request_type, result=None, exc=None):
+        pending = self._pending
+        if pending is None or request_type not in pending[1]:
+            return
+        self._pending = None
+        self._loop.call_soon_threadsafe(_resolve, pending[0], result, exc)
+
     def onRequestStart(self, api, request):
         logging.info('Request start ({})'.format(request.getType()))
 
     def onRequestFinish(self, api, request, error):
         logging.info('Request finished ({}); Result: {}'
                      .format(request, error))
+        request_type = request.getType()
         if error.getErrorCode() != MegaError.API_OK:
-            self.event.set()
-            self.event.clear()
+            self._finish(request_type, exc=RequestError(request_type, error))
             return
 
-        request_type = request.getType()
-        if request_type == MegaRequest.TYPE_LOGIN:
-            api.fetchNodes(self)
-        elif request_type == MegaRequest.TYPE_EXPORT:
+        result = None
+        if request_type == MegaRequest.TYPE_EXPORT:
             logging.info('Exported link: {}'.format(request.getLink()))
         elif request_type == MegaRequest.TYPE_ACCOUNT_DETAILS:
             account_details = request.getMegaAccountDetails()
@@ -35,14 +68,21 @@ class RequestListener(MegaRequestListener):
                                  / account_details.getStorageMax()))
             logging.info('Pro level: {}'.format(account_details.getProLevel()))
         elif request_type == MegaRequest.TYPE_FETCH_NODES:
-            self.cwd = api.getRootNode()
+            self.cwd = result = api.getRootNode()
         elif request_type == MegaRequest.TYPE_GET_PUBLIC_NODE:
-            self.cwd = request.getPublicMegaNode()
+            self.cwd = result = request.getPublicMegaNode()
 
-        if request_type != MegaRequest.TYPE_LOGIN and request_type != MegaRequest.TYPE_DELETE:
-            self.event.set()
-            self.event.clear()
+        self._finish(request_type, result)
 
     def onRequestTemporaryError(self, api, request, error):
         logging.info('Request temporary error ({}); Error: {}'
-                     .format(request, error))
\ No newline at end of file
+                     .format(request, error))
+
+
+def _resolve(future, result, exc):
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import OrderedDict
+
+
+class DownloadScheduler:
+    """Starts queued downloads under a global and a per-chat concurrency cap.
+
+    Each MegaSession keeps its pending downloads in ``session.backlog`` as a
+    heap of (priority, seq, handle, save_to, node) tuples; lower priorities
+    start first. Chats take turns round-robin, so one chat selecting
+    thousands of files can't starve the others, while a chat whose next job
+    has a better priority than everyone else's goes first.
+    """
+    def __init__(self, max_active=6, per_chat=3):
+        self.max_active = max_active
+        self.per_chat = per_chat
+        self.active = 0
+        self._chats = OrderedDict()  # chat_id -> [sessions], in round-robin order
+        self._chat_active = {}
+        self._seq = itertools.count()
+        self._loop = None
+        self._pump_task = None
+        self.quota = None  # QuotaManager; nothing new starts while over quota
+
+    @property
+    def queued(self):
+        return sum(len(s.backlog) for sessions in self._chats.values() for s in sessions)
+
+    def submit(self, session, handle=None, save_to=None, priority=0, node=None):
+        """Queues a download of ``handle`` (or an already resolved ``node``) for ``session``."""
+        heapq.heappush(session.backlog, (priority, next(self._seq), handle, save_to, node))
+        sessions = self._chats.setdefault(session.chat_id, [])
+        if session not in sessions:
+            sessions.append(session)
+        self.wakeup()
+
+    def remove(self, session):
+        """Drops a session's queued downloads; transfers already started are left alone."""
+        session.backlog.clear()
+        sessions = self._chats.get(session.chat_id)
+        if sessions and session in sessions:
+            sessions.remove(session)
+            if not sessions:
+                del self._chats[session.chat_id]
+
+    def finished(self, session):
+        """Frees the slot of one of ``session``'s transfers. Call on the event loop."""
+        self.active -= 1
+        session.active -= 1
+        count = self._chat_active.get(session.chat_id, 1) - 1
+        if count:
+            self._chat_active[session.chat_id] = count
+        else:
+            self._chat_active.pop(session.chat_id, None)
+        self.wakeup()
+
+    def finished_threadsafe(self, session):
+        """Same as ``finished`` but callable from SDK callback threads."""
+        self._loop.call_soon_threadsafe(self.finished, session)
+
+    def wakeup(self):
+        """Starts queued downloads if there is spare capacity."""
+        self._loop = asyncio.get_running_loop()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = self._loop.create_task(self._pump())
+
+    def _next(self):
+        """Picks the next (session, job) in fair order or returns None."""
+        best = None
+        for chat_id, sessions in self._chats.items():
+            if self._chat_active.get(chat_id, 0) >= self.per_chat:
+                continue
+            for session in sessions:
+                if session.backlog and not session.paused:
+                    if best is None or session.backlog[0][0] < best[1].backlog[0][0]:
+                        best = (chat_id, session)
+                    break
+        if best is None:
+            return None
+        chat_id, session = best
+        job = heapq.heappop(session.backlog)
+        sessions = self._chats.pop(chat_id)
+        sessions.remove(session)
+        if session.backlog:
+            sessions.append(session)
+        if sessions:
+            self._chats[chat_id] = sessions  # re-inserted last: round-robin
+        return session, job
+
+    async def _pump(self):
+        while self.active < self.max_active:
+            if self.quota is not None and self.quota.over_quota:
+                return
+            picked = self._next()
+            if picked is None:
+                return
+            session, (_, _, handle, save_to, node) = picked
+            self.active += 1
+            session.active += 1
+            self._chat_active[session.chat_id] = self._chat_active.get(session.chat_id, 0) + 1
+            try:
+                if node is None:
+                    node = await session.authorize_node(handle)
+                started = await session.start_download(node, save_to, on_finish=self.finished_threadsafe)
+            except Exception as e:
+                logging.error(f"Error starting download of {handle}: {e}")
+                started = False
+            if not started:
+                self.finished(session)
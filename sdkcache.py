@@ -0,0 +1,138 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+
+class CacheLease:
+    """One SDK cache directory, held by one MegaApi worker for as long as it lives."""
+    __slots__ = ("key", "slot", "path", "warm", "_lock_file")
+
+    def __init__(self, key, slot, path, warm, lock_file):
+        self.key = key
+        self.slot = slot
+        self.path = path
+        self.warm = warm  # the directory holds a node tree from an earlier login
+        self._lock_file = lock_file
+
+
+def _tree_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return total
+
+
+class SdkCache:
+    """Size-bounded home for the Mega SDK's on-disk caches, per folder link.
+
+    A MegaApi created with a basePath keeps the folder's node tree there, so
+    the next login to the same link loads it locally and only fetches what
+    changed since. Two SDK instances must never share a cache, so each link
+    gets up to ``slots`` directories (``root/<key>/<slot>``) and a worker
+    leases one for its whole life. Leases are also guarded by an flock on
+    ``<slot>.lock``, which keeps other bot processes on the host off them.
+    ``evict`` removes the least recently used slots nobody holds until the
+    cache fits in ``max_bytes``.
+    """
+    def __init__(self, root, max_bytes=10 * 1024 ** 3, slots=2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.slots = slots
+        self.size = 0  # bytes on disk as of the last evict
+        self._leased = {}  # (key, slot) -> CacheLease
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(link):
+        return hashlib.sha256(link.strip().encode()).hexdigest()[:24]
+
+    def lease(self, link):
+        """Leases a free cache directory for ``link``; None when every slot is in use."""
+        key = self.key(link)
+        directory = os.path.join(self.root, key)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            for slot in range(self.slots):
+                if (key, slot) in self._leased:
+                    continue
+                path = os.path.join(directory, str(slot))
+                lock_file = open(path + ".lock", "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()  # held by another process
+                    continue
+                os.makedirs(path, exist_ok=True)
+                os.utime(lock_file.name)
+                lease = CacheLease(key, slot, path, bool(os.listdir(path)), lock_file)
+                self._leased[(key, slot)] = lease
+                return lease
+        return None
+
+    def release(self, lease):
+        """Gives a directory back once the MegaApi using it is gone."""
+        with self._lock:
+            if self._leased.pop((lease.key, lease.slot), None) is None:
+                return
+            os.utime(lease._lock_file.name)  # last use, for eviction order
+            lease._lock_file.close()  # drops the flock
+
+    def evict(self):
+        """Deletes least recently used free slots until the cache fits; returns how many.
+
+        Walks the whole cache, so run it in a worker thread.
+        """
+        slots = []  # (last used, size, key, slot, path)
+        total = 0
+        for key in os.listdir(self.root):
+            directory = os.path.join(self.root, key)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if not name.isdigit() or not os.path.isdir(path):
+                    continue
+                size = _tree_size(path)
+                total += size
+                try:
+                    used = os.stat(path + ".lock").st_mtime
+                except OSError:
+                    used = 0
+                slots.append((used, size, key, int(name), path))
+        slots.sort()
+        evicted = 0
+        for used, size, key, slot, path in slots:
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if (key, slot) in self._leased:
+                    continue
+                with open(path + ".lock", "a") as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                    shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+        self.size = total
+        if evicted:
+            logging.info(f"Evicted {evicted} SDK cache dir(s), {total // 1024 ** 2} MB left")
+        return evicted
@@ -0,0 +1,322 @@
+import re
+from bisect import bisect_right
+from fnmatch import fnmatchcase
+
+
+class IntervalSet:
+    """Set of non-negative ints stored as sorted, disjoint [start, end) intervals.
+
+    "0-5000000" costs one pair instead of five million ints.
+    """
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        for start, end in sorted(intervals):
+            self._append(start, end)
+
+    @classmethod
+    def from_sorted(cls, values):
+        """Builds a set from ascending ints, merging consecutive runs."""
+        result = cls()
+        for v in values:
+            result._append(v, v + 1)
+        return result
+
+    def _append(self, start, end):
+        if start >= end:
+            return
+        if self._ends and start <= self._ends[-1]:
+            if end > self._ends[-1]:
+                self._ends[-1] = end
+            return
+        self._starts.append(start)
+        self._ends.append(end)
+
+    def intervals(self):
+        return zip(self._starts, self._ends)
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __len__(self):
+        return sum(e - s for s, e in zip(self._starts, self._ends))
+
+    def __bool__(self):
+        return bool(self._starts)
+
+    def __contains__(self, value):
+        k = bisect_right(self._starts, value) - 1
+        return k >= 0 and value < self._ends[k]
+
+    def __or__(self, other):
+        return IntervalSet(list(self.intervals()) + list(other.intervals()))
+
+    def __sub__(self, other):
+        result = IntervalSet()
+        cut = list(other.intervals())
+        k = 0
+        for start, end in self.intervals():
+            while k < len(cut) and cut[k][1] <= start:
+                k += 1
+            j = k
+            while start < end and j < len(cut) and cut[j][0] < end:
+                if cut[j][0] > start:
+                    result._append(start, cut[j][0])
+                start = max(start, cut[j][1])
+                j += 1
+            result._append(start, end)
+        return result
+
+    def covers(self, start, end):
+        """True if every value in [start, end) is in the set."""
+        if start >= end:
+            return True
+        k = bisect_right(self._starts, start) - 1
+        return k >= 0 and self._ends[k] >= end
+
+    def max(self):
+        return self._ends[-1] - 1 if self._ends else None
+
+    def next_from(self, value):
+        """Smallest member >= ``value``, or None."""
+        k = bisect_right(self._starts, value) - 1
+        if k >= 0 and value < self._ends[k]:
+            return value
+        return self._starts[k + 1] if k + 1 < len(self._starts) else None
+
+
+def expand_ranges(msg):
+    """Parses '1,3,5-7' into an IntervalSet."""
+    intervals = []
+    for item in msg.split(','):
+        if '-' in item:
+            start, end = map(int, item.split('-'))
+            intervals.append((start, end + 1))
+        else:
+            n = int(item)
+            intervals.append((n, n + 1))
+    return IntervalSet(intervals)
+
+
+# --- Selection language ---
+#
+#   5  3-9  12/        entries by index; "12/" or "sub:12" is the subtree under 12
+#   *.flac  "Disc ?/*" glob on the name (case-insensitive)
+#   /live|demo/i       regex searched in the name
+#   .flac  ext:mp3     extension
+#   size>100M size<=2G size bounds (K, M, G, T are powers of 1024)
+#   type:file          only files (type:folder for folders and their subtrees)
+#   all                everything
+#   !term              exclude what term matches (indices, subtrees or names)
+#
+# Index and subtree terms pick the scope (default: everything); a folder's
+# index stands for its whole subtree. Name patterns are alternatives, size
+# and type filters must all hold. When any filter is given only the
+# matching files are selected.
+
+TOKEN_RE = re.compile(r'!?/(?:\\.|[^/])+/i?|!?"[^"]*"|[^,\s]+')
+RANGE_RE = re.compile(r'^(\d+)(?:-(\d+))?$')
+SUBTREE_RE = re.compile(r'^(?:sub:(\d+)|(\d+)/)$')
+SIZE_RE = re.compile(r'^size(<=|>=|<|>)(\d+(?:\.\d+)?)([KMGT]?)B?$', re.I)
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+class SelectionError(ValueError):
+    pass
+
+
+def parse_selection(text, index):
+    """Parses a selection against a FolderIndex and returns an IntervalSet of entries."""
+    n = len(index)
+    sizes = index.sizes
+    scope = []
+    excluded = []
+    patterns = []
+    excluded_patterns = []
+    checks = []
+    want_folders = False
+    filtered = False
+
+    def check_index(i):
+        if i >= n:
+            raise SelectionError(f"Index {i} is out of range (the listing has {n} entries)")
+        return i
+
+    for token in TOKEN_RE.findall(text):
+        negate = token.startswith("!")
+        if negate:
+            token = token[1:]
+        target = excluded if negate else scope
+        m = RANGE_RE.match(token)
+        if m:
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else start
+            if end < start:
+                raise SelectionError(f"Empty range {token}")
+            check_index(end)
+            target.append((start, end + 1))
+            continue
+        m = SUBTREE_RE.match(token)
+        if m:
+            i = check_index(int(m.group(1) or m.group(2)))
+            target.append((i, index.ends[i]))
+            continue
+        if token.lower() == "all":
+            target.append((0, n))
+            continue
+        m = SIZE_RE.match(token)
+        if m:
+            if negate:
+                raise SelectionError(f"Can't negate {token}; flip the comparison instead")
+            checks.append(_size_check(sizes, m.group(1), float(m.group(2)) * UNITS[m.group(3).upper()]))
+            filtered = True
+            continue
+        if token.lower().startswith("type:"):
+            kind = token[5:].lower()
+            if kind not in ("file", "folder"):
+                raise SelectionError(f"Unknown type {kind!r}, use type:file or type:folder")
+            want_folders = kind == "folder"
+            filtered = True
+            continue
+        matcher = _name_matcher(token)
+        if negate:
+            excluded_patterns.append(matcher)
+        else:
+            patterns.append(matcher)
+            filtered = True
+
+    if not scope and not filtered and not excluded and not excluded_patterns:
+        raise SelectionError("Nothing selected")
+    if filtered:
+        # Filters pick files unless type:folder asks for folders
+        checks.append((lambda i: sizes[i] < 0) if want_folders else (lambda i: sizes[i] >= 0))
+
+    selected = IntervalSet(_with_subtrees(index, scope)) if scope else IntervalSet([(0, n)])
+    if excluded:
+        selected = selected - IntervalSet(_with_subtrees(index, excluded))
+    if not (filtered or excluded_patterns):
+        return selected
+
+    def keep(i):
+        if not all(c(i) for c in checks):
+            return False
+        name = index.name(i)
+        if patterns and not any(p(name) for p in patterns):
+            return False
+        return not any(p(name) for p in excluded_patterns)
+
+    result = IntervalSet.from_sorted(i for i in selected if keep(i))
+    if want_folders:
+        # A folder stands for its whole subtree, like an index does
+        result = IntervalSet(_with_subtrees(index, list(result.intervals())))
+        if excluded:
+            result = result - IntervalSet(_with_subtrees(index, excluded))
+        if excluded_patterns:
+            result = IntervalSet.from_sorted(
+                i for i in result if not any(p(index.name(i)) for p in excluded_patterns)
+            )
+    return result
+
+
+def _with_subtrees(index, intervals):
+    """Extends index intervals so that every folder in them brings its subtree."""
+    sizes, ends = index.sizes, index.ends
+    extended = list(intervals)
+    for start, end in intervals:
+        for i in range(start, end):
+            if sizes[i] < 0 and ends[i] > end:
+                extended.append((i, ends[i]))
+    return extended
+
+
+def _size_check(sizes, op, bound):
+    # Folders have size -1 and never pass a size filter
+    if op == ">":
+        return lambda i: sizes[i] >= 0 and sizes[i] > bound
+    if op == ">=":
+        return lambda i: sizes[i] >= 0 and sizes[i] >= bound
+    if op == "<":
+        return lambda i: 0 <= sizes[i] < bound
+    return lambda i: 0 <= sizes[i] <= bound
+
+
+def _name_matcher(token):
+    if token.startswith('"') and token.endswith('"') and len(token) > 1:
+        token = token[1:-1]
+    if len(token) > 2 and token.startswith("/") and (token.endswith("/") or token.endswith("/i")):
+        flags = re.I if token.endswith("/i") else 0
+        body = token[1:-2] if flags else token[1:-1]
+        try:
+            regex = re.compile(body, flags)
+        except re.error as e:
+            raise SelectionError(f"Bad regex {token}: {e}")
+        return lambda name: regex.search(name) is not None
+    if token.lower().startswith("ext:"):
+        token = "." + token[4:]
+    if token.startswith(".") and not any(c in token for c in "*?["):
+        suffix = token.lower()
+        return lambda name: name.lower().endswith(suffix)
+    if any(c in token for c in "*?["):
+        pattern = token.lower()
+        return lambda name: fnmatchcase(name.lower(), pattern)
+    raise SelectionError(f"Don't know what {token!r} means")
+
+
+def selection_roots(index, selected):
+    """Reduces a selection to the fewest entries to download.
+
+    A selected folder whose descendants are all selected too is downloaded
+    as one folder transfer. Folders that weren't picked themselves are never
+    stood in for, so files matched by a filter download one by one however
+    many siblings they have (each under its ``relative_dir``); a folder
+    entry with only part of its subtree selected stands for nothing on its
+    own. Returns entry indices in listing order.
+    """
+    ends, parents, sizes = index.ends, index.parents, index.sizes
+    roots = []
+    i = selected.next_from(0)
+    while i is not None:
+        if sizes[i] < 0 and not selected.covers(i + 1, ends[i]):
+            i = selected.next_from(i + 1)
+            continue
+        root = i
+        parent = parents[i]
+        while parent >= 0 and parent in selected and selected.covers(parent + 1, ends[parent]):
+            root = parent
+            parent = parents[parent]
+        roots.append(root)
+        i = selected.next_from(ends[root])
+    return roots
+
+
+def relative_dir(index, i):
+    """The folders from the link root down to entry ``i``'s parent, joined with "/".
+
+    Roots are downloaded there under the target directory, so files picked
+    from different folders keep the layout of the link and can't collide.
+    Names that aren't usable as one path component are replaced.
+    """
+    names = []
+    parent = index.parents[i]
+    while parent >= 0:
+        name = index.name(parent).replace("/", "_").replace("\0", "_")
+        names.append("_" if name in ("", ".", "..") else name)
+        parent = index.parents[parent]
+    return "/".join(reversed(names))
+
+
+def summarize(index, selected):
+    """Returns (files, folders, total_bytes) of the selected entries."""
+    files = folders = total = 0
+    sizes = index.sizes
+    for start, end in selected.intervals():
+        for size in sizes[start:end]:
+            if size < 0:
+                folders += 1
+            else:
+                files += 1
+                total += size
+    return files, folders, total
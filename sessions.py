@@ -0,0 +1,49 @@
+import itertools
+
+
+class SessionRegistry:
+    """Open MegaSessions keyed by a short session id, indexed by chat.
+
+    A chat can have several sessions at once; each gets an id users pass to
+    /ls, /cancel and the buttons of its messages. Ids are never reused while
+    the bot runs.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._by_chat = {}
+        self._ids = itertools.count(1)
+
+    def add(self, session):
+        session.id = next(self._ids)
+        self._sessions[session.id] = session
+        self._by_chat.setdefault(session.chat_id, []).append(session)
+        return session.id
+
+    def remove(self, session):
+        if self._sessions.pop(getattr(session, "id", None), None) is None:
+            return
+        chat = self._by_chat.get(session.chat_id)
+        if chat is not None:
+            chat.remove(session)
+            if not chat:
+                del self._by_chat[session.chat_id]
+
+    def get(self, session_id, chat_id=None):
+        """Returns the session with ``session_id``, or None; with ``chat_id`` only if it belongs to that chat."""
+        session = self._sessions.get(session_id)
+        if session is None or (chat_id is not None and session.chat_id != chat_id):
+            return None
+        return session
+
+    def for_chat(self, chat_id):
+        """The chat's sessions, oldest first."""
+        return list(self._by_chat.get(chat_id, ()))
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session):
+        return self._sessions.get(getattr(session, "id", None)) is session
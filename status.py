@@ -0,0 +1,75 @@
+from utils import convert_size
+
+
+def format_transfers(transfers, finished, max_lines=20):
+    """Formats a session's transfer listeners for its status message.
+
+    Only unfinished transfers get a line of their own, up to ``max_lines``;
+    finished ones are summed up in a single line. Once the session is
+    ``finished`` only the failures are listed.
+    """
+    running = []
+    failures = []
+    done = 0
+    for tl in transfers:
+        if not tl.is_finished:
+            running.append(tl)
+        elif tl.error is None:
+            done += 1
+        else:
+            failures.append(tl)
+    summary = f"{done} done" + (f", {len(failures)} failed" if failures else "")
+    if finished:
+        text = "All downloads finished: " + summary
+        if failures:
+            text += _block(failures, max_lines, "failed")
+        return text
+
+    text = "Current downloads:" + _block(running, max_lines, "running")
+    if done or failures:
+        text += "\n" + summary
+    return text
+
+
+def format_jobs(jobs, finished, max_lines=20):
+    """Formats a session's post-processing jobs like ``format_transfers``; empty when there are none."""
+    if not jobs:
+        return ""
+    running = [job for job in jobs if not job.is_finished]
+    failures = [job for job in jobs if job.is_finished and job.error]
+    done = len(jobs) - len(running) - len(failures)
+    summary = f"{done} processed" + (f", {len(failures)} failed" if failures else "")
+    if finished or not running:
+        text = "\nPost-processing: " + summary
+        if failures:
+            text += _block(failures, max_lines, "failed")
+        return text
+    text = "\nPost-processing:" + _block(running, max_lines, "running")
+    if done or failures:
+        text += "\n" + summary
+    return text
+
+
+def _block(transfers, max_lines, what):
+    shown = transfers[:max_lines]
+    text = "\n```\n" + "\n".join(tl.getStatus_telegram() for tl in shown) + "\n```"
+    if len(transfers) > len(shown):
+        text += f"\n… {len(transfers) - len(shown)} more {what}"
+    return text
+
+
+def format_batch(resolved, failed, max_lines=20):
+    """Summarises a resolved batch: (name, size, is_folder) per link that worked, (link, error) per failure."""
+    total = sum(size for _, size, _ in resolved)
+    text = f"Resolved {len(resolved)} of {len(resolved) + len(failed)} links, {convert_size(total)} in total."
+    for name, size, is_folder in resolved[:max_lines]:
+        text += f"\n• {name}{'/' if is_folder else ''} ({convert_size(size)})"
+    if len(resolved) > max_lines:
+        text += f"\n… {len(resolved) - max_lines} more"
+    if failed:
+        text += f"\nFailed ({len(failed)}):"
+        for link, error in failed[:max_lines]:
+            text += f"\n• {link}: {error}"
+        if len(failed) > max_lines:
+            text += f"\n… {len(failed) - max_lines} more failed"
+    return text
@@ -0,0 +1,88 @@
+import pytest
+
+from bandwidth import UNLIMITED, BandwidthManager, ConnectionTuner, fair_shares, parse_rate, size_connections
+
+MB = 1024 ** 2
+
+
+class Transfer:
+    def __init__(self, speed, remaining=1024 * MB):
+        self.smooth_speed = speed
+        self.remaining = remaining
+        self.is_finished = False
+
+
+class Session:
+    def __init__(self, session_id, chat_id, speed=0):
+        self.id = session_id
+        self.chat_id = chat_id
+        self.paused = False
+        self.current_dls = [Transfer(speed)]
+        self.speed_limit = None
+        self.connections = None
+
+    def set_speed_limit(self, limit):
+        self.speed_limit = limit
+
+    def set_connections(self, connections):
+        self.connections = connections
+
+
+def test_parse_rate():
+    assert parse_rate("10M") == 10 * MB
+    assert parse_rate("1.5k") == 1536
+    assert parse_rate("512KB/s") == 512 * 1024
+    assert parse_rate("off") == 0
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_fair_shares():
+    assert fair_shares(90, {"a": 10, "b": UNLIMITED, "c": UNLIMITED}) == {"a": 10, "b": 40, "c": 40}
+    assert fair_shares(UNLIMITED, {"a": 10, "b": UNLIMITED}) == {"a": 10, "b": UNLIMITED}
+
+
+def test_size_connections():
+    assert size_connections(MB, 6) == 1
+    assert size_connections(8 * MB, 6) == 2
+    assert size_connections(1024 * MB, 6) == 6
+
+
+def test_tuner_keeps_a_connection_only_if_it_pays():
+    tuner = ConnectionTuner(connections=2, hold=2)
+    assert tuner.update(1024 * MB, 100, 6) == 3  # probe
+    assert tuner.update(1024 * MB, 101, 6) == 2  # no gain: taken back
+    assert tuner.update(1024 * MB, 100, 6) == 2  # holding
+    assert tuner.update(1024 * MB, 100, 6) == 2
+    assert tuner.update(1024 * MB, 100, 6) == 3  # probe again
+    assert tuner.update(1024 * MB, 150, 6) == 3  # faster: kept
+    assert tuner.update(1024 * MB, 150, 6) == 4  # and on to the next
+    assert tuner.update(MB, 150, 6) == 1  # a small file needs just one
+
+
+def test_global_limit_is_split_between_chats_then_sessions():
+    manager = BandwidthManager(global_limit=90 * MB, default_connections=2)
+    a1, a2, b = Session(1, 100), Session(2, 100), Session(3, 200)
+    manager.rebalance([a1, a2, b])
+    assert (a1.speed_limit, a2.speed_limit, b.speed_limit) == (int(22.5 * MB), int(22.5 * MB), 45 * MB)
+
+
+def test_chat_limit_and_idle_headroom():
+    manager = BandwidthManager(global_limit=100 * MB, chat_limit=30 * MB)
+    a, b = Session(1, 100), Session(2, 200)
+    manager.rebalance([a, b])
+    assert (a.speed_limit, b.speed_limit) == (30 * MB, 30 * MB)
+    a.current_dls[0].smooth_speed = 2 * MB  # well below its cap: keeps what it uses plus headroom
+    manager.rebalance([a, b])
+    assert a.speed_limit == 3 * MB
+    manager.rebalance([b])
+    assert manager.worker(a) is None
+
+
+def test_connection_budget_is_shared_per_transfer():
+    manager = BandwidthManager(max_connections=6, total_connections=8)
+    a, b = Session(1, 100), Session(2, 200)
+    a.current_dls += [Transfer(0), Transfer(0), Transfer(0)]
+    for _ in range(10):
+        manager.rebalance([a, b])
+    assert len(a.current_dls) * a.connections + len(b.current_dls) * b.connections <= 8
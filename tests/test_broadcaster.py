@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+from telegram.error import BadRequest, Forbidden  # noqa: E402
+
+from broadcaster import StatusBroadcaster  # noqa: E402
+
+
+class Bot:
+    def __init__(self, error=None):
+        self.error = error
+        self.edits = 0
+
+    async def edit_message_text(self, **kwargs):
+        self.edits += 1
+        if self.error is not None:
+            raise self.error
+
+
+def run(bot):
+    async def scenario():
+        broadcaster = StatusBroadcaster(interval=0.01)
+        done = asyncio.Event()
+
+        async def on_done():
+            done.set()
+        broadcaster.register(bot, 1, 2, lambda: ("downloading", None, False), on_done)
+        await asyncio.wait_for(done.wait(), 1)
+        return broadcaster
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("error", [Forbidden("Forbidden: bot was blocked by the user"),
+                                   BadRequest("Message to edit not found")])
+def test_message_that_cant_be_edited_is_dropped_and_finished(error):
+    bot = Bot(error)
+    broadcaster = run(bot)
+    assert bot.edits == 1
+    assert not broadcaster._messages
+
+
+def test_transient_errors_keep_the_message():
+    async def scenario():
+        broadcaster = StatusBroadcaster(interval=0.01)
+        bot = Bot(BadRequest("Message is too long"))
+        finished = []
+
+        async def on_done():
+            finished.append(True)
+        broadcaster.register(bot, 1, 2, lambda: (str(bot.edits), None, False), on_done)
+        await asyncio.sleep(0.2)  # a tick with an edit waits at least 1/rate
+        broadcaster.unregister(1, 2)
+        return bot, finished
+    bot, finished = asyncio.run(scenario())
+    assert bot.edits > 1 and not finished
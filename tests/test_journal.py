@@ -0,0 +1,26 @@
+import sqlite3
+
+from journal import Journal
+
+
+def test_sessions_keep_their_category(tmp_path):
+    journal = Journal(str(tmp_path / "journal.db"))
+    session_id = journal.open_session(1, "link", "/downloads", 2, "s")
+    journal.add_transfers(session_id, [(10, "/downloads/a"), (11, "/downloads/b")])
+    assert journal.unfinished_sessions() == [(session_id, 1, "link", "/downloads", 2, "s", None, None)]
+    assert sorted(journal.pending_transfers(session_id)) == [(10, "/downloads/a"), (11, "/downloads/b")]
+    journal.close()
+
+
+def test_older_journals_gain_the_category_column(tmp_path):
+    path = str(tmp_path / "journal.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE sessions (id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, link TEXT NOT NULL,"
+               " save_to TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, status_chat_id INTEGER,"
+               " status_message_id INTEGER, created REAL NOT NULL, closed INTEGER NOT NULL DEFAULT 0)")
+    db.execute("INSERT INTO sessions (chat_id, link, save_to, created) VALUES (1, 'link', '/downloads', 0)")
+    db.commit()
+    db.close()
+    journal = Journal(path)
+    assert journal.unfinished_sessions() == [(1, 1, "link", "/downloads", 0, "", None, None)]
+    journal.close()
@@ -0,0 +1,20 @@
+import asyncio
+
+from megapool import MegaApiPool
+from sdkcache import SdkCache
+
+LINK = "https://mega.nz/folder/abcdEFGH#key"
+
+
+def test_release_idles_the_worker_before_freeing_its_slot(tmp_path):
+    async def scenario():
+        pool = MegaApiPool("key", size=1, cache=SdkCache(str(tmp_path), 1 << 30, 1))
+        api, listener = await pool.acquire(5, LINK)
+        seen = []
+        release = pool._slots.release
+        pool._slots.release = lambda: (seen.append(list(pool._idle)), release())
+        await pool.release(api, listener)
+        return api, seen
+
+    api, seen = asyncio.run(scenario())
+    assert [[worker[0] for worker in idle] for idle in seen] == [[api]]
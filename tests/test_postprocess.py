@@ -0,0 +1,37 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from postprocess import ExtractStep, StepError, _safe_join
+
+
+def test_safe_join_accepts_archive_root_directory(tmp_path):
+    root = str(tmp_path)
+    assert _safe_join(root, ".", directory=True) == root
+    assert _safe_join(root, "./", directory=True) == root
+    assert _safe_join(root, "./a/b.txt") == os.path.join(root, "a", "b.txt")
+
+
+@pytest.mark.parametrize("member, directory", [
+    (".", False), ("../x", False), ("..", True), ("a/../../x", False), ("/etc/passwd", False),
+])
+def test_safe_join_rejects_escapes(tmp_path, member, directory):
+    with pytest.raises(StepError):
+        _safe_join(str(tmp_path), member, directory)
+
+
+def test_extracts_tarball_of_current_directory(tmp_path):
+    archive = tmp_path / "x.tgz"
+    with tarfile.open(archive, "w:gz") as tf:
+        root = tarfile.TarInfo(".")
+        root.type = tarfile.DIRTYPE
+        tf.addfile(root)
+        data = b"hello"
+        member = tarfile.TarInfo("./sub/hello.txt")
+        member.size = len(data)
+        tf.addfile(member, io.BytesIO(data))
+    result = ExtractStep(None).run([str(archive)], {}, lambda done, total: None)
+    assert result == [str(tmp_path / "x"), str(archive)]
+    assert (tmp_path / "x" / "sub" / "hello.txt").read_bytes() == b"hello"
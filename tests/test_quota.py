@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from quota import QuotaManager
+
+
+def run(scenario):
+    events = []
+
+    async def main():
+        manager = QuotaManager(base_backoff=0.05, max_backoff=0.4, jitter=0,
+                               on_pause=lambda: events.append("pause"), on_resume=lambda: events.append("resume"))
+        manager.bind(asyncio.get_running_loop())
+        await scenario(manager)
+    asyncio.run(main())
+    return events
+
+
+def test_pauses_once_and_resumes():
+    async def scenario(manager):
+        manager.report(0)
+        manager.report(0)  # another transfer hitting the same wait
+        assert manager.over_quota and 0 < manager.eta() <= 0.05
+        await asyncio.sleep(0.08)
+        assert not manager.over_quota and manager.eta() == 0
+    assert run(scenario) == ["pause", "resume"]
+
+
+def test_server_wait_extends_but_never_shortens():
+    async def scenario(manager):
+        manager.report(0.1)
+        manager.report(0.2)
+        assert manager.eta() == pytest.approx(0.2, abs=0.02)
+        manager.report(0.05)
+        assert manager.eta() == pytest.approx(0.2, abs=0.02)
+    assert run(scenario) == ["pause"]
+
+
+def test_backoff_doubles_up_to_the_cap():
+    async def scenario(manager):
+        waits = []
+        for _ in range(5):
+            manager.report(0)
+            waits.append(manager.eta())
+            manager._timer.cancel()
+            manager._resume()
+        assert [round(w, 2) for w in waits] == [0.05, 0.1, 0.2, 0.4, 0.4]
+    run(scenario)
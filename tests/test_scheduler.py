@@ -0,0 +1,68 @@
+import asyncio
+
+from scheduler import DownloadScheduler
+
+started = []  # (session name, node) in the order the scheduler started them
+
+
+class Session:
+    def __init__(self, chat_id, name):
+        self.chat_id = chat_id
+        self.name = name
+        self.backlog = []
+        self.paused = False
+        self.active = 0
+
+    async def start_download(self, node, save_to, on_finish=None):
+        started.append((self.name, node))
+        return True
+
+
+def run(scheduler, *submissions):
+    """Submits (session, node, priority) jobs and returns the order they started in."""
+    started.clear()
+
+    async def scenario():
+        for session, node, priority in submissions:
+            scheduler.submit(session, priority=priority, node=node)
+        await asyncio.sleep(0)
+        return list(started)
+    return asyncio.run(scenario())
+
+
+def test_global_and_per_chat_caps():
+    scheduler = DownloadScheduler(max_active=3, per_chat=2)
+    a, b = Session(1, "a"), Session(2, "b")
+    order = run(scheduler, *[(a, n, 0) for n in range(4)], (b, 0, 0))
+    assert order == [("a", 0), ("b", 0), ("a", 1)]
+    assert scheduler.active == 3 and scheduler.queued == 2
+
+
+def test_chats_take_turns():
+    scheduler = DownloadScheduler(max_active=4, per_chat=4)
+    a, b = Session(1, "a"), Session(2, "b")
+    order = run(scheduler, *[(a, n, 0) for n in range(3)], (b, 0, 0), (b, 1, 0))
+    assert order == [("a", 0), ("b", 0), ("a", 1), ("b", 1)]
+
+
+def test_better_priority_goes_first():
+    scheduler = DownloadScheduler(max_active=2, per_chat=2)
+    a, b = Session(1, "a"), Session(2, "b")
+    order = run(scheduler, (a, 0, 5), (a, 1, 5), (b, 0, -1), (b, 1, -1))
+    assert order == [("b", 0), ("b", 1)]
+
+
+def test_finished_starts_the_next_download():
+    scheduler = DownloadScheduler(max_active=1, per_chat=1)
+    a = Session(1, "a")
+    started.clear()
+
+    async def scenario():
+        scheduler.submit(a, node=0)
+        scheduler.submit(a, node=1)
+        await asyncio.sleep(0)
+        scheduler.finished(a)
+        await asyncio.sleep(0)
+    asyncio.run(scenario())
+    assert started == [("a", 0), ("a", 1)]
+    assert scheduler.active == 1 and a.active == 1
@@ -0,0 +1,83 @@
+import pytest
+
+import fakemega
+from fakemega import MegaNode
+from folderindex import build_index
+from selection import IntervalSet, SelectionError, parse_selection, relative_dir, selection_roots, summarize
+
+
+@pytest.fixture
+def index():
+    # 0 ./root
+    # 1   ./A
+    # 2     x.flac
+    # 3   ./B
+    # 4     y.txt
+    # 5     z.flac
+    # 6   ./C
+    # 7   top.flac
+    root = MegaNode("root", MegaNode.TYPE_FOLDER)
+    a = MegaNode("A", MegaNode.TYPE_FOLDER, parent=root)
+    MegaNode("x.flac", size=100, parent=a)
+    b = MegaNode("B", MegaNode.TYPE_FOLDER, parent=root)
+    MegaNode("y.txt", size=10, parent=b)
+    MegaNode("z.flac", size=200, parent=b)
+    MegaNode("C", MegaNode.TYPE_FOLDER, parent=root)
+    MegaNode("top.flac", size=300, parent=root)
+    return build_index(fakemega.MegaApi("test"), root)
+
+
+def roots(index, text):
+    return selection_roots(index, parse_selection(text, index))
+
+
+def test_interval_set_subtract():
+    assert list(IntervalSet([(0, 10)]) - IntervalSet([(2, 4), (6, 7)])) == [0, 1, 4, 5, 7, 8, 9]
+
+
+def test_single_file_downloads_flat(index):
+    # x.flac is A's only child, but A itself wasn't picked
+    assert roots(index, "2") == [2]
+
+
+def test_filtered_files_download_flat(index):
+    assert roots(index, "*.flac") == [2, 5, 7]
+    assert roots(index, ".flac size>150") == [5, 7]
+
+
+def test_selected_folder_becomes_one_transfer(index):
+    assert roots(index, "3/") == [3]
+    assert roots(index, "1-2") == [1]
+    assert roots(index, "all") == [0]
+
+
+def test_partly_selected_folder_keeps_its_files(index):
+    assert roots(index, "3/ !4") == [5]
+    assert roots(index, "4-5") == [4, 5]
+
+
+def test_type_folder_selects_subtrees(index):
+    assert roots(index, "type:folder") == [0]
+    selected = parse_selection("type:folder /^[AB]$/", index)
+    assert list(selected) == [1, 2, 3, 4, 5]
+    assert selection_roots(index, selected) == [1, 3]
+    assert summarize(index, selected) == (3, 2, 310)
+
+
+def test_type_folder_honours_exclusions(index):
+    assert roots(index, "type:folder /^[AB]$/ !*.txt") == [1, 5]
+    assert roots(index, "type:folder !3/") == [1, 6, 7]
+
+
+def test_errors(index):
+    with pytest.raises(SelectionError):
+        parse_selection("99", index)
+    with pytest.raises(SelectionError):
+        parse_selection("type:link", index)
+    with pytest.raises(SelectionError):
+        parse_selection("", index)
+
+
+def test_roots_keep_their_place_in_the_link(index):
+    assert [relative_dir(index, n) for n in roots(index, "*.flac")] == ["root/A", "root/B", "root"]
+    assert relative_dir(index, 0) == ""
@@ -0,0 +1,18 @@
+from metrics import DOWNLOADED_BYTES
+from transferlistener import TransferListener
+
+
+class Transfer:
+    def getFileName(self):
+        return "a.bin"
+
+
+def test_a_restarted_transfer_is_not_counted_twice():
+    listener = TransferListener()
+    listener.log_interval = float("inf")
+    before = DOWNLOADED_BYTES._values.get((), 0)
+    for transferred in (100, 300, 0, 200, 400):  # the SDK retried it from zero after 300 bytes
+        listener._progress(Transfer(), transferred, None)
+    assert DOWNLOADED_BYTES._values.get((), 0) - before == 400
+    assert listener.transfered_size == 400
+    assert listener.smooth_speed >= 0
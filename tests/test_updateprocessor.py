@@ -0,0 +1,36 @@
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("telegram")
+from telegram import Chat, Message, Update, User  # noqa: E402
+
+from updateprocessor import ChatSerialUpdateProcessor  # noqa: E402
+
+
+def update(update_id, chat_id):
+    message = Message(update_id, datetime.datetime.now(), Chat(chat_id, "private"), from_user=User(1, "u", False))
+    return Update(update_id, message=message)
+
+
+def test_one_update_per_chat_and_at_most_max_running():
+    processor = ChatSerialUpdateProcessor(2)
+    started = []
+    running = 0
+
+    async def handle(update_id):
+        nonlocal running
+        running += 1
+        started.append((update_id, running))
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def scenario():
+        chats = [(1, 1), (2, 1), (3, 1), (4, 2), (5, 3)]
+        await asyncio.gather(*(processor.process_update(update(i, c), handle(i)) for i, c in chats))
+    asyncio.run(scenario())
+    order = [update_id for update_id, _ in started]
+    assert order.index(1) < order.index(2) < order.index(3)
+    assert max(n for _, n in started) == 2
+    assert not processor._chats and processor.current_concurrent_updates == 0
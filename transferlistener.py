@@ -1,9 +1,24 @@
 import logging
+import math
+import time
 from mega import (MegaTransferListener, MegaError)
 
+from metrics import DOWNLOADED_BYTES, OVER_QUOTA_EVENTS
+
 
 class TransferListener(MegaTransferListener):
-    def __init__(self):
+    # Progress callbacks arrive many times per second per transfer on the SDK
+    # thread, so progress is only logged every ``log_interval`` seconds. Both
+    # knobs are set from megabot's settings.
+    log_interval = 30
+    log_level = logging.DEBUG
+    speed_window = 5  # seconds; time constant of the smoothed speed
+    on_over_quota = None  # called with the server's wait in seconds; set by megabot
+
+    def __init__(self, on_finish=None, handle=None):
+        self.handle = handle  # node handle, used to journal progress
+        self.on_finish = on_finish  # called from the SDK thread once the transfer ends
+        self.reused = False  # satisfied from a copy already on disk
         self.is_finished = False
         self.over_quota = False
         self.error = None
@@ -12,14 +27,34 @@ class TransferListener(MegaTransferListener):
         self.speed = 0
         self.smooth_speed = 0
         self.transfered_size = 0
+        self._last_update = None
+        self._last_bytes = 0
+        self._next_log = 0
         super(TransferListener, self).__init__()
 
-    def onTransferStart(self, api, transfer):
-        filename = transfer.getFileName()
+    @classmethod
+    def already_downloaded(cls, filename, size, handle=None):
+        """Returns a finished listener for a file that didn't need a transfer."""
+        listener = cls(handle=handle)
+        listener.set_name(filename)
+        listener.reused = True
+        listener.is_finished = True
+        listener.total_size = listener.transfered_size = size
+        return listener
+
+    @property
+    def remaining(self):
+        """Bytes still to download."""
+        return max(0, self.total_size - self.transfered_size)
+
+    def set_name(self, filename):
         if len(filename) > 24:
             self.transfer_name = filename[:21] + '...'
         else:
             self.transfer_name = filename + ' ' * (21 - len(filename))
+
+    def onTransferStart(self, api, transfer):
+        self.set_name(transfer.getFileName())
         self.total_size = transfer.getTotalBytes()
         if self.total_size == 0:
              self.total_size = 1 # Avoid divide by zero
@@ -32,6 +67,10 @@ class TransferListener(MegaTransferListener):
         self.speed = transfer.getMeanSpeed()
         logging.info('Transfer finished ({}); Result: {}'
                      .format(transfer, transfer.getFileName(), error))
+        # Files inside a folder download report their own finish; only the
+        # top-level transfer frees the scheduler slot
+        if self.on_finish is not None and transfer.getFolderTransferTag() <= 0:
+            self.on_finish()
 
     def onTransferTemporaryError(self, api, transfer, error):
         try:
@@ -39,12 +78,14 @@ class TransferListener(MegaTransferListener):
             logging.info('Transfer temporary error ({} {}); Error: {}'
                          .format(transfer, transfer.getFileName(), error))
             if error.getErrorCode() == MegaError.API_EINCOMPLETE:
-                logging.info('Download incomplete, retrying...')
-                #api.retryTransfer(transfer)
-            if error.getErrorCode() == MegaError.API_EOVERQUOTA:
+                logging.info('Download incomplete, the SDK will retry')
+            elif error.getErrorCode() == MegaError.API_EOVERQUOTA:
+                # The SDK retries by itself; the quota manager pauses every
+                # transfer until the server-reported wait is over
                 self.over_quota = True
-                logging.info('Download incomplete, retrying...')
-                #api.retryTransfer(transfer)
+                OVER_QUOTA_EVENTS.inc()
+                if self.on_over_quota is not None:
+                    self.on_over_quota(max(0, error.getValue()))
             else:
                 logging.warning(f'Unhandled error code: {error}')
         except Exception as e:
@@ -52,16 +93,37 @@ class TransferListener(MegaTransferListener):
             logging.debug(f"Error object: {error}, Type: {type(error)}")
 
     def onTransferUpdate(self, api, transfer):
-        self.speed = transfer.getSpeed()
-        self.smooth_speed = self.speed * 0.02 + self.smooth_speed * 0.98
-        self.transfered_size = max(self.transfered_size, transfer.getTransferredBytes())
-        logging.info('Transfer update ({} {});'
-                     ' Progress: {} KB of {} KB, {} KB/s'
-                     .format(transfer,
-                             transfer.getFileName(),
-                             transfer.getTransferredBytes() / 1024,
-                             transfer.getTotalBytes() / 1024,
-                             transfer.getSpeed() / 1024))
+        self._progress(transfer, transfer.getTransferredBytes(), transfer.getSpeed())
+
+    def _progress(self, transfer, transferred, speed):
+        """Records ``transferred`` bytes so far; ``speed`` None means use the smoothed rate."""
+        now = time.monotonic()
+        last = self._last_update
+        if last is None:
+            self.smooth_speed = speed or 0
+        elif now > last:
+            # Time-weighted EWMA: the smoothing no longer depends on how often
+            # the SDK happens to call back
+            # A transfer the SDK restarts goes back to fewer bytes; that's no negative speed
+            rate = max(0, transferred - self._last_bytes) / (now - last)
+            self.smooth_speed += (1 - math.exp((last - now) / self.speed_window)) * (rate - self.smooth_speed)
+        self.speed = self.smooth_speed if speed is None else speed
+        self._last_update = now
+        self._last_bytes = transferred
+        if transferred > self.transfered_size:
+            # Only bytes past the furthest point so far count, so a retried transfer isn't counted twice
+            DOWNLOADED_BYTES.inc(transferred - self.transfered_size)
+            self.transfered_size = transferred
+            if self.error is not None:
+                # Data is flowing again after a temporary error
+                self.error = None
+                self.over_quota = False
+        if now >= self._next_log:
+            self._next_log = now + self.log_interval
+            if logging.root.isEnabledFor(self.log_level):
+                logging.log(self.log_level, 'Transfer update (%s); Progress: %d KB of %d KB, %d KB/s',
+                            transfer.getFileName(), transferred // 1024,
+                            self.total_size // 1024, self.speed // 1024)
 
     # --- ORIGINAL getStatus ---
     # This is left in case you need it, but the bot will use getStatus_telegram
@@ -86,6 +148,8 @@ class TransferListener(MegaTransferListener):
         """Returns a status string safe for Telegram (no ANSI codes)."""
         if self.error:
             return f'{self.transfer_name}: ERROR: {self.error}'
+        if self.reused:
+            return f"{self.transfer_name} Already downloaded"
         if self.is_finished:
             return f"{self.transfer_name} Done. Avg: {self.speed/(1024*1024):0.2f} MB/s"
         
@@ -102,3 +166,53 @@ class TransferListener(MegaTransferListener):
             
         speed_mb = self.speed / (1024 * 1024)
         return f"{self.transfer_name} {speed_mb:0.2f} MB/s [{progress_bar}] {int(progress*100)}% Est: {time_str}"
+
+
+class FolderTransferListener(TransferListener):
+    """Listener for one whole-folder download.
+
+    The SDK reports the folder transfer and every file inside it to the same
+    listener. Bytes are summed over the files so the folder shows up as a
+    single status line, and only the folder transfer's own finish ends it.
+    """
+    def __init__(self, total_size, on_finish=None, handle=None):
+        super(FolderTransferListener, self).__init__(on_finish, handle)
+        self.total_size = total_size or 1 # Avoid divide by zero
+        self._file_bytes = {}  # tag -> bytes of files still in flight
+        self._sum = 0  # bytes of finished files plus those in flight
+        self.files_done = 0
+        self.files_failed = 0
+
+    def onTransferStart(self, api, transfer):
+        if transfer.getFolderTransferTag() <= 0:
+            self.set_name(transfer.getFileName())
+            logging.info('Folder transfer start ({})'.format(transfer.getFileName()))
+
+    def onTransferUpdate(self, api, transfer):
+        if transfer.getFolderTransferTag() > 0:
+            tag = transfer.getTag()
+            transferred = transfer.getTransferredBytes()
+            self._sum += transferred - self._file_bytes.get(tag, 0)
+            self._file_bytes[tag] = transferred
+            self._progress(transfer, self._sum, None)
+        else:
+            self._progress(transfer, max(self._sum, transfer.getTransferredBytes()), None)
+
+    def onTransferFinish(self, api, transfer, error):
+        if transfer.getFolderTransferTag() <= 0:
+            self.transfered_size = max(self.transfered_size, self._sum)
+            super(FolderTransferListener, self).onTransferFinish(api, transfer, error)
+            return
+        tag = transfer.getTag()
+        self._sum += transfer.getTransferredBytes() - self._file_bytes.pop(tag, 0)
+        if error.getErrorCode() == MegaError.API_OK:
+            self.files_done += 1
+        else:
+            self.files_failed += 1
+            logging.info('File in folder transfer failed ({}); Result: {}'
+                         .format(transfer.getFileName(), error.toString()))
+
+    def getStatus_telegram(self, size=15):
+        status = super(FolderTransferListener, self).getStatus_telegram(size)
+        files = f" ({self.files_done} files" + (f", {self.files_failed} failed)" if self.files_failed else ")")
+        return status + files
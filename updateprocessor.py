@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import UPDATE_SECONDS
+
+
+class ChatSerialUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to ``max_running`` updates at once, one at a time per chat.
+
+    Updates from different chats are handled concurrently, while those from
+    the same chat keep their order, so a conversation never sees two of its
+    steps at the same time. An update only takes a slot once it is its
+    chat's turn, so a busy chat can't fill every slot with waiting updates.
+
+    PTB's ``max_concurrent_updates`` bounds the updates taken in, waiting
+    for their chat included; ``max_pending`` sets it and should stay well
+    above ``max_running``.
+    """
+    def __init__(self, max_running, max_pending=1024):
+        super().__init__(max(max_running, max_pending))
+        self.max_running = max_running
+        self._slots = asyncio.Semaphore(max_running)
+        self._chats = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        started = time.monotonic()
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            try:
+                async with self._slots:
+                    await coroutine
+            finally:
+                UPDATE_SECONDS.observe(time.monotonic() - started)
+            return
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+            UPDATE_SECONDS.observe(time.monotonic() - started)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,24 @@
+import math
+import re
+
+
+def convert_size(size_bytes):
+    if size_bytes == 0:
+        return "0B"
+    size_name = ("B", "KB", "MB", "GB", "TB", "PB")
+    i = int(math.floor(math.log(size_bytes, 1024)))
+    p = math.pow(1024, i)
+    s = round(size_bytes / p, 2)
+    return "%s %s" % (s, size_name[i])
+
+
+def parse_size(text):
+    """Parses a size such as '10G', '512M' or a plain number of bytes."""
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', text, re.I)
+    if m is None:
+        raise ValueError(f"'{text}' is not a size (e.g. 10G, 512M)")
+    return int(float(m.group(1)) * 1024 ** " KMGT".index(m.group(2).upper() or " "))
+
+
+def is_folder_link(link):
+    return any(f in link for f in ["folder", "#F!"])
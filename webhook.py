@@ -0,0 +1,72 @@
+import asyncio
+import hmac
+import json
+import logging
+import time
+
+from telegram import Update
+
+from metrics import WEBHOOK_REQUESTS
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class Webhook:
+    """Receives Telegram updates on the bot's HTTPServer instead of polling.
+
+    Deliveries must carry the secret token passed to setWebhook. Accepted
+    updates go into the Application's update queue just like polled ones.
+    While more than ``max_pending`` are waiting, or once draining has
+    started, the server answers 503 and Telegram delivers them again later.
+    """
+    def __init__(self, application, path, secret, max_pending=1000):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.max_pending = max_pending
+        self._draining = False
+
+    def attach(self, http_server):
+        http_server.route("POST", self.path, self._receive)
+
+    async def register(self, url, max_connections=40, certificate=None):
+        """Points Telegram at ``url``; updates queued while the bot was down are delivered there."""
+        await self.application.bot.set_webhook(
+            url=url,
+            secret_token=self.secret.decode(),
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+            certificate=certificate,
+        )
+        logging.info(f"Webhook set to {url}")
+
+    async def _receive(self, request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), self.secret):
+            WEBHOOK_REQUESTS.inc(1, "forbidden")
+            return 403, "text/plain", "forbidden\n"
+        if self._draining:
+            WEBHOOK_REQUESTS.inc(1, "draining")
+            return 503, "text/plain", "shutting down\n"
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_pending:
+            WEBHOOK_REQUESTS.inc(1, "busy")
+            return 503, "text/plain", "busy\n"
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Rejected malformed webhook update: {e}")
+            WEBHOOK_REQUESTS.inc(1, "bad_request")
+            return 400, "text/plain", "bad update\n"
+        await queue.put(update)
+        WEBHOOK_REQUESTS.inc(1, "ok")
+        return 200, "text/plain", ""
+
+    async def drain(self, timeout=30):
+        """Turns new deliveries away and waits up to ``timeout`` for queued updates to be picked up."""
+        self._draining = True
+        queue = self.application.update_queue
+        deadline = time.monotonic() + timeout
+        while queue.qsize() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if queue.qsize():
+            logging.warning(f"{queue.qsize()} webhook updates still queued after {timeout}s")
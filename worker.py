@@ -0,0 +1,257 @@
+"""Download worker for megabot's remote worker mode.
+
+    FRONTEND_URL=http://bot-host:8000 WORKER_TOKEN=... API_KEY=... python worker.py
+
+Polls the front-end's /workers/poll endpoint for queued downloads, runs
+each on a MegaApi of its own and reports progress back on the next poll.
+Start as many as needed, on any host that mounts the downloads volume at
+the same path as the front-end. On SIGTERM a worker gives its unfinished
+jobs back to the queue.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import ssl
+import time
+import urllib.request
+
+from mega import MegaNode, MegaRequest, MegaTransfer
+
+from jobqueue import POLL_PATH, TOKEN_HEADER, QUEUED, RUNNING, DONE, FAILED
+from megapool import MegaApiPool, PoolExhausted
+from requestlistener import RequestError
+from sdkcache import SdkCache
+from transferlistener import TransferListener, FolderTransferListener
+from utils import is_folder_link, parse_size
+
+FRONTEND_URL = os.getenv("FRONTEND_URL")  # base URL of the bot's HTTP server
+FRONTEND_CA_FILE = os.getenv("FRONTEND_CA_FILE")  # to trust a self-signed HTTP_TLS_CERT
+WORKER_TOKEN = os.getenv("WORKER_TOKEN")  # same as the front-end's
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_SLOTS = int(os.getenv("WORKER_SLOTS", "4"))  # downloads at once, one MegaApi each
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))  # seconds between progress reports
+API_KEY = os.getenv("API_KEY")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "300"))  # seconds per SDK request
+MEGA_POOL_IDLE_TIMEOUT = float(os.getenv("MEGA_POOL_IDLE_TIMEOUT", "300"))  # seconds
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+SDK_CACHE_DIR = os.getenv("SDK_CACHE_DIR")  # keep it on local disk; DATA_DIR/sdkcache by default
+SDK_CACHE_MAX_SIZE = parse_size(os.getenv("SDK_CACHE_MAX_SIZE", "10G"))  # 0 disables the cache
+SDK_CACHE_SLOTS = int(os.getenv("SDK_CACHE_SLOTS", "2"))
+SDK_CACHE_EVICT_INTERVAL = float(os.getenv("SDK_CACHE_EVICT_INTERVAL", "600"))  # seconds
+
+
+class Job:
+    """One claimed download and the MegaApi running it."""
+    __slots__ = ("id", "link", "handle", "save_to", "state", "error", "api", "listener", "transfer",
+                 "controls", "applied", "task", "done")
+
+    def __init__(self, spec):
+        self.id = spec["id"]
+        self.link = spec["link"]
+        self.handle = spec["handle"]
+        self.save_to = spec["save_to"]
+        self.state = RUNNING
+        self.error = None
+        self.api = None
+        self.listener = None
+        self.transfer = None
+        self.controls = {}  # wanted by the front-end
+        self.applied = {}  # last set on the MegaApi
+        self.task = None
+        self.done = asyncio.Event()
+
+    def report(self):
+        row = {"id": self.id, "state": self.state}
+        t = self.transfer
+        if t is not None:
+            row.update(transferred=t.transfered_size, total=t.total_size, speed=t.speed,
+                       smooth_speed=t.smooth_speed, over_quota=t.over_quota, error=t.error)
+            if isinstance(t, FolderTransferListener):
+                row.update(files_done=t.files_done, files_failed=t.files_failed)
+        if self.state != RUNNING:
+            row["error"] = self.error
+        return row
+
+
+class Worker:
+    """Claims jobs from the front-end and runs them on a pool of MegaApi instances."""
+    def __init__(self, url, token, worker_id, pool, interval=2, timeout=300, ssl_context=None):
+        self.url = url.rstrip("/") + POLL_PATH
+        self.token = token
+        self.worker_id = worker_id
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.jobs = {}  # job id -> Job
+        self._over_quota_wait = None
+        self._wake = asyncio.Event()
+        TransferListener.on_over_quota = self._over_quota
+
+    def _over_quota(self, wait):
+        # SDK thread; the next poll passes it on to the front-end's quota manager
+        self._over_quota_wait = max(wait, self._over_quota_wait or 0)
+
+    def _post(self, payload):
+        request = urllib.request.Request(self.url, json.dumps(payload).encode(),
+                                         {"Content-Type": "application/json", TOKEN_HEADER: self.token})
+        with urllib.request.urlopen(request, timeout=30, context=self.ssl_context) as response:
+            return json.loads(response.read())
+
+    async def poll(self, claim=True):
+        """Reports every job and takes on new ones; returns False if the front-end couldn't be reached."""
+        running = sum(1 for job in self.jobs.values() if job.state == RUNNING)
+        reported = list(self.jobs.values())
+        wait, self._over_quota_wait = self._over_quota_wait, None
+        payload = {"worker": self.worker_id, "jobs": [job.report() for job in reported],
+                   "free": max(0, self.pool.size - running) if claim else 0, "over_quota_wait": wait}
+        try:
+            answer = await asyncio.to_thread(self._post, payload)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Couldn't reach the front-end: {e}")
+            self._over_quota_wait = wait
+            return False
+        for job in reported:
+            if job.state != RUNNING:
+                del self.jobs[job.id]  # its end has been reported
+        for job_id, controls in answer.get("controls", {}).items():
+            job = self.jobs.get(int(job_id))
+            if job is not None:
+                job.controls = controls
+                self._apply(job)
+        for spec in answer.get("jobs", []):
+            if spec["id"] in self.jobs:
+                continue
+            job = self.jobs[spec["id"]] = Job(spec)
+            job.task = asyncio.create_task(self._run(job))
+        return True
+
+    def _apply(self, job):
+        """Sets what the front-end asked for on the job's MegaApi, once it has one."""
+        if job.api is None or job.state != RUNNING:
+            return
+        if job.controls.get("cancel"):
+            logging.info(f"Job {job.id} was cancelled")
+            job.api.cancelTransfers(MegaTransfer.TYPE_DOWNLOAD)
+            return
+        for name, value in job.controls.items():
+            if job.applied.get(name) == value:
+                continue
+            if name == "paused":
+                job.api.pauseTransfers(bool(value))
+            elif name == "speed_limit":
+                job.api.setMaxDownloadSpeed(value or 0)
+            elif name == "connections" and value:
+                job.api.setMaxConnections(MegaTransfer.TYPE_DOWNLOAD, value)
+            job.applied[name] = value
+
+    async def _request(self, job, start, request_type):
+        future = job.listener.expect(request_type)
+        start(job.listener)
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def _resolve(self, job):
+        """Looks the job's node up: a public file, or a node of a folder link after logging in."""
+        if not is_folder_link(job.link):
+            return await self._request(job, lambda l: job.api.getPublicNode(job.link, l),
+                                       MegaRequest.TYPE_GET_PUBLIC_NODE)
+
+        def login(listener):
+            if self.pool.cache_state(job.api) != "warm":
+                job.api.loginToFolder(job.link, listener)
+                return
+            try:
+                job.api.loginToFolder(job.link, listener, True)
+            except (TypeError, NotImplementedError):
+                job.api.loginToFolder(job.link, listener)
+        await self._request(job, login, MegaRequest.TYPE_LOGIN)
+        await self._request(job, job.api.fetchNodes, MegaRequest.TYPE_FETCH_NODES)
+        return job.api.getNodeByHandle(job.handle)
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+
+        def finished():
+            loop.call_soon_threadsafe(job.done.set)
+        try:
+            job.api, job.listener = await self.pool.acquire(self.timeout, job.link if is_folder_link(job.link) else None)
+            try:
+                node = await self._resolve(job)
+                if node is None:
+                    raise LookupError("node not found")
+                if job.controls.get("cancel"):
+                    job.state, job.error = FAILED, "Cancelled"
+                    return
+                target = job.save_to + "/" + node.getName()
+                if node.getType() == MegaNode.TYPE_FILE:
+                    job.transfer = TransferListener(on_finish=finished, handle=job.handle)
+                else:
+                    job.transfer = FolderTransferListener(job.api.getSize(node), on_finish=finished, handle=job.handle)
+                self._apply(job)
+                job.api.startDownload(node, target, job.transfer)
+                await job.done.wait()
+                job.error = job.transfer.error
+                job.state = FAILED if job.error else DONE
+            finally:
+                await self.pool.release(job.api, job.listener)
+        except asyncio.CancelledError:
+            job.state = QUEUED  # given back to the queue for another worker
+            raise
+        except (RequestError, PoolExhausted, asyncio.TimeoutError, LookupError) as e:
+            job.state, job.error = FAILED, str(e) or "request timed out"
+        except Exception as e:
+            logging.exception(f"Job {job.id} failed")
+            job.state, job.error = FAILED, str(e) or type(e).__name__
+        finally:
+            job.api = None
+            logging.info(f"Job {job.id} {job.state}" + (f": {job.error}" if job.error else ""))
+            self._wake.set()
+
+    async def run(self, stop, cache=None, evict_interval=600):
+        """Polls until ``stop`` is set, then gives unfinished jobs back."""
+        logging.info(f"Worker {self.worker_id} polling {self.url} with {self.pool.size} slots")
+        next_evict = time.monotonic()
+        while not stop.is_set():
+            await self.poll()
+            self.pool.reap()
+            if cache is not None and time.monotonic() >= next_evict:
+                next_evict = time.monotonic() + evict_interval
+                await asyncio.to_thread(cache.evict)
+            self._wake.clear()
+            waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(self._wake.wait())]
+            await asyncio.wait(waiters, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            logging.info(f"Giving {len(tasks)} unfinished job(s) back")
+        await self.poll(claim=False)
+
+
+async def main():
+    if not (FRONTEND_URL and WORKER_TOKEN):
+        raise SystemExit("Set FRONTEND_URL and WORKER_TOKEN")
+    sdk_cache = None
+    if SDK_CACHE_MAX_SIZE > 0:
+        sdk_cache = SdkCache(SDK_CACHE_DIR or os.path.join(DATA_DIR, "sdkcache"), SDK_CACHE_MAX_SIZE, SDK_CACHE_SLOTS)
+    pool = MegaApiPool(API_KEY, WORKER_SLOTS, MEGA_POOL_IDLE_TIMEOUT, cache=sdk_cache)
+    ssl_context = ssl.create_default_context(cafile=FRONTEND_CA_FILE) if FRONTEND_CA_FILE else None
+    worker = Worker(FRONTEND_URL, WORKER_TOKEN, WORKER_ID, pool, WORKER_POLL_INTERVAL, REQUEST_TIMEOUT, ssl_context)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await worker.run(stop, sdk_cache, SDK_CACHE_EVICT_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s\t%(asctime)s %(message)s")
+    asyncio.run(main())